@@ -3,13 +3,30 @@ import re
 import json
 import time
 import threading
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set
 from openai import OpenAI
-from config import DEEPSEEK_API_KEY
+import config  # noqa: F401 - 加载 .env 并校验必需的 API key，需先于读取环境变量的模块导入
 from multi_mcp_client import MultiMCPClient
+from llm_client import LLM_MODEL, ModelClient, get_model_client
+import cancellation
+import deadline
+import tool_compressor
+import tracing
+from speculation import SPECULATE_ENABLED, Speculation, get_speculator
+from tool_router import TOOL_EXPANSIONS, get_tool_router
 
 # 每轮最多允许的工具调用次数，超出将被截断以避免重复浪费
 MAX_TOOL_CALLS_PER_ROUND = 3
+# 请求剩余时限不足该秒数时，不再调用工具，改为最后一轮「基于已有信息作答」
+FINAL_ROUND_RESERVE = float(os.getenv("AGENT_FINAL_ROUND_RESERVE", "8"))
+# 预留时间不超过总时限的该比例，时限较短的请求仍能先调用工具
+FINAL_ROUND_RESERVE_RATIO = float(os.getenv("AGENT_FINAL_ROUND_RESERVE_RATIO", "0.25"))
+# 设置后本地工具改为连接常驻的 streamable HTTP MCP server（python mcp_server.py --transport http），如 http://127.0.0.1:8765/mcp/
+LOCAL_MCP_URL = os.getenv("LOCAL_MCP_URL", "")
+FINAL_ROUND_PROMPT = (
+    "（系统提示）本次请求的时间预算即将用完，请不要再调用任何工具，只基于上文已有的 <observation> 直接给出 <final_answer>；"
+    "信息不足时如实说明还缺什么。"
+)
 
 SYSTEM_PROMPT = """
 你是一个可靠的智能助手，需要用“思考→行动→观察→总结”的 ReAct 流程解决问题。
@@ -113,40 +130,58 @@ SYSTEM_PROMPT = """
 """
 
 
+def _final_round_reserve() -> float:
+    """最后一轮的预留时间：FINAL_ROUND_RESERVE，且不超过总时限的 FINAL_ROUND_RESERVE_RATIO。"""
+    dl = deadline.current()
+    if dl is None:
+        return FINAL_ROUND_RESERVE
+    return min(FINAL_ROUND_RESERVE, dl.timeout * FINAL_ROUND_RESERVE_RATIO)
+
+
+def default_mcp_servers() -> List[Dict[str, Any]]:
+    """默认接入的 MCP server：本地工具、fetch 与高德地图。"""
+    local = {"name": "local", "url": LOCAL_MCP_URL} if LOCAL_MCP_URL else {"name": "local", "command": "python", "args": ["mcp_server.py"]}
+    return [
+        local,
+        {
+            "name": "fetch",
+            "command": "uvx",
+            "args": ["mcp-server-fetch"],
+            # 使用项目内可写缓存目录，避免 ~/.cache/uv 权限/锁问题
+            "env": {"UV_CACHE_DIR": "/Users/wangluyao/Desktop/myagentbymcp/.uv-cache"},
+        },
+        {
+            "name": "amap",
+            "command": "npx",
+            "args": ["-y", "@amap/amap-maps-mcp-server"],
+            # 从环境变量读取高德 Key，需在启动前 source .env
+            "env": {"AMAP_MAPS_API_KEY": os.getenv("AMAP_MAPS_API_KEY", "")},
+        },
+    ]
+
+
 class Agent:
     def __init__(
         self,
-        client: OpenAI,
-        model: str = "deepseek-chat",
+        client: OpenAI | ModelClient,
+        model: str = LLM_MODEL,
         mcp_client: Optional[MultiMCPClient] = None,
         tool_call_timeout: int = 20,
         verbose: bool = False,
         max_rounds: int = 10,
     ):
         self.client = client
+        # 统一经由 ModelClient 调用模型（重试、对冲、延迟与 token 指标）
+        self.llm = client if isinstance(client, ModelClient) else ModelClient(client=client, model=model)
         # 默认接入本地 MCP server 和外部 fetch server
-        self.mcp_client = mcp_client or MultiMCPClient(
-            servers=[
-                {"name": "local", "command": "python", "args": ["mcp_server.py"]},
-                {
-                    "name": "fetch",
-                    "command": "uvx",
-                    "args": ["mcp-server-fetch"],
-                    # 使用项目内可写缓存目录，避免 ~/.cache/uv 权限/锁问题
-                    "env": {"UV_CACHE_DIR": "/Users/wangluyao/Desktop/myagentbymcp/.uv-cache"},
-                },
-                {
-                    "name": "amap",
-                    "command": "npx",
-                    "args": ["-y", "@amap/amap-maps-mcp-server"],
-                    # 从环境变量读取高德 Key，需在启动前 source .env
-                    "env": {"AMAP_MAPS_API_KEY": os.getenv("AMAP_MAPS_API_KEY", "")},
-                },
-            ]
-        )
+        self.mcp_client = mcp_client or MultiMCPClient(servers=default_mcp_servers())
         self.tool_call_timeout = tool_call_timeout
         # 预取 MCP 工具 schema，失败自动重试以避免空列表
         self.tools_schema = self._fetch_tools_with_retry()
+        # 按问题挑选每轮发送的工具子集；TOOL_ROUTER=0 时为 None（发送完整列表）
+        self.tool_router = get_tool_router()
+        # 本会话已发送或调用过的工具，只增不减：后续轮次工具列表不变时请求前缀逐字节一致，可命中上下文缓存
+        self.sticky_tools: Set[str] = set()
         self.model = model
         self.messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
@@ -175,17 +210,62 @@ class Agent:
             self.tools_schema = self._fetch_tools_with_retry()
         return self.tools_schema
 
-    def handle_tool_call(self, tool_call):
-        # 处理工具调用
+    def select_tools(self, prompt: str) -> List[Dict[str, Any]]:
+        """本轮对话发给模型的工具：常驻 + 本会话发送过的 + 与问题最相关的 top_k（按名称排序）。"""
+        tools = self.get_tool_schema()
+        if self.tool_router is None:
+            return tools
+        selected, saved = self.tool_router.select(tools, prompt, self.sticky_tools)
+        self.sticky_tools.update(t["function"]["name"] for t in selected)
+        span = tracing.current_span()
+        if span is not None:
+            span.set_attributes(tools_selected=len(selected), tools_total=len(tools), tool_tokens_saved=saved)
+        if self.verbose and saved:
+            print(f"🧰 本轮发送 {len(selected)}/{len(tools)} 个工具，约省 {saved} tokens")
+        return selected
+
+    def _resolve_tool_name(self, name: str) -> str:
+        """文本中的工具名可能不带 server 前缀，按后缀匹配真实的工具名。"""
+        for tool in self.get_tool_schema():
+            full = tool["function"]["name"]
+            if full == name or full.endswith(f"__{name}"):
+                return full
+        return name
+
+    def _expand_tools(self, turn_tools: List[Dict[str, Any]], names: List[str]) -> List[Dict[str, Any]]:
+        """模型请求了子集之外的工具：存在的加入子集并记为粘性，不存在的（可能因子集过小而臆造）改发完整列表。"""
+        all_tools = self.get_tool_schema()
+        by_name = {t["function"]["name"]: t for t in all_tools}
+        current = {t["function"]["name"] for t in turn_tools}
+        for name in names:
+            if name in by_name:
+                self.sticky_tools.add(name)
+        missing = [n for n in names if n not in current]
+        if not missing:
+            return turn_tools
+        if any(n not in by_name for n in missing):
+            TOOL_EXPANSIONS.inc(kind="unknown")
+            return all_tools
+        TOOL_EXPANSIONS.inc(kind="known")
+        keep = current.union(missing)
+        return [t for t in all_tools if t["function"]["name"] in keep]
+
+    def handle_tool_call(
+        self, tool_call, stop_event: Optional["threading.Event"] = None, speculation: Optional[Speculation] = None
+    ):
+        # 处理工具调用；stop_event 置位时中止进行中的工具调用，参数与预取一致时直接使用预取结果
         function_name = tool_call.function.name
         function_args = json.loads(tool_call.function.arguments or "{}")
         function_id = tool_call.id
 
-        result = self.mcp_client.call_tool(
-            function_name,
-            function_args,
-            timeout=self.tool_call_timeout,
-        )
+        result = speculation.take(function_name, function_args) if speculation is not None else None
+        if result is None:
+            result = self.mcp_client.call_tool(
+                function_name,
+                function_args,
+                timeout=self.tool_call_timeout,
+                cancel=stop_event,
+            )
         function_call_content = result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
 
         return {
@@ -194,168 +274,288 @@ class Agent:
             "tool_call_id": function_id,
         }
 
-    def get_completion(self, prompt, return_details: bool = False, stop_event: Optional["threading.Event"] = None):
+    def get_completion(
+        self,
+        prompt,
+        return_details: bool = False,
+        stop_event: Optional["threading.Event"] = None,
+        timeout: Optional[float] = None,
+        speculate: Optional[bool] = None,
+    ):
         """支持多轮工具调用的对话流程。
         return_details=True 时返回 dict，包含回复与本轮用到的工具列表。
         stop_event 用于外部请求中断。
+        timeout 为整个对话轮次的总时限（秒）；每轮模型调用与工具调用都从剩余预算中扣减，
+        不传时沿用调用方设置的 deadline.scope()。
+        speculate 为 True 时与第一轮模型请求并行预取可能的工具调用（见 speculation.py），默认取 AGENT_SPECULATE。
         """
+        speculate = SPECULATE_ENABLED if speculate is None else speculate
+        # 当前问题同时作为过长工具结果的压缩参照（tool_compressor）
+        with deadline.scope(timeout), tool_compressor.focus(prompt):
+            speculation = None
+            if speculate:
+                speculation = get_speculator().start(
+                    prompt, self.get_tool_schema(), self.mcp_client, self.tool_call_timeout, stop_event
+                )
+            try:
+                return self._complete(prompt, return_details, stop_event, speculation)
+            finally:
+                if speculation is not None:
+                    speculation.close()
+
+    def _complete(
+        self,
+        prompt,
+        return_details: bool,
+        stop_event: Optional["threading.Event"],
+        speculation: Optional[Speculation] = None,
+    ):
         self.messages.append({"role": "user", "content": prompt})
 
         round_idx = 0
         tool_log: List[str] = []
         tool_results: List[str] = []
+        turn_tools = self.select_tools(prompt)
         while True:
-            if stop_event and stop_event.is_set():
-                final = "对话已中断。"
-                if return_details:
-                    return {"content": final, "tools": tool_log, "tool_results": tool_results}
-                return final
-            round_idx += 1
-            if round_idx > self.max_rounds:
-                final = "对话已达最大轮次，可能存在工具请求超时或依赖外部网络不可达，请稍后重试或检查网络/代理。"
-                if return_details:
-                    return {"content": final, "tools": tool_log, "tool_results": tool_results}
-                return final
-
-            try:
+            with tracing.span("agent.round", round=round_idx + 1):
                 if stop_event and stop_event.is_set():
                     final = "对话已中断。"
                     if return_details:
                         return {"content": final, "tools": tool_log, "tool_results": tool_results}
                     return final
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=self.messages,
-                    tools=self.get_tool_schema(),
-                    stream=False,
-                    timeout=30,  # 放宽超时，减少长工具流程被中断
-                )
-                # DEBUG: 若无 tool_calls 也无内容，打印日志，避免静默结束
-                choice_msg = response.choices[0].message
-                if not choice_msg.tool_calls and not (choice_msg.content or "").strip():
-                    if self.verbose:
-                        print("⚠️ 模型返回空消息，无 tool_calls、无 content")
-                    # 继续下一轮，尝试引导模型给出调用或回答
-                    self.messages.append({"role": "assistant", "content": ""})
-                    continue
-            except Exception as exc:
-                err_msg = f"模型请求超时或失败：{exc}"
-                if return_details:
-                    return {"content": err_msg, "tools": tool_log, "tool_results": tool_results}
-                return err_msg
-
-            msg = response.choices[0].message
-            tool_calls = msg.tool_calls or []
-
-            # 先把带 tool_calls 的 assistant 消息放入历史
-            assistant_entry: Dict[str, Any] = {
-                "role": "assistant",
-                "content": msg.content,
-            }
-            if tool_calls:
-                assistant_entry["tool_calls"] = [
-                    {
-                        "id": call.id,
-                        "type": "function",
-                        "function": {
-                            "name": call.function.name,
-                            "arguments": call.function.arguments,
-                        },
-                    }
-                    for call in tool_calls
-                ]
-            self.messages.append(assistant_entry)
-
-            # 如果已包含最终答案，则直接返回
-            content_text = msg.content or ""
-            has_final = bool(re.search(r"<final_answer>|<final>", content_text, re.IGNORECASE))
-
-            # 如果没有工具调用，检查是否需要继续循环或返回
-            if not tool_calls:
-                # 1) 有最终答案，直接返回；若缺少 observation 则补全，方便前端展示完整工具结果
-                if has_final:
-                    final_content = content_text
-                    if tool_results and not re.search(r"<observation>", content_text, re.IGNORECASE):
-                        observations_block = "\n".join(f"<observation>{obs}</observation>" for obs in tool_results)
-                        final_content = f"{content_text}\n{observations_block}"
+                round_idx += 1
+                if round_idx > self.max_rounds:
+                    final = "对话已达最大轮次，可能存在工具请求超时或依赖外部网络不可达，请稍后重试或检查网络/代理。"
                     if return_details:
-                        return {"content": final_content, "tools": tool_log, "tool_results": tool_results}
-                    return final_content
+                        return {"content": final, "tools": tool_log, "tool_results": tool_results}
+                    return final
 
-                # 2) 有 action 文本或调用提示，但模型未返回 tool_calls，继续请求下一轮
-                has_action_tag = bool(re.search(r"<action>", content_text, re.IGNORECASE))
-                if has_action_tag:
-                    if self.verbose:
-                        print("⚠️ 模型输出了 action/调用文本但未返回 tool_calls，继续请求下一轮。")
-                    continue
+                remaining = deadline.remaining()
+                if remaining is not None and remaining < _final_round_reserve():
+                    final = self._final_round(turn_tools, tool_results, stop_event)
+                    if return_details:
+                        return {"content": final, "tools": tool_log, "tool_results": tool_results}
+                    return final
 
-                # 3) 既无工具调用也无最终答案，继续下一轮
-                if self.verbose:
-                    print("⚠️ 模型无 tool_calls 且无 final_answer，继续请求下一轮。")
-                continue
-
-            if tool_calls:
-                # 去重并限制调用次数，避免无效重复消耗
-                filtered_calls = []
-                seen = set()
-                for call in tool_calls:
-                    key = (call.function.name, call.function.arguments or "")
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    filtered_calls.append(call)
-                    if len(filtered_calls) >= MAX_TOOL_CALLS_PER_ROUND:
-                        break
-
-                # 仅打印模型调用了哪些工具及其参数，不展示工具结果
-                for call in filtered_calls:
-                    print(f"🔧 模型调用工具：{call.function.name}，参数：{call.function.arguments}")
-                    tool_log.append(call.function.name)
-
-                # 处理每个工具调用，并把结果加入消息
-                for call in filtered_calls:
+                try:
                     if stop_event and stop_event.is_set():
                         final = "对话已中断。"
                         if return_details:
                             return {"content": final, "tools": tool_log, "tool_results": tool_results}
                         return final
-                    tool_msg = self.handle_tool_call(call)
-                    self.messages.append(tool_msg)
-                    tool_results.append(tool_msg.get("content", ""))
-                    if self.verbose:
-                        content_preview = tool_msg["content"]
-                        # 展示更长的预览，避免换乘信息被截断；如仍嫌长可再调大
-                        if len(content_preview) > 2000:
-                            content_preview = content_preview[:2000].rstrip() + "..."
-                        print(f"📦 工具结果：{content_preview}")
+                    response = self.llm.create(
+                        model=self.model,
+                        messages=self.messages,
+                        tools=turn_tools,
+                        stream=False,
+                        cancel=stop_event,
+                    )
+                    # DEBUG: 若无 tool_calls 也无内容，打印日志，避免静默结束
+                    choice_msg = response.choices[0].message
+                    if not choice_msg.tool_calls and not (choice_msg.content or "").strip():
+                        if self.verbose:
+                            print("⚠️ 模型返回空消息，无 tool_calls、无 content")
+                        # 继续下一轮，尝试引导模型给出调用或回答
+                        self.messages.append({"role": "assistant", "content": ""})
+                        continue
+                except cancellation.Cancelled:
+                    final = "对话已中断。"
+                    if return_details:
+                        return {"content": final, "tools": tool_log, "tool_results": tool_results}
+                    return final
+                except Exception as exc:
+                    err_msg = f"模型请求超时或失败：{exc}"
+                    if isinstance(exc, deadline.DeadlineExceeded) or deadline.remaining() == 0:
+                        err_msg = self._deadline_reply(tool_results)
+                        self.messages.append({"role": "assistant", "content": err_msg})
+                    if return_details:
+                        return {"content": err_msg, "tools": tool_log, "tool_results": tool_results}
+                    return err_msg
+
+                msg = response.choices[0].message
+                tool_calls = msg.tool_calls or []
+
+                # 先把带 tool_calls 的 assistant 消息放入历史
+                assistant_entry: Dict[str, Any] = {
+                    "role": "assistant",
+                    "content": msg.content,
+                }
+                if tool_calls:
+                    assistant_entry["tool_calls"] = [
+                        {
+                            "id": call.id,
+                            "type": "function",
+                            "function": {
+                                "name": call.function.name,
+                                "arguments": call.function.arguments,
+                            },
+                        }
+                        for call in tool_calls
+                    ]
+                self.messages.append(assistant_entry)
+
+                # 如果已包含最终答案，则直接返回
+                content_text = msg.content or ""
+                has_final = bool(re.search(r"<final_answer>|<final>", content_text, re.IGNORECASE))
+
+                # 如果没有工具调用，检查是否需要继续循环或返回
+                if not tool_calls:
+                    # 1) 有最终答案，直接返回；若缺少 observation 则补全，方便前端展示完整工具结果
+                    if has_final:
+                        final_content = content_text
+                        if tool_results and not re.search(r"<observation>", content_text, re.IGNORECASE):
+                            observations_block = "\n".join(f"<observation>{obs}</observation>" for obs in tool_results)
+                            final_content = f"{content_text}\n{observations_block}"
+                        if return_details:
+                            return {"content": final_content, "tools": tool_log, "tool_results": tool_results}
+                        return final_content
+
+                    # 2) 有 action 文本或调用提示，但模型未返回 tool_calls，继续请求下一轮
+                    action_match = re.search(r"<action>\s*([\w\-]+)", content_text, re.IGNORECASE)
+                    has_action_tag = bool(re.search(r"<action>", content_text, re.IGNORECASE))
+                    if action_match and self.tool_router is not None:
+                        # 模型在文本里写了子集之外的工具名时展开工具列表，下一轮才能真正调用
+                        turn_tools = self._expand_tools(turn_tools, [self._resolve_tool_name(action_match.group(1))])
+                    if has_action_tag:
+                        if self.verbose:
+                            print("⚠️ 模型输出了 action/调用文本但未返回 tool_calls，继续请求下一轮。")
+                        continue
 
-                # 继续循环，再问模型
-                continue
+                    # 3) 既无工具调用也无最终答案，继续下一轮
+                    if self.verbose:
+                        print("⚠️ 模型无 tool_calls 且无 final_answer，继续请求下一轮。")
+                    continue
 
-            # 没有工具调用，表示模型已给出最终答案
-            if return_details:
-                return {"content": msg.content, "tools": tool_log, "tool_results": tool_results}
-            return msg.content
+                if tool_calls:
+                    # 去重并限制调用次数，避免无效重复消耗
+                    filtered_calls = []
+                    seen = set()
+                    for call in tool_calls:
+                        key = (call.function.name, call.function.arguments or "")
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        filtered_calls.append(call)
+                        if len(filtered_calls) >= MAX_TOOL_CALLS_PER_ROUND:
+                            break
+
+                    if self.tool_router is not None:
+                        turn_tools = self._expand_tools(turn_tools, [call.function.name for call in filtered_calls])
+
+                    # 仅打印模型调用了哪些工具及其参数，不展示工具结果
+                    for call in filtered_calls:
+                        print(f"🔧 模型调用工具：{call.function.name}，参数：{call.function.arguments}")
+                        tool_log.append(call.function.name)
+
+                    # 处理每个工具调用，并把结果加入消息
+                    for call in filtered_calls:
+                        if stop_event and stop_event.is_set():
+                            break
+                        tool_msg = self.handle_tool_call(call, stop_event, speculation)
+                        self.messages.append(tool_msg)
+                        tool_results.append(tool_msg.get("content", ""))
+                        if self.verbose:
+                            content_preview = tool_msg["content"]
+                            # 展示更长的预览，避免换乘信息被截断；如仍嫌长可再调大
+                            if len(content_preview) > 2000:
+                                content_preview = content_preview[:2000].rstrip() + "..."
+                            print(f"📦 工具结果：{content_preview}")
+
+                    # 每个 tool_call id 都要有对应的 tool 消息（含去重/截断跳过与中断未执行的），否则下一轮请求会被 API 拒绝
+                    interrupted = bool(stop_event and stop_event.is_set())
+                    skipped = "工具调用已取消" if interrupted else "重复或超出本轮上限的工具调用，已跳过"
+                    self._answer_pending_calls(assistant_entry, skipped)
+                    if interrupted:
+                        final = "对话已中断。"
+                        if return_details:
+                            return {"content": final, "tools": tool_log, "tool_results": tool_results}
+                        return final
 
+                    # 继续循环，再问模型
+                    continue
 
-    def stream_completion(self, prompt, stop_event: Optional["threading.Event"] = None):
-        """简化版流式输出（不走工具），用于前端实时显示；支持 stop_event 中断。"""
+                # 没有工具调用，表示模型已给出最终答案
+                if return_details:
+                    return {"content": msg.content, "tools": tool_log, "tool_results": tool_results}
+                return msg.content
+
+
+    def _answer_pending_calls(self, assistant_entry: Dict[str, Any], content: str):
+        """为 assistant_entry 中尚无 tool 回复的调用补上一条说明性的 tool 消息。"""
+        answered = {m.get("tool_call_id") for m in self.messages if m.get("role") == "tool"}
+        for call in assistant_entry.get("tool_calls") or ():
+            if call["id"] not in answered:
+                self.messages.append({"role": "tool", "content": content, "tool_call_id": call["id"]})
+
+    def _final_round(
+        self, tools: List[Dict[str, Any]], tool_results: List[str], stop_event: Optional["threading.Event"] = None
+    ) -> str:
+        """时限将尽：禁用工具再问一次模型，让它基于已有 observation 作答；仍失败时返回已获取的工具结果。"""
+        kwargs: Dict[str, Any] = {"tools": tools, "tool_choice": "none"} if tools else {}
+        content = ""
+        with tracing.span("agent.final_round"):
+            try:
+                # 提示只用于本次请求，不写入会话历史
+                response = self.llm.create(
+                    model=self.model,
+                    messages=self.messages + [{"role": "user", "content": FINAL_ROUND_PROMPT}],
+                    stream=False,
+                    cancel=stop_event,
+                    **kwargs,
+                )
+                content = response.choices[0].message.content or ""
+            except cancellation.Cancelled:
+                return "对话已中断。"
+            except Exception as exc:
+                # 只有最后一轮也没能在时限内完成时才计为超时
+                if isinstance(exc, deadline.DeadlineExceeded) or deadline.remaining() == 0:
+                    deadline.exceeded("final_round")
+                if self.verbose:
+                    print(f"⚠️ 时限内未能完成最后一轮回答：{exc}")
+        if not content.strip():
+            content = self._deadline_reply(tool_results)
+        elif tool_results and not re.search(r"<observation>", content, re.IGNORECASE):
+            content += "\n" + "\n".join(f"<observation>{obs}</observation>" for obs in tool_results)
+        self.messages.append({"role": "assistant", "content": content})
+        return content
+
+    def _deadline_reply(self, tool_results: List[str]) -> str:
+        dl = deadline.current()
+        limit = f"（{dl.timeout:g} 秒）" if dl is not None else ""
+        reply = f"<final_answer>请求处理超出时限{limit}，未能完成全部步骤，请稍后重试或缩小问题范围。</final_answer>"
+        if tool_results:
+            reply += "\n" + "\n".join(f"<observation>{obs}</observation>" for obs in tool_results)
+        return reply
+
+    def stream_completion(self, prompt, stop_event: Optional["threading.Event"] = None, timeout: Optional[float] = None):
+        """简化版流式输出（不走工具），用于前端实时显示；支持 stop_event 中断与总时限 timeout（秒）。
+
+        生成器的每次迭代可能在不同线程执行，这里不使用 deadline.scope()，直接按本地时限截断。
+        """
         self.messages.append({"role": "user", "content": prompt})
-        stream = self.client.chat.completions.create(
+        limit = deadline.Deadline(timeout) if timeout else None
+        stream = self.llm.create(
             model=self.model,
             messages=self.messages,
             stream=True,
-            timeout=30,
+            **({"timeout": limit.clamp(self.llm.timeout)} if limit else {}),
         )
         full_text = ""
-        for chunk in stream:
-            if stop_event and stop_event.is_set():
-                break
-            delta = chunk.choices[0].delta
-            content_piece = delta.content or ""
-            if content_piece:
-                full_text += content_piece
-                yield content_piece
+        try:
+            for chunk in stream:
+                if stop_event and stop_event.is_set():
+                    break
+                if limit is not None and limit.expired:
+                    deadline.exceeded("request")
+                    break
+                delta = chunk.choices[0].delta
+                content_piece = delta.content or ""
+                if content_piece:
+                    full_text += content_piece
+                    yield content_piece
+        finally:
+            # 中断或超时时关闭响应，立即释放连接，不再读完剩余的流
+            stream.close()
         # 将完整 assistant 消息记录到历史
         self.messages.append({"role": "assistant", "content": full_text})
         yield None
@@ -363,8 +563,6 @@ class Agent:
 
 def run_agent(query: str):
     """使用 MCP 工具的 Agent 进行对话/查询。"""
-    base_url = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com")
-    client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=base_url)
-    agent = Agent(client=client, verbose=True)
+    agent = Agent(client=get_model_client(), verbose=True)
     return agent.get_completion(query)
 
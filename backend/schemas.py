@@ -1,10 +1,11 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 
 class ChatRequest(BaseModel):
     session_id: Optional[str] = Field(None, description="会话标识，不传则新建")
     message: str = Field(..., description="用户输入")
+    timeout: Optional[float] = Field(None, description="本次请求的总时限（秒），不传时取 X-Request-Timeout 请求头或 REQUEST_TIMEOUT")
 
 
 class ChatResponse(BaseModel):
@@ -12,4 +13,11 @@ class ChatResponse(BaseModel):
     reply: str
     tools: List[str] = []
     tool_results: List[str] = []
+    timings: Dict[str, Any] = Field(default_factory=dict, description="本次请求的耗时分解（按 span 名称汇总，毫秒）")
 
+
+class UploadInitRequest(BaseModel):
+    path: str = Field(".", description="workspace 下的目标目录")
+    filename: str = Field(..., description="文件名")
+    size: int = Field(..., description="文件总字节数")
+    sha256: Optional[str] = Field(None, description="可选，完成时校验的 SHA-256")
@@ -3,20 +3,32 @@ import os
 import time
 import uuid
 import threading
+import weakref
 from pathlib import Path
-from typing import Dict, Tuple, List, Any
+from typing import Dict, List, Any, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
-from fastapi.responses import StreamingResponse
-
-from agent import Agent
-from config import DEEPSEEK_API_KEY
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+import cancellation
+import deadline
+import metrics
+import tracing
+from agent import SYSTEM_PROMPT, Agent, default_mcp_servers
+from llm_client import get_model_client
+from multi_mcp_client import MultiMCPClient
+from speculation import get_speculator
 from tools.file import _safe_path, WORKSPACE
-from backend.schemas import ChatRequest, ChatResponse
+from tools.workspace_meta import get_meta_index
+from backend.schemas import ChatRequest, ChatResponse, UploadInitRequest
+from backend import uploads
+from backend.session_backend import WORKER_ID, SharedCancelFlag, create_backend
+from backend.session_cache import SessionCache
+from rag.workspace_index import notify_changed, start_watcher
 
 app = FastAPI(title="MyAgent Backend")
+tracing.set_service_name("myagent-backend")
 
 # 允许本地前端访问，可按需收紧
 app.add_middleware(
@@ -27,11 +39,74 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 简单内存会话：session_id -> (agent, last_used_ts)
-SESSION_TTL = 60 * 30  # 30 分钟不活跃自动清理
-sessions: Dict[str, Tuple[Agent, float]] = {}
-# 会话中断标记：session_id -> threading.Event
-session_cancel_flags: Dict[str, threading.Event] = {}
+
+@app.middleware("http")
+async def _record_metrics(request: Request, call_next):
+    """
+    请求数/耗时按路由模板统计（而非原始路径），避免 session_id 等参数撑爆标签基数。
+    call_next 返回的响应体是流式的，耗时在响应体发送完毕（或客户端断开）时才记录，流式接口统计的是完整请求而非首包。
+    """
+    metrics.HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    state = {"status": 500, "done": False}
+
+    def finish():
+        if state["done"]:
+            return
+        state["done"] = True
+        metrics.HTTP_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=path, status=state["status"])
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=path)
+
+    async def body(iterator):
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            finish()
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish()
+        raise
+    state["status"] = response.status_code
+    # 多 worker 部署时标明处理请求的 worker，便于核对按 X-Session-Id 的亲和路由
+    response.headers["X-Worker-Id"] = WORKER_ID
+    if hasattr(response, "body_iterator"):
+        response.body_iterator = body(response.body_iterator)
+    else:
+        finish()
+    return response
+
+
+# 请求总时限（秒）：请求体 timeout 或 X-Request-Timeout 请求头优先，0 表示不限制
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+# workspace 增量索引：后台监听上传/写入并更新 workspace collection，可用 WORKSPACE_INDEX_WATCH=0 关闭
+WORKSPACE_INDEX_WATCH = os.getenv("WORKSPACE_INDEX_WATCH", "1") != "0"
+
+
+@app.on_event("startup")
+def _start_workspace_watcher():
+    if WORKSPACE_INDEX_WATCH:
+        start_watcher()
+
+
+# 共享会话后端（SESSION_BACKEND=sqlite|redis）：多 worker 之间共享会话状态与中断标记；memory 时为 None
+session_backend = create_backend()
+# 会话中断标记：session_id -> CancelFlag（共享后端时为 SharedCancelFlag）
+session_cancel_flags: Dict[str, Any] = {}
+# 内存会话：按 TTL 与内存预算淘汰，淘汰时完整对话落盘（或已写入共享后端），再次访问时无损恢复
+sessions = SessionCache(
+    shared_prompt=SYSTEM_PROMPT,
+    on_evict=lambda sid: session_cancel_flags.pop(sid, None),
+    backend=session_backend,
+)
+metrics.ACTIVE_SESSIONS.set_function(lambda: len(sessions))
+metrics.SESSION_CACHE_BYTES.set_function(lambda: sessions.total_bytes)
 
 # 持久化文件：保存每个 session 的摘要与最近轮次
 SESSION_FILE = Path(__file__).parent / "chat_sessions.json"
@@ -49,9 +124,14 @@ def _load_session_store() -> Dict[str, Dict[str, Any]]:
 
 
 def _save_session_store(data: Dict[str, Dict[str, Any]]):
+    started = time.perf_counter()
     SESSION_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with SESSION_FILE.open("w", encoding="utf-8") as f:
+    # 先写临时文件再原子替换，多个 worker 同时写入时不会留下半截文件
+    tmp = SESSION_FILE.with_name(f"{SESSION_FILE.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, SESSION_FILE)
+    metrics.SESSION_WRITE_LATENCY.observe(time.perf_counter() - started, op="save")
 
 
 def _compact_session(session: Dict[str, Any]):
@@ -88,7 +168,8 @@ def _hydrate_agent_from_store(agent: Agent, sid: str):
     summary = session.get("summary")
     recent = session.get("recent", [])
     if summary:
-        agent.messages.append({"role": "system", "content": f"以下是该会话到目前为止的摘要：\n{summary}"})
+        # 摘要因会话而异，放在 user 消息里，排在系统提示与工具之后，不破坏可缓存的公共前缀
+        agent.messages.append({"role": "user", "content": f"（背景）以下是该会话到目前为止的摘要：\n{summary}"})
     for msg in recent:
         agent.messages.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
 
@@ -101,72 +182,124 @@ def _delete_session_store(sid: str):
 
 
 def _get_client():
-    base_url = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/v1")
-    return OpenAI(api_key=DEEPSEEK_API_KEY, base_url=base_url)
+    # 所有会话共享同一个 ModelClient（连接池与调用指标）
+    return get_model_client()
 
 
-def _get_agent(session_id: str) -> Agent:
-    now = time.time()
-    # 清理过期会话
-    expired = [sid for sid, (_, ts) in sessions.items() if now - ts > SESSION_TTL]
-    for sid in expired:
-        sessions.pop(sid, None)
-        session_cancel_flags.pop(sid, None)
-
-    if session_id in sessions:
-        agent, _ = sessions[session_id]
-        sessions[session_id] = (agent, now)
-        return agent
+_MCP_CLIENT: Optional[MultiMCPClient] = None
+
 
-    agent = Agent(client=_get_client(), verbose=False)
-    _hydrate_agent_from_store(agent, session_id)
-    sessions[session_id] = (agent, now)
-    return agent
+def _get_mcp_client() -> MultiMCPClient:
+    # 所有会话共享同一个 MCP 客户端与工具 schema，新会话不再各自发现工具
+    global _MCP_CLIENT
+    if _MCP_CLIENT is None:
+        _MCP_CLIENT = MultiMCPClient(default_mcp_servers())
+    return _MCP_CLIENT
 
 
-def _get_cancel_flag(session_id: str) -> threading.Event:
+# 按会话串行化“未命中 -> 恢复 -> 放入缓存”，同一会话并发的首个请求不会各自恢复一份
+_AGENT_LOCKS: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+_AGENT_LOCKS_GUARD = threading.Lock()
+
+
+def _get_agent(session_id: str) -> Agent:
+    """取出会话并 pin 住，请求结束后需调用 sessions.release(session_id)。"""
+    agent = sessions.acquire(session_id)
+    if agent is not None:
+        return agent
+
+    with _AGENT_LOCKS_GUARD:
+        lock = _AGENT_LOCKS.get(session_id)
+        if lock is None:
+            lock = _AGENT_LOCKS[session_id] = threading.Lock()
+    with lock:
+        agent = sessions.acquire(session_id)
+        if agent is not None:
+            return agent
+        agent = Agent(client=_get_client(), mcp_client=_get_mcp_client(), verbose=False)
+        # 优先从淘汰快照 / 共享后端无损恢复；没有快照（如服务重启后）才从持久化历史回填摘要与最近轮次
+        version = sessions.restore(session_id, agent)
+        if not version:
+            _hydrate_agent_from_store(agent, session_id)
+        return sessions.put(session_id, agent, version)
+
+
+def _get_cancel_flag(session_id: str):
     flag = session_cancel_flags.get(session_id)
     if flag is None:
-        flag = threading.Event()
+        # 共享后端下 /cancel 可能落在其他 worker，由标记轮询后端感知
+        flag = SharedCancelFlag(session_backend, session_id) if session_backend is not None else cancellation.CancelFlag()
         session_cancel_flags[session_id] = flag
     return flag
 
 
-@app.post("/chat", response_model=ChatResponse)
-def chat(payload: ChatRequest):
-    sid = payload.session_id or str(uuid.uuid4())
-    agent = _get_agent(sid)
-    cancel_flag = _get_cancel_flag(sid)
-    cancel_flag.clear()
+def _resolve_session_id(payload: ChatRequest, header_sid: Optional[str]) -> str:
+    """请求体优先，其次 X-Session-Id 请求头（供按会话做亲和路由的负载均衡复用），都没有时新建。"""
+    return payload.session_id or header_sid or str(uuid.uuid4())
 
-    result = agent.get_completion(payload.message, return_details=True, stop_event=cancel_flag)
-    reply = result["content"] if isinstance(result, dict) else str(result)
-    tools = result.get("tools", []) if isinstance(result, dict) else []
-    tool_results = result.get("tool_results", []) if isinstance(result, dict) else []
 
-    # 追加历史并持久化
-    _append_history(sid, payload.message, reply, tools)
+def _resolve_timeout(payload: ChatRequest, header_timeout: Optional[float]) -> Optional[float]:
+    timeout = payload.timeout or header_timeout or REQUEST_TIMEOUT
+    return timeout if timeout > 0 else None
 
-    # 更新最后使用时间
-    if sid in sessions:
-        sessions[sid] = (agent, time.time())
 
-    return ChatResponse(session_id=sid, reply=reply, tools=tools, tool_results=tool_results)
+@app.post("/chat", response_model=ChatResponse)
+def chat(
+    payload: ChatRequest,
+    response: Response,
+    x_session_id: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None),
+):
+    sid = _resolve_session_id(payload, x_session_id)
+    timeout = _resolve_timeout(payload, x_request_timeout)
+    response.headers["X-Session-Id"] = sid
+    # 时限从收到请求起计算，取会话、每轮模型调用与工具调用都从中扣减
+    with tracing.span("chat", session_id=sid) as root, deadline.scope(timeout):
+        with tracing.span("session.get_agent"):
+            agent = _get_agent(sid)
+        cancel_flag = _get_cancel_flag(sid)
+        cancel_flag.clear()
+        try:
+            result = agent.get_completion(payload.message, return_details=True, stop_event=cancel_flag)
+            reply = result["content"] if isinstance(result, dict) else str(result)
+            tools = result.get("tools", []) if isinstance(result, dict) else []
+            tool_results = result.get("tool_results", []) if isinstance(result, dict) else []
+
+            # 追加历史并持久化
+            with tracing.span("session.save"):
+                _append_history(sid, payload.message, reply, tools)
+        finally:
+            # 解除 pin 并更新最后使用时间与内存占用
+            sessions.release(sid)
+            cancellation.observe_freed(cancel_flag)
+
+    metrics.observe_trace(tracing.export_spans(root))
+    return ChatResponse(session_id=sid, reply=reply, tools=tools, tool_results=tool_results, timings=root.breakdown())
 
 
 @app.post("/chat/stream")
-def chat_stream(payload: ChatRequest):
-    sid = payload.session_id or str(uuid.uuid4())
-    agent = _get_agent(sid)
+def chat_stream(
+    payload: ChatRequest,
+    x_session_id: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None),
+):
+    sid = _resolve_session_id(payload, x_session_id)
+    timeout = _resolve_timeout(payload, x_request_timeout)
     cancel_flag = _get_cancel_flag(sid)
     cancel_flag.clear()
 
     def streamer():
-        for chunk in agent.stream_completion(payload.message, stop_event=cancel_flag):
-            if chunk is None:
-                break
-            # SSE 格式
-            yield f"data: {chunk}\n\n"
+        # 在生成器内取会话并 pin 住：客户端在响应开始前断开时生成器不会启动，也就不会留下未释放的 pin
+        agent = _get_agent(sid)
+        try:
+            for chunk in agent.stream_completion(payload.message, stop_event=cancel_flag, timeout=timeout):
+                if chunk is None:
+                    break
+                # SSE 格式
+                yield f"data: {chunk}\n\n"
+        finally:
+            sessions.release(sid)
+            cancellation.observe_freed(cancel_flag)
 
     headers = {"X-Session-Id": sid}
     return StreamingResponse(streamer(), media_type="text/event-stream", headers=headers)
@@ -174,13 +307,19 @@ def chat_stream(payload: ChatRequest):
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "worker": WORKER_ID, "sessions": sessions.describe(), "speculation": get_speculator().summary()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus 文本格式的进程内指标。"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.delete("/chat/session/{session_id}")
 def delete_session(session_id: str):
-    # 删除内存 Agent
-    sessions.pop(session_id, None)
+    # 删除内存 Agent 与淘汰快照
+    sessions.pop(session_id)
     # 删除中断标记
     session_cancel_flags.pop(session_id, None)
     # 删除持久化记录
@@ -190,43 +329,79 @@ def delete_session(session_id: str):
 
 @app.post("/chat/session/{session_id}/cancel")
 def cancel_session(session_id: str):
-    """标记会话为中断，后台 Agent 将在下一次检查时退出循环。"""
+    """标记会话为中断：进行中的模型请求与工具调用被中止，后台 Agent 随即退出循环。"""
     flag = _get_cancel_flag(session_id)
     flag.set()
     return {"ok": True, "session_id": session_id}
 
 
 @app.get("/workspace/list")
-def workspace_list(path: str = "."):
-    """列出 workspace 指定目录的文件与子目录。"""
+def workspace_list(
+    path: str = ".",
+    recursive: bool = False,
+    pattern: str = "",
+    sort: str = "name",
+    descending: bool = False,
+    offset: int = 0,
+    limit: int = 500,
+    include_hash: bool = False,
+):
+    """分页列出 workspace 指定目录的文件与子目录（元数据来自增量缓存，支持排序/glob 过滤/递归）。"""
     real = _safe_path(path)
     if not os.path.exists(real):
         raise HTTPException(status_code=404, detail="路径不存在")
-    items: List[Dict[str, Any]] = []
-    for entry in os.scandir(real):
-        stat = entry.stat()
-        items.append(
-            {
-                "name": entry.name,
-                "is_dir": entry.is_dir(),
-                "size": stat.st_size,
-                "mtime": stat.st_mtime,
-            }
+    try:
+        listing = get_meta_index().list(
+            real,
+            recursive=recursive,
+            pattern=pattern,
+            sort=sort,
+            descending=descending,
+            offset=offset,
+            limit=limit,
+            include_hash=include_hash,
         )
-    return {"path": path, "abs_path": os.path.realpath(real), "items": items}
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    return {**listing, "path": path, "abs_path": os.path.realpath(real)}
 
 
 @app.post("/workspace/upload")
-async def workspace_upload(path: str = ".", file: UploadFile = File(...)):
-    """上传文件到 workspace 指定目录。"""
-    real_dir = _safe_path(path)
-    os.makedirs(real_dir, exist_ok=True)
-    dest = os.path.join(real_dir, file.filename)
-    try:
-        content = await file.read()
-        with open(dest, "wb") as f:
-            f.write(content)
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"写入失败: {exc}")
-    return {"ok": True, "path": path, "filename": file.filename, "dest": os.path.realpath(dest)}
+async def workspace_upload(path: str = ".", file: UploadFile = File(...), sha256: Optional[str] = None):
+    """上传文件到 workspace 指定目录（分块流式写盘，可选 sha256 校验）。"""
+    saved = await uploads.save_upload(path, file, sha256=sha256)
+    notify_changed()
+    return {"ok": True, "path": path, "filename": os.path.basename(file.filename), **saved}
+
+
+@app.post("/workspace/upload/init")
+def workspace_upload_init(payload: UploadInitRequest):
+    """创建分片上传任务，返回 upload_id 与建议分片大小。"""
+    return uploads.init_upload(payload.path, payload.filename, payload.size, payload.sha256)
+
+
+@app.get("/workspace/upload/{upload_id}")
+def workspace_upload_status(upload_id: str):
+    """查询已接收字节数，断线后从 received 处续传。"""
+    return uploads.upload_status(upload_id)
+
+
+@app.put("/workspace/upload/{upload_id}")
+async def workspace_upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """以原始请求体追加一个分片（offset 为该分片在文件中的起始位置）。"""
+    return await uploads.append_chunk(upload_id, offset, request.stream())
+
+
+@app.post("/workspace/upload/{upload_id}/complete")
+async def workspace_upload_complete(upload_id: str):
+    """校验大小与 sha256 后原子改名到目标路径。"""
+    result = await uploads.complete_upload(upload_id)
+    notify_changed()
+    return result
+
 
+@app.delete("/workspace/upload/{upload_id}")
+def workspace_upload_abort(upload_id: str):
+    return uploads.abort_upload(upload_id)
@@ -0,0 +1,276 @@
+"""
+可外置的会话状态与中断信号后端，使后端可以多 worker / 多节点部署。
+
+- memory（默认）：单进程，会话只在本进程内存中，淘汰时落盘到 SESSION_SPILL_DIR（见 session_cache.py）。
+- sqlite：同一节点的多个 worker 共享 SESSION_DB（WAL 模式），适合 uvicorn --workers N。
+- redis：多节点共享 REDIS_URL（需 pip install redis，兼容 Redis 协议的服务均可）。
+
+共享后端下，每次请求结束把完整对话写回后端并递增版本号；任一 worker 取会话时先比较版本，落后则重新加载，
+因此同一会话的后续请求落到哪个 worker 都能拿到最新状态。写回按版本号比较并交换：两个 worker 同时处理同一会话时，
+后写入者收到 VersionConflict，由 session_cache 重新加载并把本轮新增的消息接在最新状态之后再写，不会静默丢掉一轮。
+/cancel 写入共享的中断标记，正在执行该会话的 worker 在 Agent 的下一次检查时轮询到并退出。负载均衡可按
+X-Session-Id 请求头做一致性哈希，使同一会话尽量落在同一 worker 上以命中内存缓存（响应头 X-Worker-Id 标明处理请求的
+worker）。
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:  # 可选：Redis 后端
+    import redis  # type: ignore
+except Exception:  # pragma: no cover - 未安装时仅 redis 后端不可用
+    redis = None
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory | sqlite | redis
+SESSION_DB = Path(os.getenv("SESSION_DB", str(Path(__file__).parent / "sessions.db")))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("SESSION_REDIS_PREFIX", "myagent:")
+# 共享会话状态的保留时间（秒），与落盘快照一致
+SESSION_STATE_TTL = int(float(os.getenv("SESSION_SPILL_TTL", str(7 * 24 * 3600))))
+# 中断标记的保留时间与轮询间隔（秒）
+CANCEL_TTL = 3600
+CANCEL_POLL_INTERVAL = float(os.getenv("SESSION_CANCEL_POLL_INTERVAL", "0.5"))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class VersionConflict(Exception):
+    """写回时后端中的版本号已不是调用方读到的版本（其他 worker 先写入了该会话）。"""
+
+    def __init__(self, sid: str, expected: int):
+        super().__init__(f"会话 {sid} 的版本已变化（期望 {expected}）")
+        self.sid = sid
+        self.expected = expected
+
+
+class SessionBackend(ABC):
+    """共享后端接口：会话快照（压缩后的字节串）带单调递增的版本号。"""
+
+    name = ""
+
+    @abstractmethod
+    def load(self, sid: str) -> Optional[Tuple[int, bytes]]:
+        ...
+
+    @abstractmethod
+    def save(self, sid: str, blob: bytes, expected: int) -> int:
+        """当前版本号等于 expected（0 表示尚不存在）时写入快照并返回新版本号，否则抛出 VersionConflict。"""
+
+    @abstractmethod
+    def version(self, sid: str) -> int:
+        """当前版本号，不存在时为 0。"""
+
+    @abstractmethod
+    def delete(self, sid: str):
+        ...
+
+    @abstractmethod
+    def set_cancel(self, sid: str, cancelled: bool):
+        ...
+
+    @abstractmethod
+    def cancelled_at(self, sid: str) -> Optional[float]:
+        """中断标记写入的时间戳（time.time()），未中断时为 None。"""
+
+
+class SQLiteBackend(SessionBackend):
+    """同一节点多进程共享；每个线程一条连接。"""
+
+    name = "sqlite"
+
+    def __init__(self, path: Path = SESSION_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, version INTEGER NOT NULL, data BLOB, updated REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS cancels (sid TEXT PRIMARY KEY, at REAL)")
+        self._prune()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _prune(self):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE updated < ?", (now - SESSION_STATE_TTL,))
+        conn.execute("DELETE FROM cancels WHERE at < ?", (now - CANCEL_TTL,))
+
+    def load(self, sid: str) -> Optional[Tuple[int, bytes]]:
+        row = self._conn().execute("SELECT version, data FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def save(self, sid: str, blob: bytes, expected: int) -> int:
+        if expected <= 0:
+            row = self._conn().execute(
+                "INSERT INTO sessions (sid, version, data, updated) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(sid) DO NOTHING RETURNING version",
+                (sid, blob, time.time()),
+            ).fetchone()
+        else:
+            row = self._conn().execute(
+                "UPDATE sessions SET version = version + 1, data = ?, updated = ? WHERE sid = ? AND version = ? "
+                "RETURNING version",
+                (blob, time.time(), sid, expected),
+            ).fetchone()
+        if row is None:
+            raise VersionConflict(sid, expected)
+        return row[0]
+
+    def version(self, sid: str) -> int:
+        row = self._conn().execute("SELECT version FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        return row[0] if row else 0
+
+    def delete(self, sid: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        conn.execute("DELETE FROM cancels WHERE sid = ?", (sid,))
+
+    def set_cancel(self, sid: str, cancelled: bool):
+        if cancelled:
+            self._conn().execute("INSERT OR REPLACE INTO cancels (sid, at) VALUES (?, ?)", (sid, time.time()))
+        else:
+            self._conn().execute("DELETE FROM cancels WHERE sid = ?", (sid,))
+
+    def cancelled_at(self, sid: str) -> Optional[float]:
+        row = self._conn().execute("SELECT at FROM cancels WHERE sid = ?", (sid,)).fetchone()
+        return row[0] if row else None
+
+
+class RedisBackend(SessionBackend):
+    """多节点共享；键带 TTL，过期会话由 Redis 自动清理。"""
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX):
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND=redis 需要安装 redis：pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, kind: str, sid: str) -> str:
+        return f"{self.prefix}{kind}:{sid}"
+
+    def load(self, sid: str) -> Optional[Tuple[int, bytes]]:
+        version, data = self.client.hmget(self._key("session", sid), "version", "data")
+        if data is None:
+            return None
+        return int(version or 0), bytes(data)
+
+    def save(self, sid: str, blob: bytes, expected: int) -> int:
+        key = self._key("session", sid)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.hget(key, "version")
+                if int(current or 0) != max(expected, 0):
+                    raise VersionConflict(sid, expected)
+                pipe.multi()
+                pipe.hset(key, mapping={"version": max(expected, 0) + 1, "data": blob})
+                pipe.expire(key, SESSION_STATE_TTL)
+                pipe.execute()
+            except redis.WatchError:
+                raise VersionConflict(sid, expected)
+        return max(expected, 0) + 1
+
+    def version(self, sid: str) -> int:
+        value = self.client.hget(self._key("session", sid), "version")
+        return int(value) if value is not None else 0
+
+    def delete(self, sid: str):
+        self.client.delete(self._key("session", sid), self._key("cancel", sid))
+
+    def set_cancel(self, sid: str, cancelled: bool):
+        if cancelled:
+            self.client.set(self._key("cancel", sid), time.time(), ex=CANCEL_TTL)
+        else:
+            self.client.delete(self._key("cancel", sid))
+
+    def cancelled_at(self, sid: str) -> Optional[float]:
+        value = self.client.get(self._key("cancel", sid))
+        return float(value) if value is not None else None
+
+
+class SharedCancelFlag:
+    """与 threading.Event 接口兼容的中断标记：set() 写入共享后端，is_set() 按间隔轮询后端。
+
+    set_at 为发起中断的时间（可能来自其他 worker），用于统计取消到释放的耗时。
+    """
+
+    def __init__(self, backend: SessionBackend, sid: str, poll_interval: float = CANCEL_POLL_INTERVAL):
+        self.backend = backend
+        self.sid = sid
+        self.poll_interval = poll_interval
+        self.set_at: Optional[float] = None
+        self._local = threading.Event()
+        self._next_poll = 0.0
+
+    def set(self):
+        self.set_at = time.time()
+        self._local.set()
+        self._write(True)
+
+    def clear(self):
+        self.set_at = None
+        self._local.clear()
+        self._next_poll = 0.0
+        self._write(False)
+
+    def _write(self, cancelled: bool):
+        # 后端暂时不可用时退化为本 worker 内的中断标记，不让请求因此失败
+        try:
+            self.backend.set_cancel(self.sid, cancelled)
+        except Exception as exc:
+            print(f"⚠️ 写入共享中断标记失败：{self.sid} -> {exc}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """按轮询间隔等待中断，供退避等待时提前醒来。"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while not self.is_set():
+            left = None if end is None else end - time.monotonic()
+            if left is not None and left <= 0:
+                return False
+            self._local.wait(self.poll_interval if left is None else min(self.poll_interval, left))
+        return True
+
+    def is_set(self) -> bool:
+        if self._local.is_set():
+            return True
+        now = time.monotonic()
+        if now < self._next_poll:
+            return False
+        self._next_poll = now + self.poll_interval
+        try:
+            cancelled_at = self.backend.cancelled_at(self.sid)
+        except Exception:
+            return False  # 后端暂时不可用时不中断请求
+        if cancelled_at is None:
+            return False
+        self.set_at = cancelled_at
+        self._local.set()
+        return True
+
+
+def create_backend(kind: str = SESSION_BACKEND) -> Optional[SessionBackend]:
+    """按 SESSION_BACKEND 创建共享后端；memory 返回 None（单进程模式）。"""
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    raise ValueError(f"不支持的 SESSION_BACKEND：{kind}，可选：memory / sqlite / redis")
@@ -0,0 +1,359 @@
+"""
+内存受限的会话缓存：session_id -> Agent。
+
+- 按最近使用排序的 OrderedDict 同时充当 LRU 顺序与 TTL 索引：最久未用的会话总在队首，过期检查只需从队首
+  弹出已过期项，O(1) 摊销，而不是每个请求遍历全部会话。
+- 总内存预算（SESSION_CACHE_MAX_MB）与会话数上限（SESSION_CACHE_MAX_SESSIONS）超出时按 LRU 淘汰。
+- 淘汰（含 TTL 过期）时把完整的 messages 以 zlib 压缩 JSON 落盘，会话再次到来时无损恢复，
+  不再只能从持久化历史中回填最近 6 条消息。
+- 正在处理请求的会话被 pin 住，不会被淘汰（否则落盘的是请求进行中的旧状态）。
+- 传入共享后端（session_backend.py）时改为写穿：每次请求结束写回后端并记录版本号，取会话时版本落后则重新加载，
+  淘汰只需丢弃内存副本。写回按版本号比较并交换，冲突时重新加载并把本轮新增的消息接在最新状态之后重试；
+  后端暂时不可用时沿用内存副本，请求照常处理。
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from backend.session_backend import SessionBackend, VersionConflict
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(60 * 30)))  # 30 分钟不活跃移出内存（落盘）
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "256"))
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1000"))
+SESSION_SPILL_DIR = Path(os.getenv("SESSION_SPILL_DIR", str(Path(__file__).parent / ".sessions")))
+# 落盘会话的保留时间，超过后清理（默认 7 天）
+SESSION_SPILL_TTL = float(os.getenv("SESSION_SPILL_TTL", str(7 * 24 * 3600)))
+SPILL_PRUNE_INTERVAL = 600
+# 每条消息除内容外的固定开销估计（dict 与键）
+MESSAGE_OVERHEAD_BYTES = 240
+# 写回共享后端遇到版本冲突时的最大重试次数
+SAVE_CONFLICT_RETRIES = 3
+
+
+def estimate_bytes(messages: List[Dict[str, Any]], shared: Optional[str] = None) -> int:
+    """粗略估计 messages 占用的内存；shared（如系统提示词）为多个会话共享的同一字符串，不计入。"""
+    total = 0
+    for msg in messages:
+        total += MESSAGE_OVERHEAD_BYTES
+        content = msg.get("content")
+        if isinstance(content, str) and content is not shared:
+            total += sys.getsizeof(content)
+        for call in msg.get("tool_calls") or ():
+            total += MESSAGE_OVERHEAD_BYTES + sys.getsizeof(call.get("function", {}).get("arguments") or "")
+    return total
+
+
+def encode_snapshot(snapshot: List[Dict[str, Any]], sid: str = "") -> bytes:
+    data = json.dumps({"sid": sid, "saved_at": time.time(), "messages": snapshot}, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(data.encode("utf-8"), 1)
+
+
+def decode_snapshot(blob: bytes) -> List[Dict[str, Any]]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))["messages"]
+
+
+class _Entry:
+    __slots__ = ("agent", "last_used", "size", "pins", "version", "base")
+
+    def __init__(self, agent: Any, size: int, version: int = 0):
+        self.agent = agent
+        self.last_used = time.time()
+        self.size = size
+        self.pins = 0
+        self.version = version
+        # 与 version 对应的消息条数：其后的消息是本轮新增的，写回冲突时接到最新状态之后
+        self.base = len(agent.messages)
+
+
+class SessionCache:
+    """线程安全的会话缓存；缓存对象需有 messages 属性（Agent）。"""
+
+    def __init__(
+        self,
+        ttl: float = SESSION_TTL,
+        max_bytes: int = int(SESSION_CACHE_MAX_MB * 1024 * 1024),
+        max_sessions: int = SESSION_CACHE_MAX_SESSIONS,
+        spill_dir: Path = SESSION_SPILL_DIR,
+        shared_prompt: Optional[str] = None,
+        on_evict: Optional[Callable[[str], None]] = None,
+        backend: Optional[SessionBackend] = None,
+    ):
+        self.ttl = ttl
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.max_sessions = max(1, max_sessions)
+        self.spill_dir = Path(spill_dir)
+        self.shared_prompt = shared_prompt
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 串行化快照的写盘与恢复，避免恢复时读到写了一半的文件
+        self._io_lock = threading.Lock()
+        # 正在写盘的会话快照：写盘完成前到来的同一会话直接从这里恢复
+        self._spilling: Dict[str, List[Dict[str, Any]]] = {}
+        self._last_prune = 0.0
+        self.stats = {"hits": 0, "restored": 0, "misses": 0, "spilled": 0, "expired": 0, "stale": 0, "conflicts": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._entries
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    # ---------- 读写 ----------
+
+    def acquire(self, sid: str) -> Optional[Any]:
+        """取出内存中的会话并 pin 住；不在内存中返回 None（可再调用 restore）。"""
+        self._evict(expired_only=True)
+        # 共享后端下先比较版本：其他 worker 处理过该会话时内存副本已过期；后端不可用时沿用内存副本
+        latest = None
+        if self.backend is not None:
+            try:
+                latest = self.backend.version(sid)
+            except Exception as exc:
+                print(f"⚠️ 读取共享会话版本失败：{sid} -> {exc}")
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if latest is not None and latest != entry.version and not entry.pins:
+                del self._entries[sid]
+                self._bytes -= entry.size
+                self.stats["stale"] += 1
+                return None
+            if not entry.pins:
+                entry.base = len(entry.agent.messages)
+            entry.pins += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(sid)
+            self.stats["hits"] += 1
+            return entry.agent
+
+    def restore(self, sid: str, agent: Any) -> int:
+        """从快照恢复 agent.messages，返回快照版本号（没有快照时为 0）。
+
+        本地模式下读取落盘文件并删除（之后以内存为准）；共享后端模式下读取后端中的最新版本。
+        """
+        if self.backend is not None:
+            try:
+                loaded = self.backend.load(sid)
+                version, snapshot = (loaded[0], decode_snapshot(loaded[1])) if loaded else (0, None)
+            except Exception as exc:
+                print(f"⚠️ 读取共享会话失败：{sid} -> {exc}")
+                version, snapshot = 0, None
+            if snapshot is None:
+                self.stats["misses"] += 1
+                return 0
+            self._apply(agent, snapshot)
+            return version
+        with self._io_lock:
+            with self._lock:
+                # 尚未写盘的快照直接取走，对应的写盘随之取消
+                snapshot = self._spilling.pop(sid, None)
+            if snapshot is None:
+                path = self._spill_path(sid)
+                try:
+                    snapshot = decode_snapshot(path.read_bytes())
+                except FileNotFoundError:
+                    self.stats["misses"] += 1
+                    return 0
+                except Exception:
+                    self.stats["misses"] += 1
+                    path.unlink(missing_ok=True)
+                    return 0
+                path.unlink(missing_ok=True)
+        self._apply(agent, snapshot)
+        return 1
+
+    def _apply(self, agent: Any, snapshot: List[Dict[str, Any]]):
+        agent.messages = self._messages(snapshot)
+        self.stats["restored"] += 1
+
+    def _messages(self, snapshot: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        messages = list(snapshot)
+        if messages and messages[0].get("role") == "system" and messages[0].get("content") is None and self.shared_prompt:
+            messages[0] = {"role": "system", "content": self.shared_prompt}
+        return messages
+
+    def put(self, sid: str, agent: Any, version: int = 0) -> Any:
+        """放入会话并 pin 住（与 acquire 对应，用完调用 release）；version 为 restore 返回的版本号。
+
+        会话已在缓存中（并发的首个请求先一步放入）时不替换，pin 住并返回已有的 agent，调用方应改用返回值。
+        """
+        entry = _Entry(agent, estimate_bytes(agent.messages, self.shared_prompt), version)
+        entry.pins = 1
+        with self._lock:
+            old = self._entries.get(sid)
+            if old is not None:
+                old.pins += 1
+                old.last_used = time.time()
+                self._entries.move_to_end(sid)
+                return old.agent
+            self._entries[sid] = entry
+            self._bytes += entry.size
+        self._evict()
+        return agent
+
+    def release(self, sid: str):
+        """请求结束：解除 pin，按新的消息量更新内存占用，并在超出预算时淘汰。"""
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return
+            entry.pins = max(0, entry.pins - 1)
+            entry.last_used = time.time()
+            # 保持按最近使用排序：_evict 遇到第一个未过期的会话即停止
+            self._entries.move_to_end(sid)
+            size = estimate_bytes(entry.agent.messages, self.shared_prompt)
+            self._bytes += size - entry.size
+            entry.size = size
+            snapshot = self._snapshot(entry.agent.messages) if self.backend is not None else None
+        if snapshot is not None:
+            self._write_through(sid, entry, snapshot)
+        self._evict()
+
+    def _write_through(self, sid: str, entry: _Entry, snapshot: List[Dict[str, Any]]):
+        """写穿到共享后端，其他 worker 据版本号判断是否需要重新加载。
+
+        按 entry.version 比较并交换：其他 worker 已先写入本会话时，重新加载最新状态，把本轮新增的消息
+        （entry.base 之后的部分）接在其后再写，两轮都保留。
+        """
+        started = time.perf_counter()
+        expected, base, merged = entry.version, entry.base, False
+        try:
+            for _ in range(SAVE_CONFLICT_RETRIES + 1):
+                try:
+                    entry.version = self.backend.save(sid, encode_snapshot(snapshot, sid), expected)
+                except VersionConflict:
+                    self.stats["conflicts"] += 1
+                    loaded = self.backend.load(sid)
+                    latest = decode_snapshot(loaded[1]) if loaded else []
+                    expected = loaded[0] if loaded else 0
+                    snapshot = latest + snapshot[base:]
+                    base, merged = len(latest), True
+                    continue
+                metrics.SESSION_WRITE_LATENCY.observe(time.perf_counter() - started, op="shared")
+                with self._lock:
+                    if merged:
+                        entry.agent.messages = self._messages(snapshot)
+                        size = estimate_bytes(entry.agent.messages, self.shared_prompt)
+                        self._bytes += size - entry.size
+                        entry.size = size
+                    entry.base = len(snapshot)
+                return
+            raise RuntimeError(f"版本冲突重试 {SAVE_CONFLICT_RETRIES} 次仍未写入")
+        except Exception as exc:
+            entry.version = -1  # 写入失败：下次按过期处理，从后端重新加载
+            print(f"⚠️ 写入共享会话失败：{sid} -> {exc}")
+
+    def pop(self, sid: str):
+        """删除会话（内存与落盘快照）。"""
+        with self._io_lock:
+            with self._lock:
+                entry = self._entries.pop(sid, None)
+                if entry is not None:
+                    self._bytes -= entry.size
+                self._spilling.pop(sid, None)
+            self._spill_path(sid).unlink(missing_ok=True)
+        if self.backend is not None:
+            try:
+                self.backend.delete(sid)
+            except Exception as exc:
+                print(f"⚠️ 删除共享会话失败：{sid} -> {exc}")
+
+    # ---------- 淘汰与落盘 ----------
+
+    def _evict(self, expired_only: bool = False):
+        now = time.time()
+        victims = []
+        with self._lock:
+            remaining_bytes, remaining = self._bytes, len(self._entries)
+            doomed = []
+            # 从队首（最久未用）开始，遇到既未过期也无需腾空间的会话即停止
+            for sid, entry in self._entries.items():
+                expired = now - entry.last_used > self.ttl
+                over = not expired_only and (remaining_bytes > self.max_bytes or remaining > self.max_sessions)
+                if not expired and not over:
+                    break
+                if entry.pins:
+                    continue
+                doomed.append((sid, entry, expired))
+                remaining_bytes -= entry.size
+                remaining -= 1
+            for sid, entry, expired in doomed:
+                del self._entries[sid]
+                self._bytes -= entry.size
+                self.stats["expired" if expired else "spilled"] += 1
+                if self.backend is not None:
+                    victims.append((sid, None))  # 已在 release 时写入共享后端
+                    continue
+                snapshot = self._snapshot(entry.agent.messages)
+                self._spilling[sid] = snapshot
+                victims.append((sid, snapshot))
+        for sid, snapshot in victims:
+            if snapshot is not None:
+                self._spill(sid, snapshot)
+            if self.on_evict is not None:
+                self.on_evict(sid)
+        if now - self._last_prune > SPILL_PRUNE_INTERVAL:
+            self._last_prune = now
+            self._prune_spill(now)
+
+    def _snapshot(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        snapshot = list(messages)
+        # 默认系统提示词不落盘，恢复时换回当前版本
+        if snapshot and snapshot[0].get("role") == "system" and snapshot[0].get("content") is self.shared_prompt:
+            snapshot[0] = {"role": "system", "content": None}
+        return snapshot
+
+    def _spill(self, sid: str, snapshot: List[Dict[str, Any]]):
+        path = self._spill_path(sid)
+        with self._io_lock:
+            with self._lock:
+                if self._spilling.get(sid) is not snapshot:
+                    return  # 已被 restore 取走或有更新的快照
+                self._spilling.pop(sid, None)
+            started = time.perf_counter()
+            try:
+                self.spill_dir.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(encode_snapshot(snapshot, sid))
+                os.replace(tmp, path)
+                metrics.SESSION_WRITE_LATENCY.observe(time.perf_counter() - started, op="spill")
+            except OSError as exc:
+                print(f"⚠️ 会话落盘失败：{sid} -> {exc}")
+
+    def _spill_path(self, sid: str) -> Path:
+        return self.spill_dir / (hashlib.sha1(sid.encode("utf-8")).hexdigest() + ".json.z")
+
+    def _prune_spill(self, now: float):
+        try:
+            for path in self.spill_dir.glob("*.json.z"):
+                if now - path.stat().st_mtime > SESSION_SPILL_TTL:
+                    path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_sessions": self.max_sessions,
+            "backend": self.backend.name if self.backend is not None else "memory",
+            **self.stats,
+        }
@@ -0,0 +1,255 @@
+"""
+workspace 上传：分块流式写盘（线程池 IO，不阻塞事件循环）+ 临时文件原子改名，
+以及可断点续传的分片上传（init -> PUT 分片 -> complete）。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from tools.file import WORKSPACE, _safe_path
+from tools.workspace_meta import invalidate as invalidate_meta
+
+try:  # 跨进程互斥（多个 worker 可能同时收到同一上传任务的分片）
+    import fcntl
+except Exception:  # pragma: no cover - Windows
+    fcntl = None
+
+# 每次读取/写入的块大小与单文件上限
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+# 临时目录放在 workspace 内，保证与目标在同一文件系统，os.replace 才是原子的
+UPLOAD_TMP_DIR = os.path.join(WORKSPACE, ".uploads")
+
+
+def _tmp_dir() -> str:
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    return UPLOAD_TMP_DIR
+
+
+def _resolve_dest(path: str, filename: str) -> str:
+    name = os.path.basename(filename or "")
+    if not name or name in (".", ".."):
+        raise HTTPException(status_code=400, detail="文件名无效")
+    try:
+        return _safe_path(os.path.join(path, name))
+    except PermissionError as exc:
+        raise HTTPException(status_code=403, detail=str(exc))
+
+
+def _metrics(nbytes: int, started: float) -> Dict[str, Any]:
+    seconds = max(time.perf_counter() - started, 1e-6)
+    return {"bytes": nbytes, "seconds": round(seconds, 4), "mb_per_s": round(nbytes / seconds / 1024 / 1024, 2)}
+
+
+def _finalize(tmp_path: str, dest: str):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(tmp_path, dest)
+    invalidate_meta(dest)
+
+
+async def _write_stream(chunks: AsyncIterator[bytes], f, hasher, limit: int, already: int = 0) -> int:
+    """把异步字节流写入已打开的文件，超过 limit 时抛 413；返回本次写入字节数。"""
+    written = 0
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if already + written + len(chunk) > limit:
+            raise HTTPException(status_code=413, detail=f"文件超过大小上限 {limit} 字节")
+        await run_in_threadpool(f.write, chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        written += len(chunk)
+    return written
+
+
+async def _iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def save_upload(path: str, file: UploadFile, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """单请求上传：按块写入临时文件，校验后原子改名到目标位置，内存占用与文件大小无关。"""
+    dest = _resolve_dest(path, file.filename)
+    tmp_path = os.path.join(_tmp_dir(), f"{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    started = time.perf_counter()
+    try:
+        f = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            nbytes = await _write_stream(_iter_upload(file), f, hasher, UPLOAD_MAX_BYTES)
+        finally:
+            await run_in_threadpool(f.close)
+        digest = hasher.hexdigest()
+        if sha256 and sha256.lower() != digest:
+            raise HTTPException(status_code=422, detail=f"校验失败：期望 {sha256}，实际 {digest}")
+        await run_in_threadpool(_finalize, tmp_path, dest)
+    except HTTPException:
+        await run_in_threadpool(_remove_quietly, tmp_path)
+        raise
+    except Exception as exc:
+        await run_in_threadpool(_remove_quietly, tmp_path)
+        raise HTTPException(status_code=500, detail=f"写入失败: {exc}")
+    return {"dest": os.path.realpath(dest), "sha256": digest, **_metrics(nbytes, started)}
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ---------- 分片 / 断点续传 ----------
+
+
+def _state_path(upload_id: str) -> str:
+    if not upload_id.isalnum():
+        raise HTTPException(status_code=400, detail="upload_id 无效")
+    return os.path.join(_tmp_dir(), f"{upload_id}.json")
+
+
+def _part_path(upload_id: str) -> str:
+    return os.path.join(_tmp_dir(), f"{upload_id}.part")
+
+
+def _lock_path(upload_id: str) -> str:
+    return os.path.join(_tmp_dir(), f"{upload_id}.lock")
+
+
+# 进程内按 upload_id 的锁；上传任务不再被引用时自动回收
+_LOCKS: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _flock(path: str):
+    f = open(path, "a+")
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    return f
+
+
+@asynccontextmanager
+async def _upload_lock(upload_id: str):
+    """串行化同一上传任务的写入：进程内 asyncio.Lock + 跨进程 flock（阻塞等待放到线程池）。"""
+    _state_path(upload_id)  # 校验 upload_id，避免拼出任意锁文件路径
+    lock = _LOCKS.get(upload_id)
+    if lock is None:
+        lock = _LOCKS[upload_id] = asyncio.Lock()
+    async with lock:
+        lock_file = await run_in_threadpool(_flock, _lock_path(upload_id))
+        try:
+            yield
+        finally:
+            lock_file.close()  # 关闭即释放 flock
+
+
+def _load_state(upload_id: str) -> Dict[str, Any]:
+    path = _state_path(upload_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="上传任务不存在或已完成")
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    part = _part_path(upload_id)
+    state["received"] = os.path.getsize(part) if os.path.exists(part) else 0
+    return state
+
+
+def _save_state(state: Dict[str, Any]):
+    tmp = _state_path(state["upload_id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in state.items() if k != "received"}, f, ensure_ascii=False)
+    os.replace(tmp, _state_path(state["upload_id"]))
+
+
+def init_upload(path: str, filename: str, size: int, sha256: Optional[str] = None) -> Dict[str, Any]:
+    if size < 0 or size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"文件超过大小上限 {UPLOAD_MAX_BYTES} 字节")
+    dest = _resolve_dest(path, filename)
+    state = {
+        "upload_id": uuid.uuid4().hex,
+        "path": path,
+        "filename": os.path.basename(filename),
+        "dest": dest,
+        "size": size,
+        "sha256": (sha256 or "").lower() or None,
+        "created_at": time.time(),
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+    }
+    _save_state(state)
+    open(_part_path(state["upload_id"]), "wb").close()
+    state["received"] = 0
+    return state
+
+
+def upload_status(upload_id: str) -> Dict[str, Any]:
+    return _load_state(upload_id)
+
+
+async def append_chunk(upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """
+    追加一个分片；offset 必须等于已接收字节数，否则返回 409 与当前进度，客户端据此续传。
+    同一任务的分片串行写入，加锁后按磁盘上的实际大小重新校验 offset：超时重试等并发的重复分片只有一个会被追加。
+    """
+    async with _upload_lock(upload_id):
+        state = await run_in_threadpool(_load_state, upload_id)
+        if offset != state["received"]:
+            raise HTTPException(status_code=409, detail={"message": "偏移不匹配", "received": state["received"]})
+        started = time.perf_counter()
+        f = await run_in_threadpool(open, _part_path(upload_id), "ab")
+        try:
+            written = await _write_stream(chunks, f, None, state["size"], already=state["received"])
+        finally:
+            await run_in_threadpool(f.close)
+    state["received"] += written
+    return {"upload_id": upload_id, "received": state["received"], "size": state["size"], **_metrics(written, started)}
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+async def complete_upload(upload_id: str) -> Dict[str, Any]:
+    async with _upload_lock(upload_id):
+        state = await run_in_threadpool(_load_state, upload_id)
+        if state["received"] != state["size"]:
+            raise HTTPException(status_code=409, detail={"message": "文件尚未传输完整", "received": state["received"]})
+        part = _part_path(upload_id)
+        digest = await run_in_threadpool(_sha256_file, part)
+        if state.get("sha256") and state["sha256"] != digest:
+            raise HTTPException(status_code=422, detail=f"校验失败：期望 {state['sha256']}，实际 {digest}")
+        await run_in_threadpool(_finalize, part, state["dest"])
+        await run_in_threadpool(_remove_quietly, _state_path(upload_id))
+        await run_in_threadpool(_remove_quietly, _lock_path(upload_id))
+    return {
+        "ok": True,
+        "path": state["path"],
+        "filename": state["filename"],
+        "dest": os.path.realpath(state["dest"]),
+        "size": state["size"],
+        "sha256": digest,
+        "seconds_since_init": round(time.time() - state["created_at"], 2),
+    }
+
+
+def abort_upload(upload_id: str) -> Dict[str, Any]:
+    _load_state(upload_id)
+    _remove_quietly(_part_path(upload_id))
+    _remove_quietly(_state_path(upload_id))
+    _remove_quietly(_lock_path(upload_id))
+    return {"ok": True, "upload_id": upload_id}
@@ -0,0 +1,6 @@
+"""
+离线基准测试：合成菜谱语料 + hash 向量化后端 + 模拟模型服务 + 本地 MCP server。
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.compare baseline.json bench.json --threshold 0.2
+"""
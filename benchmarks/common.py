@@ -0,0 +1,71 @@
+"""基准测试通用工具：计时、分位数与结果收集。"""
+
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round((len(ordered) - 1) * pct)), len(ordered) - 1)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+class Results:
+    """扁平的指标表：name -> {value, unit, better}；better 为 lower/higher，用于跨提交比较。"""
+
+    def __init__(self, params: Dict[str, Any]):
+        self.meta = {
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": params,
+        }
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        self.errors: Dict[str, str] = {}
+
+    def add(self, name: str, value: Optional[float], unit: str, better: str = "lower"):
+        if value is None:
+            return
+        self.metrics[name] = {"value": round(float(value), 4), "unit": unit, "better": better}
+        print(f"  {name:<48} {value:>12.3f} {unit}")
+
+    def add_latencies(self, prefix: str, seconds: List[float]):
+        """记录 p50/p99（毫秒）。"""
+        ms = [s * 1000 for s in seconds]
+        self.add(f"{prefix}.p50_ms", percentile(ms, 0.5), "ms")
+        self.add(f"{prefix}.p99_ms", percentile(ms, 0.99), "ms")
+
+    def fail(self, suite: str, exc: BaseException):
+        self.errors[suite] = f"{exc.__class__.__name__}: {exc}"
+        print(f"  ⚠️ {suite} 失败：{self.errors[suite]}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"meta": self.meta, "metrics": self.metrics, "errors": self.errors}
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,87 @@
+"""
+比较两次基准结果，超过阈值的退化以非零退出码返回（可用于 CI）：
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.2
+    python -m benchmarks.compare baseline.json current.json --thresholds thresholds.json
+
+thresholds.json 为 {指标名或前缀: 相对阈值}，按最长前缀匹配，未匹配的使用 --threshold。
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+
+def _load(path: str) -> Dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _threshold_for(name: str, default: float, overrides: Dict[str, float]) -> float:
+    best: Optional[Tuple[int, float]] = None
+    for prefix, value in overrides.items():
+        if name.startswith(prefix) and (best is None or len(prefix) > best[0]):
+            best = (len(prefix), float(value))
+    return best[1] if best else default
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, overrides: Dict[str, float], min_abs_ms: float = 1.0) -> List[Dict]:
+    """返回每个共同指标的比较结果；change 为“变差”方向的相对变化（正数表示退化）。"""
+    rows = []
+    base_metrics, cur_metrics = baseline.get("metrics", {}), current.get("metrics", {})
+    for name in sorted(set(base_metrics) & set(cur_metrics)):
+        base, cur = base_metrics[name], cur_metrics[name]
+        b, c = base["value"], cur["value"]
+        better = cur.get("better", "lower")
+        if b == 0:
+            change = 0.0 if c == 0 else float("inf")
+        else:
+            change = (c - b) / abs(b) if better == "lower" else (b - c) / abs(b)
+        limit = _threshold_for(name, threshold, overrides)
+        # 毫秒级指标的绝对变化过小时视为噪声
+        noise = cur.get("unit") == "ms" and abs(c - b) < min_abs_ms
+        rows.append(
+            {
+                "metric": name,
+                "baseline": b,
+                "current": c,
+                "unit": cur.get("unit", ""),
+                "change": change,
+                "threshold": limit,
+                "regressed": change > limit and not noise,
+            }
+        )
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="比较两次基准结果")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.2, help="默认相对退化阈值（0.2 = 20%%）")
+    parser.add_argument("--thresholds", help="按指标前缀覆盖阈值的 JSON 文件")
+    parser.add_argument("--min-abs-ms", type=float, default=1.0, help="毫秒指标的最小绝对变化")
+    args = parser.parse_args(argv)
+
+    overrides = _load(args.thresholds) if args.thresholds else {}
+    baseline, current = _load(args.baseline), _load(args.current)
+    rows = compare(baseline, current, args.threshold, overrides, args.min_abs_ms)
+
+    print(f"baseline {baseline['meta'].get('commit')}  ->  current {current['meta'].get('commit')}")
+    for row in rows:
+        flag = "❌" if row["regressed"] else ("✅" if row["change"] < -row["threshold"] else "  ")
+        print(
+            f"{flag} {row['metric']:<48} {row['baseline']:>12.3f} -> {row['current']:>12.3f} {row['unit']:<8}"
+            f" {row['change'] * 100:+7.1f}% (阈值 {row['threshold'] * 100:.0f}%)"
+        )
+    missing = sorted(set(baseline.get("metrics", {})) - set(current.get("metrics", {})))
+    if missing:
+        print(f"当前结果缺少 {len(missing)} 项指标：{', '.join(missing[:10])}")
+    regressions = [r for r in rows if r["regressed"]]
+    print(f"{len(rows)} 项指标，{len(regressions)} 项退化超过阈值")
+    return 1 if regressions or current.get("errors") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""合成 Markdown 菜谱语料：结构与 rag/data（HowToCook）一致（分类目录、标题、原料、步骤）。"""
+
+import random
+from pathlib import Path
+
+CATEGORIES = ["meat_dish", "vegetable_dish", "soup", "staple", "breakfast", "dessert", "aquatic"]
+INGREDIENTS = ["鸡蛋", "番茄", "土豆", "猪肉", "牛肉", "鸡翅", "豆腐", "青椒", "洋葱", "大蒜", "生姜", "米饭", "面条", "虾仁", "白菜", "胡萝卜"]
+METHODS = ["炒", "炖", "煮", "蒸", "烤", "煎", "焖", "凉拌"]
+STEPS = [
+    "将{a}洗净切块备用",
+    "锅中倒油烧至七成热，放入{b}翻炒",
+    "加入适量盐和生抽调味",
+    "小火{m}{n}分钟至入味",
+    "出锅前撒上葱花",
+    "{a}焯水后捞出沥干",
+    "把{b}和{a}一起下锅",
+]
+
+
+def dish_names(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(n):
+        a, b = rng.sample(INGREDIENTS, 2)
+        yield f"{rng.choice(METHODS)}{a}{b}{i}", a, b
+
+
+def generate_corpus(out_dir: Path, n_docs: int, seed: int = 0) -> Path:
+    """生成 n_docs 篇菜谱到 out_dir/dishes/<分类>/，返回数据目录。"""
+    rng = random.Random(seed)
+    root = Path(out_dir)
+    for idx, (name, a, b) in enumerate(dish_names(n_docs, seed)):
+        category = CATEGORIES[idx % len(CATEGORIES)]
+        folder = root / "dishes" / category
+        folder.mkdir(parents=True, exist_ok=True)
+        steps = "\n".join(
+            f"{i}. " + rng.choice(STEPS).format(a=a, b=b, m=rng.choice(METHODS), n=rng.randint(3, 30))
+            for i in range(1, rng.randint(4, 9))
+        )
+        stars = "★" * rng.randint(1, 5)
+        text = (
+            f"# {name}的做法\n\n{name}是一道家常菜，预估烹饪难度：{stars}\n\n"
+            f"## 必备原料和工具\n\n- {a}\n- {b}\n- 食用油\n- 盐\n\n"
+            f"## 计算\n\n每份 {a} {rng.randint(100, 500)}g，{b} {rng.randint(50, 300)}g\n\n"
+            f"## 操作\n\n{steps}\n\n## 附加内容\n\n{a}与{b}搭配口感更佳。\n"
+        )
+        (folder / f"{name}.md").write_text(text, encoding="utf-8")
+    return root
+
+
+def sample_queries(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [f"{rng.choice(METHODS)}{rng.choice(INGREDIENTS)}怎么做" for _ in range(n)]
@@ -0,0 +1,105 @@
+"""
+运行基准并输出 JSON：
+
+    python -m benchmarks.run --out bench.json                 # 全部
+    python -m benchmarks.run --suites rag,session --quick     # 快速子集
+
+默认使用 hash 向量化后端（RAG_EMBED_BACKEND 已设置时沿用），全程不访问外部网络。
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+# 需在导入 rag 之前确定向量化后端
+os.environ.setdefault("RAG_EMBED_BACKEND", "hash")
+
+from benchmarks.common import Results  # noqa: E402
+from benchmarks import suites  # noqa: E402
+
+# config 要求的密钥在离线基准中用占位值（模型与搜索均不访问外部服务）
+for _key, _value in suites.BENCH_ENV_DEFAULTS.items():
+    os.environ.setdefault(_key, _value)
+
+ALL_SUITES = ("rag", "mcp", "chat", "session")
+
+
+def _ints(value: str):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="myagentbymcp 离线基准测试")
+    parser.add_argument("--suites", default=",".join(ALL_SUITES), help=f"逗号分隔，可选：{', '.join(ALL_SUITES)}")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--quick", action="store_true", help="缩小规模，用于冒烟检查")
+    parser.add_argument("--sizes", default="200,1000", help="RAG 语料规模（文档数）")
+    parser.add_argument("--backends", default=",".join(suites.RAG_BACKENDS), help="RAG 索引后端")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--mcp-calls", type=int, default=10)
+    parser.add_argument("--mcp-servers", type=int, default=3)
+    parser.add_argument("--chat-requests", type=int, default=200)
+    parser.add_argument("--chat-concurrency", type=int, default=8)
+    parser.add_argument("--chat-tool-requests", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--session-sizes", default="10,1000")
+    parser.add_argument("--session-writes", type=int, default=50)
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.sizes, args.queries, args.mcp_calls, args.mcp_servers = "100", 30, 3, 2
+        args.chat_requests, args.chat_concurrency, args.chat_tool_requests = 40, 4, 4
+        args.session_sizes, args.session_writes = "10,200", 10
+
+    selected = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = set(selected) - set(ALL_SUITES)
+    if unknown:
+        parser.error(f"未知 suite：{', '.join(sorted(unknown))}")
+
+    results = Results({k: v for k, v in vars(args).items() if k not in ("out", "keep_workdir")})
+    results.meta["embed_backend"] = os.environ["RAG_EMBED_BACKEND"]
+    workdir = suites.make_workdir()
+    rag_info = {}
+    started = time.perf_counter()
+    try:
+        if "rag" in selected:
+            print("== rag")
+            try:
+                rag_info = suites.run_rag(results, workdir, _ints(args.sizes), args.queries, args.backends.split(","))
+            except Exception as exc:
+                results.fail("rag", exc)
+        if "mcp" in selected:
+            print("== mcp")
+            collections = rag_info.get("collections") or []
+            try:
+                suites.run_mcp(results, workdir, args.mcp_calls, args.mcp_servers, collections[-1] if collections else None)
+            except Exception as exc:
+                results.fail("mcp", exc)
+        if "chat" in selected:
+            print("== chat")
+            try:
+                suites.run_chat(results, workdir, args.chat_requests, args.chat_concurrency, False, args.llm_latency_ms)
+                suites.run_chat(results, workdir, args.chat_tool_requests, args.chat_concurrency, True, args.llm_latency_ms)
+            except Exception as exc:
+                results.fail("chat", exc)
+        if "session" in selected:
+            print("== session")
+            try:
+                suites.run_session(results, workdir, _ints(args.session_sizes), args.session_writes)
+            except Exception as exc:
+                results.fail("session", exc)
+    finally:
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results.meta["elapsed_s"] = round(time.perf_counter() - started, 2)
+    results.save(args.out)
+    print(f"结果已写入 {args.out}（{len(results.metrics)} 项指标，{len(results.errors)} 个失败）")
+    return 1 if results.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+各项基准：
+- rag：索引构建吞吐、检索延迟（按语料规模与索引后端 store/faiss/numpy/json）
+- mcp：MCPClient.call_tool 往返、MultiMCPClient 工具发现耗时
+- chat：/chat 在并发下的 rps 与 p50/p99（模拟模型服务 + 本地 MCP server）
+- session：会话持久化写入成本（随已有会话数量变化）
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.common import PROJECT_ROOT, Results, free_port
+from benchmarks.corpus import generate_corpus, sample_queries
+
+# 本地 MCP server 子进程需要的环境（mcp 默认只继承少量安全变量）
+BENCH_ENV_DEFAULTS = {"DEEPSEEK_API_KEY": "bench", "TAVILY_API_KEY": "bench"}
+
+# store 使用 int8 压缩存储；其余三种为原有的 float32 索引
+RAG_BACKENDS = {
+    "store": {"index_type": "auto", "storage": "int8"},
+    "faiss": {"index_type": "faiss", "storage": "float32"},
+    "numpy": {"index_type": "numpy", "storage": "float32"},
+    "json": {"index_type": "json", "storage": "float32"},
+}
+
+
+def _bench_env(extra: Dict[str, str] = None) -> Dict[str, str]:
+    env = {**BENCH_ENV_DEFAULTS, **os.environ}
+    env.update(extra or {})
+    return env
+
+
+def _server_config(name: str, env: Dict[str, str]) -> Dict[str, Any]:
+    # 使用当前解释器启动 MCP server，保证与基准进程相同的虚拟环境
+    return {"name": name, "command": sys.executable, "args": ["mcp_server.py"], "cwd": PROJECT_ROOT, "env": env}
+
+
+def _checked_call(client, name: str, arguments: Dict[str, Any]) -> str:
+    text = client.call_tool(name, arguments)
+    if text.startswith(("工具调用失败", "工具调用超时", "工具执行失败")):
+        raise RuntimeError(f"{name}: {text[:200]}")
+    return text
+
+
+def _collection_name(size: int, backend: str) -> str:
+    return f"bench_{backend}_{size}"
+
+
+def run_rag(results: Results, workdir: Path, sizes: List[int], queries: int, backends: List[str]) -> Dict[str, Any]:
+    from rag.collection import CollectionConfig, register_collection
+    from rag.engine import get_manager
+    from rag.index_construction import faiss
+    from rag.retrieval import search
+
+    collections = []
+    qs = sample_queries(queries)
+    for size in sizes:
+        data_dir = generate_corpus(workdir / f"corpus_{size}", size)
+        for backend in backends:
+            if backend == "faiss" and faiss is None:
+                print("  (跳过 faiss：未安装 faiss-cpu)")
+                continue
+            name = _collection_name(size, backend)
+            cfg = CollectionConfig(
+                name=name,
+                data_dir=data_dir,
+                index_dir=workdir / "index" / name,
+                **RAG_BACKENDS[backend],
+            )
+            register_collection(cfg)
+            collections.append(cfg.to_dict())
+            engine = get_manager().get(name)
+
+            started = time.perf_counter()
+            built = engine.build()
+            elapsed = time.perf_counter() - started
+            prefix = f"rag.{backend}.{size}"
+            results.add(f"{prefix}.build_s", elapsed, "s")
+            results.add(f"{prefix}.build_chunks_per_s", built["chunks"] / elapsed if elapsed else None, "chunks/s", "higher")
+
+            # 首次检索包含加载索引，单独记录
+            started = time.perf_counter()
+            search(qs[0], collection=name, min_score=0.0)
+            results.add(f"{prefix}.first_search_ms", (time.perf_counter() - started) * 1000, "ms")
+            latencies = []
+            for q in qs:
+                started = time.perf_counter()
+                search(q, collection=name, min_score=0.0)
+                latencies.append(time.perf_counter() - started)
+            results.add_latencies(f"{prefix}.search", latencies)
+            results.add(f"{prefix}.resident_mb", engine.resident_bytes() / 1024 / 1024, "MB")
+    return {"collections": collections}
+
+
+def run_mcp(results: Results, workdir: Path, calls: int, servers: int, rag_collection: Dict[str, Any] = None):
+    from mcp_client import MCPClient
+    from multi_mcp_client import MultiMCPClient
+
+    env_extra = {}
+    if rag_collection:
+        collections_file = workdir / "collections.json"
+        collections_file.write_text(json.dumps({"collections": [rag_collection]}, ensure_ascii=False), encoding="utf-8")
+        env_extra["RAG_COLLECTIONS_FILE"] = str(collections_file)
+    env = _bench_env(env_extra)
+    client = MCPClient(command=sys.executable, args=["mcp_server.py"], cwd=PROJECT_ROOT, env=env, call_timeout=60)
+
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        _checked_call(client, "get_current_datetime", {})
+        latencies.append(time.perf_counter() - started)
+    results.add_latencies("mcp.call_tool.datetime", latencies)
+
+    if rag_collection:
+        latencies = []
+        for q in sample_queries(calls, seed=7):
+            started = time.perf_counter()
+            _checked_call(client, "rag_search", {"query": q, "collection": rag_collection["name"]})
+            latencies.append(time.perf_counter() - started)
+        results.add_latencies("mcp.call_tool.rag_search", latencies)
+
+    config = [_server_config(f"s{i}", env) for i in range(servers)]
+    started = time.perf_counter()
+    tools = MultiMCPClient(config).get_openai_tools()
+    results.add(f"mcp.discovery.{servers}_servers_ms", (time.perf_counter() - started) * 1000, "ms")
+    results.add("mcp.discovery.tools", len(tools), "tools", "higher")
+
+
+def _start_backend(port: int, mcp_env: Dict[str, str]):
+    """在当前进程内用 uvicorn 启动后端；会话共享的 MCP 客户端只接入本地 MCP server，会话文件写到临时目录。"""
+    import uvicorn
+
+    import backend.server as server
+    from multi_mcp_client import MultiMCPClient
+
+    server._MCP_CLIENT = MultiMCPClient([_server_config("local", mcp_env)])
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    uv = uvicorn.Server(config)
+    threading.Thread(target=uv.run, name="bench-backend", daemon=True).start()
+    for _ in range(100):
+        if uv.started:
+            break
+        time.sleep(0.05)
+    return uv
+
+
+def run_chat(results: Results, workdir: Path, requests: int, concurrency: int, with_tools: bool, latency_ms: float):
+    import httpx
+
+    import backend.server as server
+    import mock_llm_server
+
+    final_only = {"turns": [{"content": "<final_answer>{last_user}</final_answer>"}]}
+    script = mock_llm_server.DEFAULT_SCRIPT if with_tools else final_only
+    llm_port, api_port = free_port(), free_port()
+    mock = mock_llm_server.serve(port=llm_port, script=script, latency_ms=latency_ms)
+
+    # 模型调用层读取环境变量，需在创建默认 ModelClient 之前设置
+    import llm_client
+
+    llm_client._DEFAULT = llm_client.ModelClient(base_url=f"http://127.0.0.1:{llm_port}/v1", api_key="bench")
+    server.SESSION_FILE = workdir / "chat_sessions.json"
+    uv = _start_backend(api_port, _bench_env())
+    label = "chat.tools" if with_tools else "chat.no_tools"
+    try:
+        url = f"http://127.0.0.1:{api_port}/chat"
+        sessions = [f"bench-{label}-{i}" for i in range(concurrency)]
+        with httpx.Client(timeout=120, limits=httpx.Limits(max_connections=concurrency)) as http:
+            # 预热：创建会话（含 MCP 工具发现），不计入稳态指标
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(lambda sid: http.post(url, json={"session_id": sid, "message": "预热"}), sessions))
+            results.add(f"{label}.warmup_s", time.perf_counter() - started, "s")
+
+            def one(i: int) -> float:
+                t0 = time.perf_counter()
+                resp = http.post(url, json={"session_id": sessions[i % concurrency], "message": f"问题{i}"})
+                resp.raise_for_status()
+                return time.perf_counter() - t0
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                latencies = list(pool.map(one, range(requests)))
+            wall = time.perf_counter() - started
+        results.add(f"{label}.c{concurrency}.rps", requests / wall, "req/s", "higher")
+        results.add_latencies(f"{label}.c{concurrency}", latencies)
+        results.add(f"{label}.llm_requests", mock.mock.requests, "requests")
+    finally:
+        uv.should_exit = True
+        mock.shutdown()
+
+
+def run_session(results: Results, workdir: Path, sizes: List[int], writes: int):
+    import backend.server as server
+
+    for size in sizes:
+        server.SESSION_FILE = workdir / f"sessions_{size}.json"
+        server._save_session_store(
+            {f"s{i}": {"summary": "历史摘要" * 20, "recent": [{"role": "user", "content": "你好" * 50}] * 6} for i in range(size)}
+        )
+        latencies = []
+        for i in range(writes):
+            started = time.perf_counter()
+            server._append_history(f"s{i % size}", "新的问题" * 10, "新的回答" * 40, ["local__rag_search"])
+            latencies.append(time.perf_counter() - started)
+        results.add_latencies(f"session.append.{size}_sessions", latencies)
+        results.add(f"session.file.{size}_sessions_kb", server.SESSION_FILE.stat().st_size / 1024, "KB")
+
+
+def make_workdir() -> Path:
+    return Path(tempfile.mkdtemp(prefix="myagent-bench-"))
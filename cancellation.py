@@ -0,0 +1,77 @@
+"""
+请求取消：/chat/session/{id}/cancel 之后在毫秒级释放请求占用的资源，而不是等当前模型/工具调用自然结束。
+
+- 模型调用：ModelClient 把非流式请求放到后台事件循环上的 AsyncOpenAI 执行，调用线程等待结果时每 CHECK_INTERVAL
+  检查一次取消标记；取消时直接取消协程，httpx 随之中止请求并丢弃该连接。流式请求在取消时关闭响应流。
+- MCP 工具调用：MCPClient 在调用的事件循环里监视取消标记，先发送 notifications/cancelled 再放弃等待；server 收到后
+  取消处理协程并置位该请求的协作式取消事件（tool_cancelled()），同步工具在安全点检查后提前返回，
+  server 进程随 stdin 关闭立即退出，不再拖住客户端。
+- 从发起取消到请求释放的耗时计入 myagent_cancel_to_free_seconds。
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, Future, wait
+from contextvars import ContextVar
+from typing import Any, Iterable, Optional, Set, Tuple
+
+import metrics
+
+CHECK_INTERVAL = float(os.getenv("CANCEL_CHECK_INTERVAL", "0.05"))
+
+
+class Cancelled(Exception):
+    """请求已被调用方取消。"""
+
+
+class CancelFlag(threading.Event):
+    """记录置位时间的 threading.Event，用于统计取消到释放的耗时。"""
+
+    set_at: Optional[float] = None
+
+    def set(self):
+        self.set_at = time.time()
+        super().set()
+
+    def clear(self):
+        self.set_at = None
+        super().clear()
+
+
+def observe_freed(flag: Any):
+    """请求结束、资源释放后调用：若请求是被取消的，记录从发起取消到释放的耗时。"""
+    set_at = getattr(flag, "set_at", None)
+    if set_at is not None and flag.is_set():
+        metrics.CANCEL_TO_FREE.observe(max(time.time() - set_at, 0.0))
+
+
+def wait_futures(
+    futures: Iterable[Future], cancel: Any, timeout: Optional[float] = None, return_when: str = ALL_COMPLETED
+) -> Tuple[Set[Future], Set[Future]]:
+    """concurrent.futures.wait 的可取消版本：取消标记置位时取消所有 future 并抛出 Cancelled。"""
+    pending = set(futures)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        step = CHECK_INTERVAL if deadline is None else min(CHECK_INTERVAL, max(deadline - time.monotonic(), 0.0))
+        done, not_done = wait(pending, timeout=step, return_when=return_when)
+        if not not_done or (done and return_when != ALL_COMPLETED):
+            return done, not_done
+        if cancel.is_set():
+            for fut in not_done:
+                fut.cancel()
+            raise Cancelled("请求已取消")
+        if deadline is not None and time.monotonic() >= deadline:
+            return done, not_done
+
+
+# ---------- 工具侧（MCP server 进程内）----------
+
+# 当前工具调用的协作式取消事件，由 mcp_server 在收到 notifications/cancelled 时置位
+tool_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("tool_cancel_event", default=None)
+
+
+def tool_cancelled() -> bool:
+    """长耗时的同步工具在循环中调用，为 True 时应尽快返回。"""
+    event = tool_cancel_event.get()
+    return event is not None and event.is_set()
@@ -4,6 +4,8 @@ import os
 
 load_dotenv(".env")
 
+from llm_client import LLM_BASE_URL, LLM_MAX_RETRIES, LLM_MODEL, LLM_TIMEOUT  # noqa: E402 - 需在加载 .env 之后读取
+
 
 def require_env(key: str) -> str:
     value = os.getenv(key)
@@ -13,9 +15,13 @@ def require_env(key: str) -> str:
 
 
 DEEPSEEK_API_KEY = require_env("DEEPSEEK_API_KEY")
+# 与 Agent 共用 llm_client 中的环境配置（地址、模型、超时、重试次数）
 llm = ChatDeepSeek(
-    model="deepseek-chat",
-    temperature=0.3
+    model=LLM_MODEL,
+    temperature=0.3,
+    api_base=LLM_BASE_URL,
+    timeout=LLM_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES,
 )
 
 TAVILY_API_KEY = require_env("TAVILY_API_KEY")
\ No newline at end of file
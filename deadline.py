@@ -0,0 +1,78 @@
+"""
+端到端请求时限：由 HTTP 请求（或调用方）设定一次，Agent 的每一轮、每次模型调用与 MCP 工具调用都从剩余预算中扣减。
+
+- scope(timeout) 在当前上下文设置时限（contextvar，随 anyio / to_thread 复制到子任务）；嵌套时只会收紧不会放宽。
+- clamp(timeout) 把各处原有的固定超时收紧到剩余预算，未设置时限时原样返回。
+- 时限耗尽时抛出 DeadlineExceeded（TimeoutError 子类），并计入 myagent_deadline_exceeded_total{stage}。
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import metrics
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求的总时限已用完。"""
+
+
+class Deadline:
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(self.at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.at
+
+    def clamp(self, timeout: Optional[float]) -> float:
+        remaining = self.remaining()
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def scope(timeout: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """在 with 块内生效的时限；timeout 为空时沿用外层时限（可能为 None）。"""
+    outer = _current.get()
+    if timeout is None or timeout <= 0 or (outer is not None and outer.remaining() <= timeout):
+        yield outer
+        return
+    token = _current.set(Deadline(timeout))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def remaining() -> Optional[float]:
+    dl = _current.get()
+    return dl.remaining() if dl is not None else None
+
+
+def clamp(timeout: Optional[float]) -> Optional[float]:
+    dl = _current.get()
+    return timeout if dl is None else dl.clamp(timeout)
+
+
+def check(stage: str):
+    """时限已用完时计数并抛出 DeadlineExceeded。"""
+    dl = _current.get()
+    if dl is not None and dl.expired:
+        exceeded(stage)
+        raise DeadlineExceeded(f"请求已超过 {dl.timeout:g} 秒时限（{stage}）")
+
+
+def exceeded(stage: str):
+    metrics.DEADLINE_EXCEEDED.inc(stage=stage)
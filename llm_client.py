@@ -0,0 +1,282 @@
+"""
+统一的模型调用层：Agent 与 modules 链共用同一套环境配置（地址、模型、超时、重试）。
+
+- 重试：超时/连接错误/429/5xx 按指数退避 + 全抖动（full jitter）重试，优先遵循 Retry-After。
+- 对冲：设置 LLM_HEDGE_DELAY>0 时，非流式请求超过该延迟仍未返回则并行发出第二个相同请求，先返回者胜出
+  （落后的请求仅在可取消模式下被中止，否则会多消耗一次 token，默认关闭）。
+- 取消：传入 cancel（threading.Event 兼容对象）时，非流式请求在后台事件循环上经 AsyncOpenAI 发出，
+  等待期间每 cancellation.CHECK_INTERVAL 检查一次，取消时中止进行中的 HTTP 请求并抛出 Cancelled，不再占用线程等它返回。
+- 时限：在 deadline.scope() 内调用时，单次超时收紧到请求剩余预算，退避等待超出剩余预算时不再重试。
+- 指标：记录每次调用的延迟、尝试次数、是否对冲与 token 用量，summary() 汇总 p50/p95。
+- 上下文缓存：记录响应中命中供应商前缀缓存的 prompt token（DeepSeek 的 prompt_cache_hit_tokens，
+  或 OpenAI 兼容的 prompt_tokens_details.cached_tokens），用于核对请求前缀是否足够稳定。
+
+DEEPSEEK_API_BASE 指向 mock_llm_server.py 即可离线压测完整 Agent 循环。
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+import anyio.from_thread
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+import cancellation
+import deadline
+import metrics
+import tracing
+
+LLM_BASE_URL = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# 0 表示不对冲
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+METRICS_WINDOW = 500
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def cached_prompt_tokens(usage: Any) -> Optional[int]:
+    """响应 usage 中命中前缀缓存的 prompt token 数；供应商未返回时为 None。"""
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit = getattr(details, "cached_tokens", None) if details is not None else None
+    return int(hit) if hit is not None else None
+
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_DELAY, cap: float = LLM_RETRY_MAX_DELAY) -> float:
+    """全抖动指数退避：在 [0, min(cap, base * 2^attempt)] 中均匀取值，避免重试同步成峰。"""
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+
+class ModelClient:
+    """OpenAI 兼容接口的封装，线程安全，可被多个会话共享（复用同一连接池）。"""
+
+    def __init__(
+        self,
+        client: Optional[OpenAI] = None,
+        model: str = LLM_MODEL,
+        base_url: str = LLM_BASE_URL,
+        api_key: Optional[str] = None,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        hedge_delay: float = LLM_HEDGE_DELAY,
+    ):
+        # SDK 自带重试关闭，由本层统一处理重试与抖动
+        self.client = client or OpenAI(
+            api_key=api_key or os.getenv("DEEPSEEK_API_KEY", ""),
+            base_url=base_url,
+            max_retries=0,
+        )
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self._calls: deque = deque(maxlen=METRICS_WINDOW)
+        self._lock = threading.Lock()
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        # 可取消请求使用的后台事件循环与异步客户端，首次需要时创建
+        self._portal_cm = None
+        self._portal = None
+        self._aclient: Optional[AsyncOpenAI] = None
+
+    @property
+    def chat(self):
+        """兼容直接使用 OpenAI 客户端的代码（client.chat.completions.create）。"""
+        return self.client.chat
+
+    # ---------- 调用 ----------
+
+    def create(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None, cancel: Any = None, **kwargs):
+        """chat.completions.create，附带重试、对冲、取消与指标；stream=True 时返回流且不对冲、不可中途取消。"""
+        params: Dict[str, Any] = {"model": kwargs.pop("model", self.model), "messages": messages, **kwargs}
+        if tools:
+            params["tools"] = tools
+        params.setdefault("timeout", self.timeout)
+
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"model": params["model"], "attempts": 0, "hedged": False, "stream": bool(params.get("stream"))}
+        with tracing.span("llm.chat", model=params["model"], stream=record["stream"]) as span:
+            try:
+                response = self._with_retries(params, record, cancel)
+            except Exception as exc:
+                record.update({"ok": False, "error": exc.__class__.__name__})
+                raise
+            else:
+                record["ok"] = True
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    record["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+                    record["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+                    cached = cached_prompt_tokens(usage)
+                    if cached is not None:
+                        record["cached_tokens"] = cached
+                return response
+            finally:
+                record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                span.set_attributes(**{k: v for k, v in record.items() if k in ("attempts", "hedged", "prompt_tokens", "completion_tokens", "cached_tokens")})
+                with self._lock:
+                    self._calls.append(record)
+                _observe(record)
+
+    def _with_retries(self, params: Dict[str, Any], record: Dict[str, Any], cancel: Any = None):
+        attempt = 0
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise cancellation.Cancelled("请求已取消，未发出模型请求")
+            record["attempts"] = attempt + 1
+            remaining = deadline.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    deadline.exceeded("llm")
+                    raise deadline.DeadlineExceeded("请求时限已用完，未发出模型请求")
+                params = {**params, "timeout": min(params["timeout"], remaining)}
+            try:
+                if not params.get("stream") and (self.hedge_delay > 0 or cancel is not None):
+                    return self._in_background(params, record, cancel)
+                return self.client.chat.completions.create(**params)
+            except RETRYABLE_ERRORS as exc:
+                remaining = deadline.remaining()
+                if remaining is not None and remaining <= 0:
+                    deadline.exceeded("llm")
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(exc)
+                delay = min(delay, LLM_RETRY_MAX_DELAY) if delay is not None else backoff_delay(attempt)
+                if remaining is not None and delay >= remaining:
+                    raise  # 等不到下一次重试就会超出请求时限
+                if cancel is not None:
+                    if cancel.wait(delay):
+                        raise cancellation.Cancelled("请求已取消")
+                else:
+                    time.sleep(delay)
+                attempt += 1
+
+    def _submit(self, params: Dict[str, Any], cancellable: bool) -> Future:
+        """在后台发出一次请求：可取消的请求走事件循环上的异步客户端（取消 future 即中止 HTTP 请求），否则走线程池。"""
+        if cancellable:
+            portal, aclient = self._async_client()
+            return portal.start_task_soon(partial(aclient.chat.completions.create, **params))
+        if self._hedge_pool is None:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+        return self._hedge_pool.submit(self.client.chat.completions.create, **params)
+
+    def _async_client(self):
+        with self._lock:
+            if self._portal is None:
+                self._portal_cm = anyio.from_thread.start_blocking_portal()
+                self._portal = self._portal_cm.__enter__()
+                self._aclient = AsyncOpenAI(
+                    api_key=self.client.api_key, base_url=self.client.base_url, timeout=self.timeout, max_retries=0
+                )
+            return self._portal, self._aclient
+
+    @staticmethod
+    def _wait(futures, cancel: Any, timeout: Optional[float] = None, return_when: str = ALL_COMPLETED):
+        if cancel is None:
+            return wait(futures, timeout=timeout, return_when=return_when)
+        return cancellation.wait_futures(futures, cancel, timeout=timeout, return_when=return_when)
+
+    def _in_background(self, params: Dict[str, Any], record: Dict[str, Any], cancel: Any = None):
+        """在后台执行请求，调用线程只负责等待：hedge_delay 后未返回则对冲，cancel 置位时中止并抛出 Cancelled。"""
+        cancellable = cancel is not None
+        primary = self._submit(params, cancellable)
+        done, _ = self._wait([primary], cancel, timeout=self.hedge_delay if self.hedge_delay > 0 else None)
+        if done:
+            return primary.result()
+        record["hedged"] = True
+        hedge = self._submit(params, cancellable)
+        pending = {primary, hedge}
+        last_exc: Optional[BaseException] = None
+        while pending:
+            done, pending = self._wait(pending, cancel, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    record["hedge_won"] = fut is hedge
+                    for loser in pending:
+                        loser.cancel()  # 只对可取消的请求生效，线程池中已开始的请求会继续跑完
+                    return fut.result()
+                last_exc = fut.exception()
+        raise last_exc
+
+    # ---------- 指标 ----------
+
+    def recent_calls(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._calls)[-limit:]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self._calls)
+        latencies = [c["latency_ms"] for c in calls if c.get("ok")]
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for c in calls if not c.get("ok")),
+            "retries": sum(c["attempts"] - 1 for c in calls),
+            "hedged": sum(1 for c in calls if c.get("hedged")),
+            "p50_ms": _percentile(latencies, 0.5),
+            "p95_ms": _percentile(latencies, 0.95),
+            "prompt_tokens": sum(c.get("prompt_tokens", 0) for c in calls),
+            "completion_tokens": sum(c.get("completion_tokens", 0) for c in calls),
+            "cached_tokens": sum(c.get("cached_tokens", 0) for c in calls),
+        }
+
+
+def _observe(record: Dict[str, Any]):
+    model = record["model"]
+    outcome = "ok" if record.get("ok") else "cancelled" if record.get("error") == "Cancelled" else "error"
+    metrics.LLM_LATENCY.observe(record["latency_ms"] / 1000, model=model, outcome=outcome)
+    if record["attempts"] > 1:
+        metrics.LLM_RETRIES.inc(record["attempts"] - 1, model=model)
+    if record["hedged"]:
+        metrics.LLM_HEDGED.inc(model=model)
+    if "prompt_tokens" in record:
+        metrics.LLM_TOKENS.inc(record["prompt_tokens"], model=model, kind="prompt")
+        metrics.LLM_TOKENS.inc(record["completion_tokens"], model=model, kind="completion")
+        metrics.LLM_PROMPT_TOKENS.observe(record["prompt_tokens"], model=model)
+    if "cached_tokens" in record:
+        metrics.LLM_TOKENS.inc(record["cached_tokens"], model=model, kind="prompt_cache_hit")
+        metrics.LLM_TOKENS.inc(max(record["prompt_tokens"] - record["cached_tokens"], 0), model=model, kind="prompt_cache_miss")
+
+
+_DEFAULT: Optional[ModelClient] = None
+
+
+def get_model_client() -> ModelClient:
+    """进程内共享的默认客户端。"""
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = ModelClient()
+    return _DEFAULT
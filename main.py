@@ -1,16 +1,12 @@
-import os
 from agent import Agent
-from config import DEEPSEEK_API_KEY
-from openai import OpenAI
+from llm_client import get_model_client
 
 
 def chat_loop():
     print("进入多轮对话，输入 exit/quit 结束。")
 
     # 复用同一个 Agent 实例以保持对话记忆（进程内）
-    base_url = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/v1")
-    client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=base_url)
-    agent = Agent(client=client, verbose=True)
+    agent = Agent(client=get_model_client(), verbose=True)
 
     while True:
         query = input("\n你：").strip()
@@ -1,4 +1,5 @@
-import json
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
@@ -6,14 +7,54 @@ import anyio
 from mcp import types  # type: ignore
 from mcp.client.session import ClientSession  # type: ignore
 from mcp.client.stdio import StdioServerParameters, stdio_client  # type: ignore
+from mcp.client.streamable_http import streamablehttp_client  # type: ignore
+
+import cancellation
+import deadline
+import metrics
+import tool_compressor
+import tool_views
+import tracing
 
 # 默认调用超时（秒）与结果裁剪长度
 DEFAULT_CALL_TIMEOUT = 20
 DEFAULT_RESULT_MAX_CHARS = 1200
+# 长耗时工具的最短超时（秒），不受调用方传入的较短超时影响
+TOOL_MIN_TIMEOUTS = {"research": 120}
+# 取消工具调用后等待 server 确认（Request cancelled 响应）的最长时间（秒）
+CANCEL_GRACE = 0.5
+
+
+class _RequestTap:
+    """包装传输的写入流，记录发出的 tools/call 请求 id：发送 notifications/cancelled 时需要引用它。"""
+
+    def __init__(self, stream: Any):
+        self._stream = stream
+        self.request_id: Optional[types.RequestId] = None
+
+    async def send(self, item: Any):
+        root = getattr(getattr(item, "message", None), "root", None)
+        if isinstance(root, types.JSONRPCRequest) and root.method == "tools/call":
+            self.request_id = root.id
+        await self._stream.send(item)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self._stream.__aexit__(*exc_info)
 
 
 class MCPClient:
-    """简单的 MCP stdio 客户端封装，用于列出工具并执行工具调用。"""
+    """简单的 MCP 客户端封装，用于列出工具并执行工具调用。
+
+    默认以 stdio 方式每次调用启动一个 server 进程；给出 url 时改为连接常驻的 streamable HTTP server
+    （如 python mcp_server.py --transport http），不再有进程启动与模型加载开销。
+    """
 
     def __init__(
         self,
@@ -23,7 +64,13 @@ class MCPClient:
         env: Optional[Dict[str, str]] = None,
         call_timeout: int = DEFAULT_CALL_TIMEOUT,
         result_max_chars: int = DEFAULT_RESULT_MAX_CHARS,
+        name: str = "local",
+        url: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
     ):
+        self.name = name
+        self.url = url
+        self.headers = headers
         self.server_params = StdioServerParameters(
             command=command,
             args=args or ["mcp_server.py"],
@@ -66,38 +113,162 @@ class MCPClient:
             )
         return schemas
 
-    def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None, timeout: Optional[int] = None) -> str:
-        """执行 MCP 工具调用并返回裁剪后的文本结果。"""
-        timeout_sec = timeout or self.call_timeout
+    def call_tool(
+        self, name: str, arguments: Optional[Dict[str, Any]] = None, timeout: Optional[int] = None, cancel: Any = None
+    ) -> str:
+        """执行 MCP 工具调用并返回裁剪后的文本结果；cancel（threading.Event 兼容对象）置位时中止调用。"""
+        if cancel is not None and cancel.is_set():
+            return "工具调用已取消"
+        timeout_sec = max(timeout or self.call_timeout, TOOL_MIN_TIMEOUTS.get(name, 0))
+        # 请求设置了总时限时，工具超时收紧到剩余预算（包括 research 等长耗时工具的最短超时）
+        limit = deadline.clamp(timeout_sec)
+        if limit <= 0:
+            deadline.exceeded("tool")
+            return "请求时限已用完，未执行该工具"
+        shortened, timeout_sec = limit < timeout_sec, limit
+        started = time.perf_counter()
         try:
-            result = anyio.run(self._call_tool_once, name, arguments or {}, timeout_sec)
+            result = anyio.run(self._call_tool_once, name, arguments or {}, timeout_sec, cancel)
         except Exception as exc:
+            span = tracing.current_span()
+            if span is not None:
+                span.record_error(exc)
+            if isinstance(exc, cancellation.Cancelled):
+                self._observe(name, started, "cancelled")
+                print(f"🛑 工具调用已取消：{name}")
+                return "工具调用已取消"
             if exc.__class__.__name__ == "TimeoutError":
+                self._observe(name, started, "timeout")
+                if shortened:
+                    deadline.exceeded("tool")
                 print(f"⏱️ 工具调用超时：{name}")
                 return "工具调用超时，请换一种方式或缩短查询"
+            self._observe(name, started, "error")
             print(f"❌ 工具调用失败：{name} -> {exc}")
             return f"工具调用失败：{exc}"
 
-        formatted = self._format_result(result)
+        # MCP server 侧的 span 随结果 _meta 回传，并入当前 trace
+        tracing.import_spans((result.meta or {}).get("trace_spans"))
+        formatted = self._format_result(result, name, arguments)
+        failed = result.isError or formatted.startswith(("工具执行失败", "未知工具"))
+        self._observe(name, started, "error" if failed else "ok")
         print(f"[MCP] call_tool {name} args={arguments} -> {formatted[:80]}{'...' if len(formatted) > 80 else ''}")
         return formatted
 
+    def _observe(self, tool: str, started: float, outcome: str):
+        metrics.TOOL_CALLS.inc(server=self.name, tool=tool, outcome=outcome)
+        metrics.TOOL_LATENCY.observe(time.perf_counter() - started, server=self.name, tool=tool)
+
+    @asynccontextmanager
+    async def _connect(self):
+        """按配置建立传输：url 为 streamable HTTP，否则启动 stdio server 进程。"""
+        if self.url:
+            async with streamablehttp_client(self.url, headers=self.headers) as (read_stream, write_stream, _):
+                yield read_stream, write_stream
+        else:
+            async with stdio_client(self.server_params) as (read_stream, write_stream):
+                yield read_stream, write_stream
+
     async def _list_tools_once(self) -> List[types.Tool]:
-        async with stdio_client(self.server_params) as (read_stream, write_stream):
+        async with self._connect() as (read_stream, write_stream):
             async with ClientSession(read_stream, write_stream) as session:
                 await session.initialize()
                 result = await session.list_tools()
                 return result.tools
 
-    async def _call_tool_once(self, name: str, arguments: Dict[str, Any], timeout_sec: int) -> types.CallToolResult:
-        async with stdio_client(self.server_params) as (read_stream, write_stream):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                with anyio.fail_after(timeout_sec):
-                    return await session.call_tool(name, arguments or {})
+    async def _call_tool_once(
+        self, name: str, arguments: Dict[str, Any], timeout_sec: float, cancel: Any = None
+    ) -> types.CallToolResult:
+        result: Optional[types.CallToolResult] = None
+        async with self._connect() as (read_stream, write_stream):
+            tap = _RequestTap(write_stream) if cancel is not None else None
+            async with ClientSession(read_stream, tap or write_stream) as session:
+                # stdio 每次调用都新起 server 进程，initialize 的耗时即进程启动与导入成本；HTTP 为建立会话的往返
+                with tracing.span("mcp.connect"):
+                    await session.initialize()
+                await self._prime_output_schemas(session)
+                with tracing.span("mcp.request", tool=name), anyio.fail_after(timeout_sec):
+                    call = session.call_tool(
+                        name, arguments or {}, progress_callback=self._on_progress, meta=tracing.inject() or None
+                    )
+                    if cancel is None:
+                        return await call
+                    result = await self._cancellable(session, call, cancel, tap)
+        # 在传输的上下文之外抛出，否则会被其任务组包装成 ExceptionGroup
+        if result is None:
+            raise cancellation.Cancelled("工具调用已取消")
+        return result
+
+    async def _prime_output_schemas(self, session: ClientSession):
+        """ClientSession 按 list_tools 的结果校验 structuredContent，未取过时会在拿到结果后补发 list_tools；
+        已缓存工具列表时直接填入其 outputSchema，省去每次调用的这次往返，仅缓存为空时才真正请求。"""
+        if not self._tool_cache:
+            with tracing.span("mcp.list_tools"):
+                self._tool_cache = (await session.list_tools()).tools
+            return
+        for tool in self._tool_cache:
+            session._tool_output_schemas[tool.name] = tool.outputSchema
+
+    async def _cancellable(
+        self, session: ClientSession, call, cancel: Any, tap: _RequestTap
+    ) -> Optional[types.CallToolResult]:
+        """等待工具结果的同时监视取消标记：取消时通知 server（notifications/cancelled）中止处理并返回 None。
+
+        server 取消处理协程后会立即回一条 "Request cancelled" 错误响应，这里等调用随之结束（最多 CANCEL_GRACE 秒）
+        再关闭会话，避免响应落在已关闭的流上。
+        """
+        result: Optional[types.CallToolResult] = None
+        error: Optional[Exception] = None
+        finished = anyio.Event()
+
+        async def watch():
+            while not cancel.is_set():
+                await anyio.sleep(cancellation.CHECK_INTERVAL)
+            with anyio.CancelScope(shield=True), anyio.move_on_after(CANCEL_GRACE):
+                if tap.request_id is not None:
+                    await session.send_notification(
+                        types.ClientNotification(
+                            types.CancelledNotification(
+                                params=types.CancelledNotificationParams(
+                                    requestId=tap.request_id, reason="cancelled by client"
+                                )
+                            )
+                        )
+                    )
+                    await finished.wait()
+            tg.cancel_scope.cancel()
+
+        async def run():
+            nonlocal result, error
+            try:
+                result = await call
+            except Exception as exc:
+                error = exc
+            finally:
+                finished.set()
+            if not cancel.is_set():
+                tg.cancel_scope.cancel()
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(watch)
+            tg.start_soon(run)
+        if cancel.is_set():
+            return None
+        if error is not None:
+            raise error
+        return result
+
+    async def _on_progress(self, progress: float, total: Optional[float], message: Optional[str]):
+        """长耗时工具（如 research）逐步推送的中间结果。"""
+        total_text = f"/{total:g}" if total else ""
+        print(f"[MCP] progress {progress:g}{total_text} {(message or '')[:120]}")
 
-    def _format_result(self, result: types.CallToolResult) -> str:
-        """提取文本并裁剪，避免直接返回大对象。"""
+    def _format_result(self, result: types.CallToolResult, name: str = "", arguments: Optional[Dict[str, Any]] = None) -> str:
+        """提取文本并按当前问题压缩，避免直接返回大对象；有 structuredContent 时按工具类型渲染紧凑视图。"""
+        query = tool_compressor.focus_query(arguments)
+        if result.structuredContent is not None and not result.isError:
+            with tool_compressor.focus(query):
+                return tool_views.render(name, result.structuredContent, self.result_max_chars)
         parts: List[str] = []
         for item in result.content or []:
             item_type = getattr(item, "type", "")
@@ -118,19 +289,9 @@ class MCPClient:
             else:
                 parts.append(f"[{item_type or 'content'} 内容已省略]")
 
-        if result.structuredContent:
-            try:
-                parts.append(json.dumps(result.structuredContent, ensure_ascii=False))
-            except Exception:
-                parts.append(str(result.structuredContent))
-
         text = "\n".join(p for p in parts if p).strip()
         if not text:
             text = "(空结果)"
-        return self._clip(text)
-
-    def _clip(self, text: str) -> str:
-        if len(text) <= self.result_max_chars:
-            return text
-        return text[: self.result_max_chars].rstrip() + f"... (已截断，原始长度 {len(text)})"
+        # 超出工具的 token 预算时保留与问题最相关的段落（并标出省略的行号），而不是只留开头
+        return tool_compressor.compress(text, query, budget_tokens=tool_compressor.budget_for(name), tool=name)
 
@@ -1,23 +1,55 @@
+"""
+本地 MCP server：把 tools/ 下的工具通过 MCP 暴露给 Agent。
+
+两种传输方式：
+- stdio（默认）：客户端每次调用启动一个进程，用完即退出；
+- streamable HTTP：python mcp_server.py --transport http --port 8765，单个常驻进程服务所有 backend worker 与会话，
+  Embedder 与索引只加载一次并保持常驻；同步工具在至多 MCP_TOOL_WORKERS 个工作线程中执行。
+  客户端设置 LOCAL_MCP_URL=http://127.0.0.1:8765/mcp/ 即改为连接该服务。
+"""
+
+import argparse
 import json
 import inspect
-from typing import Any, Dict, List
+import os
+import sys
+import threading
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Dict, List, Optional
 
 import anyio
 from mcp import types
 from mcp.server import Server, stdio
 
+import cancellation
+import tool_views
+import tracing
+
 from tools.web_search import web_search
+from tools.output_schemas import OUTPUT_SCHEMAS
+from tools.research import progress_reporter, research
 from tools.datetime import get_current_datetime
 from tools.file import (
     list_dir,
     read_file,
+    grep_file,
     write_file,
     append_file,
     delete_file,
     rename_file,
     make_dir,
 )
-from tools.cookbook_rag import rag_rebuild_index, rag_search, rag_read_file
+from tools.cookbook_rag import (
+    rag_rebuild_index,
+    rag_search,
+    rag_read_file,
+    rag_grep_file,
+    rag_list_collections,
+    rag_index_status,
+    rag_cancel_index_job,
+    workspace_search,
+)
 
 
 def _python_type_to_json_schema(param: inspect.Parameter) -> Dict[str, Any]:
@@ -45,6 +77,9 @@ def _build_tool_schema(func) -> types.Tool:
         properties[name] = _python_type_to_json_schema(param)
         if param.default is inspect._empty:
             required.append(name)
+        elif param.default is None or isinstance(param.default, (str, int, float, bool)):
+            # 声明默认值：客户端（如推测执行比较参数时）可据此补齐模型省略的可选参数
+            properties[name]["default"] = param.default
 
     description = (func.__doc__ or "").strip() or f"调用 {func.__name__}"
     return types.Tool(
@@ -55,7 +90,7 @@ def _build_tool_schema(func) -> types.Tool:
             "properties": properties,
             "required": required,
         },
-        outputSchema=None,
+        outputSchema=OUTPUT_SCHEMAS.get(func.__name__),
     )
 
 
@@ -64,6 +99,7 @@ TOOL_FUNCTIONS = {
     "get_current_datetime": get_current_datetime,
     "list_dir": list_dir,
     "read_file": read_file,
+    "grep_file": grep_file,
     "write_file": write_file,
     "append_file": append_file,
     "delete_file": delete_file,
@@ -72,16 +108,58 @@ TOOL_FUNCTIONS = {
     "rag_search": rag_search,
     "rag_rebuild_index": rag_rebuild_index,
     "rag_read_file": rag_read_file,
+    "rag_grep_file": rag_grep_file,
+    "rag_list_collections": rag_list_collections,
+    "rag_index_status": rag_index_status,
+    "rag_cancel_index_job": rag_cancel_index_job,
+    "workspace_search": workspace_search,
+    "research": research,
 }
 
 server = Server("myagent-mcp", instructions="myagentbymcp 工具通过 MCP 暴露给模型使用。")
 
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio")
+MCP_HTTP_HOST = os.getenv("MCP_HTTP_HOST", "127.0.0.1")
+MCP_HTTP_PORT = int(os.getenv("MCP_HTTP_PORT", "8765"))
+# 同步工具的并发上限（所有会话共享），超出的调用排队等待
+MCP_TOOL_WORKERS = int(os.getenv("MCP_TOOL_WORKERS", "8"))
+# 声明了 outputSchema 的工具，TextContent 中只放该字符数以内的渲染视图，完整数据只在 structuredContent 中传一份
+STRUCTURED_TEXT_MAX_CHARS = int(os.getenv("MCP_STRUCTURED_TEXT_MAX_CHARS", "2000"))
+
+_tool_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def _get_tool_limiter() -> anyio.CapacityLimiter:
+    # CapacityLimiter 需在事件循环内创建
+    global _tool_limiter
+    if _tool_limiter is None:
+        _tool_limiter = anyio.CapacityLimiter(MCP_TOOL_WORKERS)
+    return _tool_limiter
+
 
 @server.list_tools()
 async def handle_list_tools():
     return [_build_tool_schema(func) for func in TOOL_FUNCTIONS.values()]
 
 
+def _bind_progress():
+    """请求携带 progressToken 时，为长耗时工具绑定 progress 通知回调。"""
+    reporter = None
+    try:
+        ctx = server.request_context
+        progress_token = ctx.meta.progressToken if ctx.meta else None
+    except LookupError:
+        progress_token = None
+    if progress_token is not None:
+
+        async def reporter(progress, total=None, message=None):
+            await ctx.session.send_progress_notification(
+                progress_token, progress, total=total, message=message, related_request_id=str(ctx.request_id)
+            )
+
+    return progress_reporter.set(reporter)
+
+
 @server.call_tool()
 async def handle_call_tool(tool_name: str, arguments: Dict[str, Any]):
     func = TOOL_FUNCTIONS.get(tool_name)
@@ -90,24 +168,67 @@ async def handle_call_tool(tool_name: str, arguments: Dict[str, Any]):
             types.TextContent(type="text", text=f"未知工具：{tool_name}"),
         ]
 
-    try:
-        result = func(**(arguments or {}))
-    except Exception as exc:
-        return [
-            types.TextContent(type="text", text=f"工具执行失败：{exc}"),
-        ]
+    parent = _trace_parent()
+    token = _bind_progress()
+    cancel_event = threading.Event()
+    cancel_token = cancellation.tool_cancel_event.set(cancel_event)
+    with tracing.span("mcp.handle_call_tool", parent=parent, tool=tool_name) as span:
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = await func(**(arguments or {}))
+            else:
+                # 同步工具放到工作线程执行，不阻塞事件循环上的其他请求（anyio 会复制 contextvars，span 照常嵌套）；
+                # 客户端取消（notifications/cancelled）时不再等待该线程，由 cancel_event 通知工具在安全点提前返回
+                result = await anyio.to_thread.run_sync(
+                    partial(func, **(arguments or {})), abandon_on_cancel=True, limiter=_get_tool_limiter()
+                )
+        except anyio.get_cancelled_exc_class():
+            cancel_event.set()
+            span.set_attributes(cancelled=True)
+            raise
+        except Exception as exc:
+            span.record_error(exc)
+            text, structured, is_error = f"工具执行失败：{exc}", None, True
+        else:
+            text, structured, is_error = _shape_result(tool_name, result)
+        finally:
+            progress_reporter.reset(token)
+            cancellation.tool_cancel_event.reset(cancel_token)
+
+    content = [types.TextContent(type="text", text=text)]
+    meta = {"trace_spans": tracing.export_spans(span)} if parent is not None else None
+    if structured is None and not is_error and meta is None:
+        return content
+    # 调用方携带了 traceparent 时，把本进程内的 span 随结果回传
+    return types.CallToolResult(content=content, structuredContent=structured, isError=is_error, **{"_meta": meta})
+
+
+def _shape_result(tool_name: str, result: Any):
+    """返回 (text, structuredContent, isError)。
 
+    声明了 outputSchema 的工具：dict 结果放在 structuredContent，TextContent 中附上按 STRUCTURED_TEXT_MAX_CHARS
+    裁剪的渲染视图（tool_views），不解析 structuredContent 的客户端仍有可读结果，又不必把完整 JSON 传两遍；
+    返回字符串即为出错信息。
+    其他工具保持原样：非字符串结果序列化为 JSON 文本。
+    """
+    if tool_name in OUTPUT_SCHEMAS:
+        if isinstance(result, dict):
+            return tool_views.render(tool_name, result, STRUCTURED_TEXT_MAX_CHARS), result, False
+        return str(result), None, True
     if isinstance(result, str):
-        text = result
-    else:
-        try:
-            text = json.dumps(result, ensure_ascii=False)
-        except Exception:
-            text = str(result)
+        return result, None, False
+    try:
+        return json.dumps(result, ensure_ascii=False), None, False
+    except Exception:
+        return str(result), None, False
 
-    return [
-        types.TextContent(type="text", text=text),
-    ]
+
+def _trace_parent():
+    """从请求 _meta 中解析调用方的 traceparent。"""
+    try:
+        return tracing.extract(server.request_context.meta)
+    except LookupError:
+        return None
 
 
 async def main():
@@ -116,6 +237,72 @@ async def main():
         await server.run(read_stream, write_stream, init_options)
 
 
+def create_http_app():
+    """streamable HTTP 传输的 ASGI 应用：MCP 端点挂在 /mcp/，另有 /health。
+
+    每个客户端连接是一个独立的 MCP 会话（含 notifications/cancelled 等通知），所有会话共享本进程的工具与索引。
+    """
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Mount, Route
+
+    session_manager = StreamableHTTPSessionManager(app=server)
+
+    async def handle_mcp(scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+    async def health(request):
+        limiter = _get_tool_limiter()
+        return JSONResponse(
+            {
+                "ok": True,
+                "transport": "streamable-http",
+                "tool_workers": MCP_TOOL_WORKERS,
+                "tools_running": limiter.borrowed_tokens,
+                "tools_waiting": limiter.statistics().tasks_waiting,
+            }
+        )
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # 启动时预热 Embedder，首个请求不必等待模型加载
+        try:
+            from rag.embedding import get_embedder
+
+            await anyio.to_thread.run_sync(get_embedder)
+        except Exception as exc:
+            print(f"⚠️ Embedder 预热失败，将在首次检索时加载：{exc}", file=sys.stderr)
+        async with session_manager.run():
+            yield
+
+    return Starlette(routes=[Route("/health", health), Mount("/mcp", app=handle_mcp)], lifespan=lifespan)
+
+
+def serve_http(host: str = MCP_HTTP_HOST, port: int = MCP_HTTP_PORT):
+    import uvicorn
+
+    uvicorn.run(create_http_app(), host=host, port=port, log_level="warning")
+
+
 if __name__ == "__main__":
-    anyio.run(main)
+    parser = argparse.ArgumentParser(description="myagent 本地 MCP server")
+    parser.add_argument("--transport", choices=["stdio", "http"], default=MCP_TRANSPORT)
+    parser.add_argument("--host", default=MCP_HTTP_HOST)
+    parser.add_argument("--port", type=int, default=MCP_HTTP_PORT)
+    args = parser.parse_args()
+
+    tracing.set_service_name("myagent-mcp")
+    if args.transport == "http":
+        serve_http(args.host, args.port)
+    else:
+        anyio.run(main)
+        # stdin 关闭后直接结束进程：不等被取消后仍在收尾的工具线程（abandon_on_cancel），也跳过解释器清理
+        # （已导入向量化等模块时约 0.5 秒），客户端关闭 stdin 后无需等待即可释放这次调用
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(0)
 
@@ -0,0 +1,237 @@
+"""
+进程内指标（Prometheus 文本格式），不依赖 prometheus_client。
+
+- Counter / Gauge / Histogram 按标签值元组分桶，每个指标一把锁，记录一次只做一次 bisect 与几次加法。
+- render() 输出 text/plain; version=0.0.4，供后端 /metrics 抓取。
+- observe_trace()：请求结束时把 trace 中各 span 的耗时计入 stage 直方图；MCP server 子进程内的 span 会随结果回传
+  （见 tracing.py），因此 rag.search 等在工具进程中执行的阶段也能在后端进程统计，带 cache_hit 属性的 span 计入缓存命中率。
+"""
+
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+PREFIX = "myagent_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], float]):
+        """抓取时才求值（如当前会话数），避免在热路径上维护。"""
+        self._function = func
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(float(self._function()))}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [各桶计数（不累积）..., +Inf 桶, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[idx] += 1
+            row[-1] += value
+
+    def snapshot(self, **labels: Any) -> Dict[str, float]:
+        with self._lock:
+            row = list(self._values.get(self._key(labels)) or [0.0] * (len(self.buckets) + 2))
+        return {"count": sum(row[:-1]), "sum": row[-1]}
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(row)) for key, row in self._values.items())
+        lines: List[str] = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), row[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # 模块重复导入时复用已有指标
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ---------- 指标定义 ----------
+
+HTTP_REQUESTS = counter("http_requests_total", "后端 HTTP 请求数", ("method", "route", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "后端 HTTP 请求耗时", ("method", "route"))
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+ACTIVE_SESSIONS = gauge("active_sessions", "内存中的活跃会话数")
+SESSION_CACHE_BYTES = gauge("session_cache_bytes", "内存会话估算占用（字节）")
+SESSION_WRITE_LATENCY = histogram("session_store_write_duration_seconds", "会话持久化写入耗时", ("op",))
+
+LLM_LATENCY = histogram("llm_request_duration_seconds", "模型调用耗时（含重试与对冲）", ("model", "outcome"))
+LLM_TOKENS = counter("llm_tokens_total", "模型调用 token 用量（kind=prompt|completion|prompt_cache_hit|prompt_cache_miss）", ("model", "kind"))
+LLM_PROMPT_TOKENS = histogram("llm_prompt_tokens", "单次模型调用的 prompt token 数", ("model",), TOKEN_BUCKETS)
+LLM_RETRIES = counter("llm_retries_total", "模型调用重试次数", ("model",))
+LLM_HEDGED = counter("llm_hedged_total", "发出对冲请求的模型调用数", ("model",))
+
+TOOL_CALLS = counter("tool_calls_total", "MCP 工具调用数（outcome=ok|error|timeout|cancelled）", ("server", "tool", "outcome"))
+TOOL_LATENCY = histogram("tool_call_duration_seconds", "MCP 工具调用耗时（含 server 进程启动）", ("server", "tool"))
+
+DEADLINE_EXCEEDED = counter("deadline_exceeded_total", "请求时限耗尽次数（stage=llm|tool|final_round|request）", ("stage",))
+CANCEL_TO_FREE = histogram(
+    "cancel_to_free_seconds", "从发起取消到请求释放（会话可再次使用）的耗时", buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+STAGE_LATENCY = histogram("stage_duration_seconds", "请求内各阶段（trace span）耗时，含 MCP server 进程内的 rag.*", ("stage",))
+CACHE_REQUESTS = counter("cache_requests_total", "缓存查询数（result=hit|miss）", ("cache", "result"))
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def observe_trace(spans: Iterable[Any]):
+    """把一条 trace 的 span 计入阶段直方图与缓存命中计数（请求结束时调用一次）。"""
+    for item in spans:
+        d = item if isinstance(item, dict) else item.to_dict()
+        if not d.get("end_ns"):
+            continue
+        STAGE_LATENCY.observe((d["end_ns"] - d["start_ns"]) / 1e9, stage=d["name"])
+        attrs = d.get("attributes") or {}
+        if "cache_hit" in attrs:
+            cache_lookup(d["name"], bool(attrs["cache_hit"]))
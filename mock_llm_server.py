@@ -0,0 +1,259 @@
+"""
+本地 OpenAI 兼容的模拟模型服务，按脚本确定性地回放 tool_calls 与最终回答，用于离线压测完整 Agent 循环。
+
+用法：
+    python mock_llm_server.py --port 8900 [--script script.json] [--latency-ms 50] [--fail-every 0]
+    DEEPSEEK_API_BASE=http://127.0.0.1:8900/v1 DEEPSEEK_API_KEY=mock uvicorn backend.server:app
+
+脚本格式（按“本轮用户消息之后已有的 assistant 消息数”选取第几步，超出时使用最后一步）：
+{
+  "turns": [
+    {"tool_calls": [{"name": "local__get_current_datetime", "arguments": {}}]},
+    {"content": "<final_answer>{last_user}</final_answer>"}
+  ]
+}
+content 中的 {last_user} 会替换为最后一条用户消息；tool 名不带前缀时匹配请求 tools 中以 __<name> 结尾的工具。
+
+usage 中模拟 DeepSeek 的上下文缓存：按「system 消息 + tools + 其余消息」逐段计算前缀哈希，与之前请求的最长公共前缀计为
+prompt_cache_hit_tokens，可用于离线核对请求前缀是否逐字节稳定。
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+DEFAULT_SCRIPT = {
+    "turns": [
+        {"tool_calls": [{"name": "get_current_datetime", "arguments": {}}]},
+        {"content": "<thought>已获得工具结果</thought>\n<final_answer>模拟回答：{last_user}</final_answer>"},
+    ]
+}
+
+
+def _estimate_tokens(obj: Any) -> int:
+    text = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)
+    return max(1, len(text) // 3)
+
+
+class MockLLM:
+    def __init__(self, script: Dict[str, Any], latency_ms: float = 0.0, jitter_ms: float = 0.0, fail_every: int = 0, seed: int = 0):
+        self.turns: List[Dict[str, Any]] = script.get("turns") or DEFAULT_SCRIPT["turns"]
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_every = fail_every
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        # 前缀哈希 -> None，按 LRU 淘汰
+        self._prefix_cache: "OrderedDict[str, None]" = OrderedDict()
+        self.prefix_cache_size = 4096
+
+    def next_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def delay(self) -> float:
+        with self._lock:
+            jitter = self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        return (self.latency_ms + jitter) / 1000
+
+    def cache_hit_tokens(self, body: Dict[str, Any]) -> int:
+        """与历史请求的最长公共前缀（按段）折算的 token 数，并记录本次请求的各段前缀。"""
+        # 与 DeepSeek 的对话模板一致：开头的 system 消息在前，工具说明紧随其后，再是其余消息
+        messages = body.get("messages") or []
+        lead = next((i for i, m in enumerate(messages) if m.get("role") != "system"), len(messages))
+        segments = [json.dumps(m, ensure_ascii=False) for m in messages[:lead]]
+        segments.append(json.dumps(body.get("tools") or [], ensure_ascii=False))
+        segments.extend(json.dumps(m, ensure_ascii=False) for m in messages[lead:])
+        digest = hashlib.sha1()
+        hit, prefix_tokens, still_hit = 0, 0, True
+        with self._lock:
+            for seg in segments:
+                digest.update(seg.encode("utf-8"))
+                key = digest.hexdigest()
+                prefix_tokens += _estimate_tokens(seg)
+                if still_hit and key in self._prefix_cache:
+                    hit = prefix_tokens
+                    self._prefix_cache.move_to_end(key)
+                else:
+                    still_hit = False
+                    self._prefix_cache[key] = None
+            while len(self._prefix_cache) > self.prefix_cache_size:
+                self._prefix_cache.popitem(last=False)
+        return hit
+
+    @staticmethod
+    def _step(messages: List[Dict[str, Any]]) -> int:
+        last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+        return sum(1 for m in messages[last_user + 1 :] if m.get("role") == "assistant")
+
+    @staticmethod
+    def _resolve_tool(name: str, tools: List[Dict[str, Any]]) -> Optional[str]:
+        names = [t.get("function", {}).get("name", "") for t in tools or []]
+        if name in names:
+            return name
+        for full in names:
+            if full.endswith(f"__{name}"):
+                return full
+        return None
+
+    def respond(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        messages = body.get("messages") or []
+        step = self._step(messages)
+        turn = self.turns[min(step, len(self.turns) - 1)]
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        tool_calls = []
+        # tool_choice="none"（如时限将尽的最后一轮）时不回放 tool_calls，直接给出回答
+        scripted_calls = [] if body.get("tool_choice") == "none" else turn.get("tool_calls") or []
+        for idx, call in enumerate(scripted_calls):
+            name = self._resolve_tool(call["name"], body.get("tools"))
+            if name is None:
+                continue  # 请求未提供该工具（如无工具的流式请求），跳过
+            tool_calls.append(
+                {
+                    "id": f"call_{step}_{idx}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(call.get("arguments") or {}, ensure_ascii=False)},
+                }
+            )
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+            finish_reason = "tool_calls"
+        content = turn.get("content")
+        if content is not None or not tool_calls:
+            message["content"] = (content or "<final_answer>{last_user}</final_answer>").replace("{last_user}", last_user)
+
+        prompt_tokens = _estimate_tokens(messages) + _estimate_tokens(body.get("tools") or [])
+        completion_tokens = _estimate_tokens(message)
+        cache_hit = min(self.cache_hit_tokens(body), prompt_tokens)
+        return {
+            "id": f"chatcmpl-mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_cache_hit_tokens": cache_hit,
+                "prompt_cache_miss_tokens": prompt_tokens - cache_hit,
+            },
+        }
+
+
+def _stream_chunks(resp: Dict[str, Any], piece_chars: int = 8):
+    """把完整回复拆成 chat.completion.chunk 序列（SSE）。"""
+    base = {"id": resp["id"], "object": "chat.completion.chunk", "created": resp["created"], "model": resp["model"]}
+    choice = resp["choices"][0]
+    message = choice["message"]
+    yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+    content = message.get("content") or ""
+    for i in range(0, len(content), piece_chars):
+        yield {**base, "choices": [{"index": 0, "delta": {"content": content[i : i + piece_chars]}, "finish_reason": None}]}
+    for idx, call in enumerate(message.get("tool_calls") or []):
+        delta = {"tool_calls": [{"index": idx, **call}]}
+        yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}], "usage": resp["usage"]}
+
+
+def make_handler(mock: MockLLM):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            n = mock.next_request()
+            time.sleep(mock.delay())
+            if mock.fail_every and n % mock.fail_every == 0:
+                # 模拟上游过载，用于验证重试
+                self._send_json(503, {"error": {"message": "mock overloaded"}}, {"Retry-After": "0"})
+                return
+            resp = mock.respond(body)
+            if not body.get("stream"):
+                self._send_json(200, resp)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in _stream_chunks(resp):
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def log_message(self, format, *args):  # noqa: A002 - 静默访问日志
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8900, script: Optional[Dict[str, Any]] = None, **kwargs) -> ThreadingHTTPServer:
+    """在后台线程启动模拟服务并返回 server（测试/压测脚本中使用，server.shutdown() 停止）。"""
+    mock = MockLLM(script or DEFAULT_SCRIPT, **kwargs)
+    httpd = ThreadingHTTPServer((host, port), make_handler(mock))
+    httpd.daemon_threads = True
+    httpd.mock = mock
+    threading.Thread(target=httpd.serve_forever, name="mock-llm", daemon=True).start()
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的模拟模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--script", help="回放脚本 JSON 文件")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fail-every", type=int, default=0, help="每 N 个请求返回一次 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    mock = MockLLM(script, args.latency_ms, args.jitter_ms, args.fail_every, args.seed)
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(mock))
+    httpd.daemon_threads = True
+    print(f"mock LLM 服务已启动：http://{args.host}:{args.port}/v1")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
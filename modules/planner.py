@@ -16,8 +16,7 @@ planner_prompt = ChatPromptTemplate.from_template("""
 
 planner_chain = planner_prompt | llm | JsonOutputParser()
 
-def make_plan(query):
-    resp = planner_chain.invoke({"query": query})
+def _validate_plan(resp):
     if not isinstance(resp, dict):
         raise ValueError("规划结果解析失败：非字典")
     subs = resp.get("sub_questions") or []
@@ -25,3 +24,11 @@ def make_plan(query):
     if not subs or not kws:
         raise ValueError("规划结果缺少 sub_questions 或 keywords")
     return {"sub_questions": subs, "keywords": kws}
+
+
+def make_plan(query):
+    return _validate_plan(planner_chain.invoke({"query": query}))
+
+
+async def amake_plan(query):
+    return _validate_plan(await planner_chain.ainvoke({"query": query}))
@@ -0,0 +1,214 @@
+"""
+研究流水线：规划 -> 并发检索（联网 + RAG）-> 来源去重 -> 并发总结（流式产出）-> 综合。
+
+各子问题的检索与总结在 asyncio.Semaphore 限制下并发执行；同一来源被多个子问题命中时只保留在
+排名最靠前的子问题中，避免重复总结。research_events 以事件流形式逐步产出（计划、检索、单条总结、
+最终答案），run_research 消费事件流并返回最终结果与耗时分解。
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from modules.planner import amake_plan
+from modules.summarizer import asummarize
+from modules.synthesizer import asynthesize
+from rag.collection import DEFAULT_COLLECTION
+from rag.retrieval import search as rag_search
+from tools.web_search import search_results
+
+DEFAULT_CONCURRENCY = 4
+MAX_SUB_QUESTIONS = 5
+WEB_RESULTS = 5
+RAG_RESULTS = 3
+# 每个子问题送入总结的内容上限（字符）
+SUMMARY_INPUT_CHARS = 4000
+
+
+def _ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _source_key(src: Dict[str, Any]) -> str:
+    """URL / RAG chunk id 相同，或正文前 300 字相同，视为同一来源。"""
+    if src.get("url"):
+        return "url:" + src["url"].split("#", 1)[0].rstrip("/").lower()
+    if src.get("id"):
+        return f"rag:{src.get('collection')}:{src['id']}"
+    text = " ".join((src.get("content") or "").split())[:300]
+    return "text:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+async def _search_one(
+    question: str,
+    sem: asyncio.Semaphore,
+    use_web: bool,
+    use_rag: bool,
+    collection: str,
+) -> Dict[str, Any]:
+    async with sem:
+        started = time.perf_counter()
+        tasks = []
+        if use_web:
+            tasks.append(search_results(question, max_results=WEB_RESULTS))
+        if use_rag:
+            tasks.append(asyncio.to_thread(rag_search, question, RAG_RESULTS, 0.2, False, collection))
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+    sources: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            errors.append(str(outcome) or outcome.__class__.__name__)
+        elif isinstance(outcome, dict):  # 联网结果
+            if outcome.get("error"):
+                errors.append(outcome["error"])
+            sources.extend({"kind": "web", **item} for item in outcome.get("results", []))
+        else:  # RAG 结果
+            sources.extend(
+                {
+                    "kind": "rag",
+                    "id": item.get("id"),
+                    "collection": item.get("collection"),
+                    "title": item.get("dish_name") or item.get("source"),
+                    "source": item.get("source"),
+                    "content": item.get("content") or "",
+                    "score": item.get("score"),
+                }
+                for item in outcome
+            )
+    return {"question": question, "sources": sources, "errors": errors, "search_ms": _ms(started)}
+
+
+def dedupe_sources(searches: List[Dict[str, Any]]) -> int:
+    """按排名把重复来源只保留给首个命中的子问题（原地修改），返回去掉的条数。"""
+    seen = set()
+    removed = 0
+    # 按名次轮转遍历，使重复来源归属于排名更靠前的子问题
+    depth = max((len(s["sources"]) for s in searches), default=0)
+    keep: List[List[Dict[str, Any]]] = [[] for _ in searches]
+    for rank in range(depth):
+        for i, s in enumerate(searches):
+            if rank >= len(s["sources"]):
+                continue
+            src = s["sources"][rank]
+            key = _source_key(src)
+            if key in seen:
+                removed += 1
+                continue
+            seen.add(key)
+            keep[i].append(src)
+    for s, kept in zip(searches, keep):
+        s["sources"] = kept
+    return removed
+
+
+def _summary_input(sources: List[Dict[str, Any]]) -> str:
+    blocks, size = [], 0
+    for idx, src in enumerate(sources, 1):
+        ref = src.get("url") or src.get("source") or ""
+        block = f"[{idx}] {src.get('title') or ''} {ref}\n{src.get('content') or ''}".strip()
+        if size + len(block) > SUMMARY_INPUT_CHARS and blocks:
+            break
+        blocks.append(block)
+        size += len(block)
+    return "\n\n".join(blocks)
+
+
+async def _summarize_one(index: int, search: Dict[str, Any], sem: asyncio.Semaphore) -> Dict[str, Any]:
+    started = time.perf_counter()
+    if not search["sources"]:
+        return {"index": index, "question": search["question"], "summary": "", "summary_ms": 0.0, "skipped": True}
+    async with sem:
+        summary = await asummarize(search["question"], _summary_input(search["sources"]))
+    return {"index": index, "question": search["question"], "summary": summary, "summary_ms": _ms(started)}
+
+
+async def research_events(
+    query: str,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    use_web: bool = True,
+    use_rag: bool = True,
+    collection: str = DEFAULT_COLLECTION,
+) -> AsyncIterator[Dict[str, Any]]:
+    """逐步产出事件：plan、searched、summary（每完成一条即产出）、final。"""
+    t0 = time.perf_counter()
+    timings: Dict[str, Any] = {}
+    sem = asyncio.Semaphore(max(int(max_concurrency or 1), 1))
+
+    started = time.perf_counter()
+    plan = await amake_plan(query)
+    questions = [str(q) for q in plan["sub_questions"]][:MAX_SUB_QUESTIONS]
+    timings["plan_ms"] = _ms(started)
+    yield {"type": "plan", "sub_questions": questions, "keywords": plan["keywords"]}
+
+    started = time.perf_counter()
+    searches = await asyncio.gather(*(_search_one(q, sem, use_web, use_rag, collection) for q in questions))
+    timings["search_ms"] = _ms(started)
+    started = time.perf_counter()
+    duplicates = dedupe_sources(searches)
+    timings["dedupe_ms"] = _ms(started)
+    yield {
+        "type": "searched",
+        "sources": sum(len(s["sources"]) for s in searches),
+        "duplicates_removed": duplicates,
+        "errors": [e for s in searches for e in s["errors"]],
+    }
+
+    started = time.perf_counter()
+    summaries: List[Optional[Dict[str, Any]]] = [None] * len(searches)
+    for fut in asyncio.as_completed([_summarize_one(i, s, sem) for i, s in enumerate(searches)]):
+        item = await fut
+        summaries[item["index"]] = item
+        if not item.get("skipped"):
+            yield {"type": "summary", **item}
+    timings["summarize_ms"] = _ms(started)
+
+    started = time.perf_counter()
+    points = [f"{s['question']}：{s['summary']}" for s in summaries if s and s["summary"]]
+    answer = await asynthesize(points) if points else "未检索到可用信息，无法给出答案。"
+    timings["synthesize_ms"] = _ms(started)
+    timings["total_ms"] = _ms(t0)
+    # 串行执行时的估计耗时，用于衡量并发收益
+    timings["sequential_estimate_ms"] = round(
+        timings["plan_ms"]
+        + sum(s["search_ms"] for s in searches)
+        + sum(s["summary_ms"] for s in summaries if s)
+        + timings["synthesize_ms"],
+        1,
+    )
+    timings["per_question"] = [
+        {"question": s["question"], "search_ms": s["search_ms"], "summary_ms": (summaries[i] or {}).get("summary_ms")}
+        for i, s in enumerate(searches)
+    ]
+
+    sources = [
+        {k: src.get(k) for k in ("kind", "title", "url", "source", "collection") if src.get(k)}
+        for s in searches
+        for src in s["sources"]
+    ]
+    yield {
+        "type": "final",
+        "query": query,
+        "answer": answer,
+        "sub_questions": [
+            {"question": s["question"], "summary": (summaries[i] or {}).get("summary", "")} for i, s in enumerate(searches)
+        ],
+        "sources": sources,
+        "duplicates_removed": duplicates,
+        "timings": timings,
+    }
+
+
+async def run_research(query: str, on_event=None, **kwargs) -> Dict[str, Any]:
+    """执行完整流水线并返回 final 事件；on_event（同步或异步函数）接收中间事件。"""
+    final: Dict[str, Any] = {}
+    async for event in research_events(query, **kwargs):
+        if on_event is not None:
+            maybe = on_event(event)
+            if asyncio.iscoroutine(maybe):
+                await maybe
+        if event["type"] == "final":
+            final = event
+    return final
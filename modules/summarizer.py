@@ -16,4 +16,12 @@ def summarize(question, content):
     return summary_chain.invoke({
         "question": question,
         "content": content
-    }).content
\ No newline at end of file
+    }).content
+
+
+async def asummarize(question, content):
+    resp = await summary_chain.ainvoke({
+        "question": question,
+        "content": content
+    })
+    return resp.content
@@ -12,3 +12,8 @@ synth_chain = synth_prompt | llm
 
 def synthesize(points):
     return synth_chain.invoke({"points": "\n".join(points)}).content
+
+
+async def asynthesize(points):
+    resp = await synth_chain.ainvoke({"points": "\n".join(points)})
+    return resp.content
@@ -1,12 +1,13 @@
-import copy
+import json
 from typing import Any, Dict, List, Optional
 
+import tracing
 from mcp_client import MCPClient
 
 
 class MultiMCPClient:
     """
-    聚合多个 MCP stdio server。
+    聚合多个 MCP server（stdio 或 streamable HTTP）。
     - 每个 server 用一个 MCPClient 管理。
     - 工具名加前缀：{server_name}::{tool_name}，避免重名。
     """
@@ -14,8 +15,10 @@ class MultiMCPClient:
     def __init__(self, servers: List[Dict[str, Any]]):
         """
         servers: [{name, command, args, cwd?, env?, timeout?, result_max_chars?}]
+        或 streamable HTTP server：[{name, url, headers?, timeout?, result_max_chars?}]
         """
         self.clients: Dict[str, MCPClient] = {}
+        self._openai_tools: List[Dict[str, Any]] = []
         for server in servers:
             name = server["name"]
             self.clients[name] = MCPClient(
@@ -25,25 +28,40 @@ class MultiMCPClient:
                 env=server.get("env"),
                 call_timeout=server.get("timeout", 20),
                 result_max_chars=server.get("result_max_chars", 1200),
+                name=name,
+                url=server.get("url"),
+                headers=server.get("headers"),
             )
 
     def get_openai_tools(self) -> List[Dict[str, Any]]:
+        # 多个会话共享同一个客户端时复用聚合结果（调用方只读，不要修改返回的列表）
+        if self._openai_tools:
+            return self._openai_tools
         schemas: List[Dict[str, Any]] = []
         for server_name, client in self.clients.items():
             for tool in client.get_openai_tools():
-                tool_copy = copy.deepcopy(tool)
+                # 键按字典序重排（同时完成深拷贝），序列化结果与 server 返回的字段顺序无关
+                tool_copy = json.loads(json.dumps(tool, sort_keys=True, ensure_ascii=False))
                 # OpenAI tools 名称要求匹配 ^[a-zA-Z0-9_-]+$，不能包含冒号
                 tool_copy["function"]["name"] = f"{server_name}__{tool_copy['function']['name']}"
                 schemas.append(tool_copy)
+        # 按工具名排序：与 server 启动/发现顺序无关，请求前缀逐字节稳定，供应商的上下文缓存才能命中
+        schemas.sort(key=lambda t: t["function"]["name"])
         print(f"[MCP] aggregated tools: {[t['function']['name'] for t in schemas]}")
+        # 有 server 未取到工具时不缓存，下次调用再重试
+        if all(client._tool_cache for client in self.clients.values()):
+            self._openai_tools = schemas
         return schemas
 
-    def call_tool(self, prefixed_name: str, arguments: Optional[Dict[str, Any]] = None, timeout: Optional[int] = None) -> str:
+    def call_tool(
+        self, prefixed_name: str, arguments: Optional[Dict[str, Any]] = None, timeout: Optional[int] = None, cancel: Any = None
+    ) -> str:
         if "__" not in prefixed_name:
             return f"工具名称缺少前缀：{prefixed_name}"
         server_name, tool_name = prefixed_name.split("__", 1)
         client = self.clients.get(server_name)
         if not client:
             return f"未找到 MCP server：{server_name}"
-        return client.call_tool(tool_name, arguments or {}, timeout=timeout)
+        with tracing.span("mcp.call_tool", server=server_name, tool=tool_name):
+            return client.call_tool(tool_name, arguments or {}, timeout=timeout, cancel=cancel)
 
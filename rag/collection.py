@@ -0,0 +1,133 @@
+"""
+RAG collection 配置：每个 collection 拥有独立的数据目录、分块配置、索引目录与索引类型。
+
+默认内置菜谱库 cookbook（rag/data -> rag/index，兼容原有目录）；其余 collection 在
+rag/collections.json（或 RAG_COLLECTIONS_FILE 指定的文件）中声明，例如：
+
+{
+  "collections": [
+    {"name": "docs", "data_dir": "docs", "file_globs": ["*.md", "*.txt"],
+     "max_chunk_chars": 800, "chunk_overlap": 100, "index_type": "numpy", "storage": "int8"}
+  ]
+}
+
+相对路径以项目根目录为基准；未给出 index_dir 时使用 rag/index/<name>。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .index_construction import DATA_DIR, INDEX_DIR, INDEX_PATH, resolve_index_dir
+from .vector_store import STORAGE_MODE
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+COLLECTIONS_FILE = Path(os.getenv("RAG_COLLECTIONS_FILE", str(Path(__file__).parent / "collections.json")))
+DEFAULT_COLLECTION = "cookbook"
+WORKSPACE_COLLECTION = "workspace"
+# workspace 中参与索引的文本文件类型
+WORKSPACE_GLOBS = ["*.md", "*.txt", "*.rst", "*.csv", "*.json", "*.yaml", "*.yml", "*.html", "*.py", "*.log"]
+# auto：按 压缩存储 -> faiss -> numpy -> json 的顺序选择可用索引
+INDEX_TYPES = ("auto", "faiss", "numpy", "json")
+
+
+@dataclass
+class CollectionConfig:
+    name: str
+    data_dir: Path
+    index_dir: Path
+    description: str = ""
+    file_globs: List[str] = field(default_factory=lambda: ["*.md"])
+    max_chunk_chars: int = 0
+    chunk_overlap: int = 0
+    index_type: str = "auto"
+    storage: str = STORAGE_MODE
+
+    def __post_init__(self):
+        self.data_dir = Path(self.data_dir)
+        self.index_dir = Path(self.index_dir)
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"collection {self.name} 的 index_type 无效：{self.index_type}")
+
+    @property
+    def active_index_dir(self) -> Path:
+        """当前生效的代际索引目录（见 index_construction.activate_generation）。"""
+        return resolve_index_dir(self.index_dir)
+
+    @property
+    def index_path(self) -> Path:
+        return self.active_index_dir / INDEX_PATH.name
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["data_dir"] = str(self.data_dir)
+        data["index_dir"] = str(self.index_dir)
+        return data
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "CollectionConfig":
+        name = raw["name"]
+        data_dir = Path(raw.get("data_dir") or name)
+        index_dir = Path(raw.get("index_dir") or INDEX_DIR / name)
+        params = {k: v for k, v in raw.items() if k in cls.__dataclass_fields__}
+        params.update(
+            {
+                "data_dir": data_dir if data_dir.is_absolute() else PROJECT_ROOT / data_dir,
+                "index_dir": index_dir if index_dir.is_absolute() else PROJECT_ROOT / index_dir,
+            }
+        )
+        return cls(**params)
+
+
+_REGISTRY: Dict[str, CollectionConfig] = {}
+
+
+def _default_collections() -> Dict[str, CollectionConfig]:
+    return {
+        DEFAULT_COLLECTION: CollectionConfig(
+            name=DEFAULT_COLLECTION,
+            data_dir=DATA_DIR,
+            index_dir=INDEX_DIR,
+            description="菜谱数据集（HowToCook）",
+        ),
+        # workspace 索引由 rag.workspace_index 增量维护，也可整体重建
+        WORKSPACE_COLLECTION: CollectionConfig(
+            name=WORKSPACE_COLLECTION,
+            data_dir=PROJECT_ROOT / "workspace",
+            index_dir=INDEX_DIR / WORKSPACE_COLLECTION,
+            description="workspace 目录中上传/写入的文件",
+            file_globs=list(WORKSPACE_GLOBS),
+            max_chunk_chars=800,
+            chunk_overlap=100,
+            index_type="numpy",
+        ),
+    }
+
+
+def load_collections(path: Path = COLLECTIONS_FILE) -> Dict[str, CollectionConfig]:
+    """读取内置与配置文件中的 collection，配置文件中同名项覆盖内置项。"""
+    collections = _default_collections()
+    if Path(path).exists():
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+        for item in raw.get("collections", []):
+            cfg = CollectionConfig.from_dict(item)
+            collections[cfg.name] = cfg
+    collections.update(_REGISTRY)
+    return collections
+
+
+def register_collection(config: CollectionConfig):
+    """在进程内注册 collection（如 workspace 索引），优先级高于配置文件。"""
+    _REGISTRY[config.name] = config
+
+
+def get_collection(name: Optional[str] = None) -> CollectionConfig:
+    name = name or DEFAULT_COLLECTION
+    collections = load_collections()
+    if name not in collections:
+        raise KeyError(f"未知 collection：{name}，可选：{', '.join(collections)}")
+    return collections[name]
@@ -6,7 +6,7 @@ import hashlib
 import logging
 import uuid
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 from langchain_core.documents import Document
 from langchain_text_splitters import MarkdownHeaderTextSplitter
@@ -34,22 +34,42 @@ class DataPreparationModule:
     CATEGORY_LABELS = list(set(CATEGORY_MAPPING.values()))
     DIFFICULTY_LABELS = ["非常简单", "简单", "中等", "困难", "非常困难"]
 
-    def __init__(self, data_path: str):
+    def __init__(
+        self,
+        data_path: str,
+        file_globs: Optional[List[str]] = None,
+        max_chunk_chars: int = 0,
+        chunk_overlap: int = 0,
+    ):
         """
         初始化数据准备模块
 
         Args:
             data_path: 数据文件夹路径
+            file_globs: 需要加载的文件模式，默认仅 *.md
+            max_chunk_chars: 按标题分块后仍超过该长度的块再按字符切分，0 表示不切分
+            chunk_overlap: 二次切分时相邻块的重叠字符数
         """
         self.data_path = data_path
+        self.file_globs = file_globs or ["*.md"]
+        self.max_chunk_chars = max_chunk_chars
+        self.chunk_overlap = chunk_overlap
         self.documents: List[Document] = []  # 父文档（完整食谱）
         self.chunks: List[Document] = []  # 子文档（按标题分割的小块）
         self.parent_child_map: Dict[str, str] = {}  # 子块ID -> 父文档ID的映射
 
-    def load_documents(self) -> List[Document]:
+    def load_documents(
+        self,
+        progress: Optional[Callable[[int, int], None]] = None,
+        files: Optional[List[Path]] = None,
+    ) -> List[Document]:
         """
         加载文档数据
 
+        Args:
+            progress: 可选回调 progress(已解析文件数, 文件总数)
+            files: 仅加载指定文件（增量索引时使用），默认按 file_globs 扫描整个数据目录
+
         Returns:
             加载的文档列表
         """
@@ -58,7 +78,11 @@ class DataPreparationModule:
         documents = []
         data_path_obj = Path(self.data_path)
 
-        for md_file in data_path_obj.rglob("*.md"):
+        if files is not None:
+            md_files = [Path(f) for f in files]
+        else:
+            md_files = sorted({f for pattern in self.file_globs for f in data_path_obj.rglob(pattern) if f.is_file()})
+        for file_idx, md_file in enumerate(md_files, 1):
             try:
                 with open(md_file, "r", encoding="utf-8") as f:
                     content = f.read()
@@ -84,6 +108,9 @@ class DataPreparationModule:
             except Exception as exc:
                 logger.warning(f"读取文件 {md_file} 失败: {exc}")
 
+            if progress is not None:
+                progress(file_idx, len(md_files))
+
         for doc in documents:
             self._enhance_metadata(doc)
 
@@ -141,10 +168,15 @@ class DataPreparationModule:
             raise ValueError("请先加载文档")
 
         chunks = self._markdown_header_split()
+        if self.max_chunk_chars > 0:
+            chunks = self._split_oversized(chunks)
 
         for i, chunk in enumerate(chunks):
             if "chunk_id" not in chunk.metadata:
                 chunk.metadata["chunk_id"] = str(uuid.uuid4())
+            # (chunk_index, sub_index) 为块在父文档中的位置；未二次切分的块只有一段
+            chunk.metadata.setdefault("sub_index", 0)
+            chunk.metadata.setdefault("sub_count", 1)
             chunk.metadata["batch_index"] = i
             chunk.metadata["chunk_size"] = len(chunk.page_content)
 
@@ -205,6 +237,28 @@ class DataPreparationModule:
         logger.info(f"Markdown结构分割完成，生成 {len(all_chunks)} 个结构化块")
         return all_chunks
 
+    def _split_oversized(self, chunks: List[Document]) -> List[Document]:
+        """对超过 max_chunk_chars 的块按字符二次切分（无标题的纯文本文档会整篇落在一个块里）。"""
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.max_chunk_chars,
+            chunk_overlap=min(self.chunk_overlap, self.max_chunk_chars // 2),
+        )
+        result: List[Document] = []
+        for chunk in chunks:
+            if len(chunk.page_content) <= self.max_chunk_chars:
+                result.append(chunk)
+                continue
+            pieces = splitter.split_text(chunk.page_content)
+            for j, piece in enumerate(pieces):
+                metadata = dict(chunk.metadata)
+                child_id = str(uuid.uuid4())
+                metadata.update({"chunk_id": child_id, "sub_index": j, "sub_count": len(pieces)})
+                self.parent_child_map[child_id] = metadata.get("parent_id")
+                result.append(Document(page_content=piece, metadata=metadata))
+        return result
+
     def filter_documents_by_category(self, category: str) -> List[Document]:
         """按分类过滤文档"""
         return [doc for doc in self.documents if doc.metadata.get("category") == category]
@@ -1,30 +1,323 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import List
+import argparse
+import json
+import os
+import tempfile
+import zlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+import tracing
+
+DEFAULT_MODEL_NAME = "BAAI/bge-small-zh-v1.5"
+
+# 推理后端：torch（原始全精度）、torch-int8（动态量化 Linear）、onnx、onnx-int8（ONNX Runtime 动态 int8 量化）；
+# hash 为字符 n-gram 特征哈希，无需模型文件，仅用于离线基准测试与冒烟测试
+SUPPORTED_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8", "hash")
+HASH_DIM = int(os.getenv("RAG_HASH_DIM", "512"))
+EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+# 导出/量化后的模型缓存目录，首次使用时生成，之后直接复用
+MODEL_CACHE_DIR = Path(os.getenv("RAG_MODEL_CACHE_DIR", str(Path(__file__).parent / "models")))
+
+
+def _model_cache_path(model_name: str, cache_dir: Path) -> Path:
+    return Path(cache_dir) / model_name.replace("/", "__") / "onnx"
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+def export_onnx(model_name: str = DEFAULT_MODEL_NAME, cache_dir: Path = MODEL_CACHE_DIR, quantize: bool = False) -> Path:
+    """
+    将 SentenceTransformer 的底层 Transformer 导出为 ONNX（可选动态 int8 量化），结果缓存到 cache_dir。
+    返回可直接加载的 .onnx 文件路径；已存在时跳过导出。
+    """
+    out_dir = _model_cache_path(model_name, cache_dir)
+    fp32_path = out_dir / "model.onnx"
+    int8_path = out_dir / "model.int8.onnx"
+    target = int8_path if quantize else fp32_path
+    if target.exists() and (out_dir / "pooling.json").exists():
+        return target
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pooling_path = out_dir / "pooling.json"
+    if not (fp32_path.exists() and pooling_path.exists()):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        st = SentenceTransformer(model_name, device="cpu")
+        transformer = st[0]
+        tokenizer = transformer.tokenizer
+        input_names = [n for n in tokenizer.model_input_names if n in ("input_ids", "attention_mask", "token_type_ids")]
+
+        class _LastHidden(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *inputs):
+                return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+        # 先导出到临时目录再逐个 os.replace 到位，pooling.json 最后落盘作为完成标记：
+        # 进程中途被杀或多个进程同时首次导出时，都不会留下缺 pooling.json 却被当作已导出的目录
+        with tempfile.TemporaryDirectory(dir=out_dir.parent, prefix=".onnx-") as tmp:
+            tmp_dir = Path(tmp)
+            dummy = tokenizer(["导出示例"], return_tensors="pt")
+            dynamic_axes = {name: {0: "batch", 1: "seq"} for name in input_names}
+            dynamic_axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+            torch.onnx.export(
+                _LastHidden(transformer.auto_model.eval()),
+                tuple(dummy[name] for name in input_names),
+                str(tmp_dir / fp32_path.name),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+            tokenizer.save_pretrained(str(tmp_dir))
+            pooling_mode = "cls"
+            if len(st) > 1 and hasattr(st[1], "get_pooling_mode_str"):
+                pooling_mode = st[1].get_pooling_mode_str()
+            (tmp_dir / pooling_path.name).write_text(
+                json.dumps({"mode": pooling_mode, "max_seq_length": st.max_seq_length}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            files = sorted(p for p in tmp_dir.iterdir() if p.name != pooling_path.name)
+            for path in files + [tmp_dir / pooling_path.name]:
+                os.replace(path, out_dir / path.name)
+
+    if quantize and not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_path = out_dir / f".{os.getpid()}.{int8_path.name}"
+        try:
+            quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return target
+
+
+class _TorchBackend:
+    """SentenceTransformer 推理，int8=True 时对 Linear 层做动态量化。"""
+
+    def __init__(self, model_name: str, int8: bool = False):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu" if int8 else None)
+        if int8:
+            import torch
+
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,  # 归一化后内积等价于 cosine
+        )
+
+
+class _OnnxBackend:
+    """ONNX Runtime CPU 推理，按长度排序分批以减少 padding。"""
+
+    def __init__(self, model_name: str, cache_dir: Path, int8: bool = False):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = export_onnx(model_name, cache_dir, quantize=int8)
+        model_dir = model_path.parent
+        pooling = json.loads((model_dir / "pooling.json").read_text(encoding="utf-8"))
+        self.pooling_mode = pooling.get("mode", "cls")
+        self.max_seq_length = int(pooling.get("max_seq_length") or 512)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = int(os.getenv("RAG_EMBED_THREADS", "0"))
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_path), opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.pooling_mode == "cls":
+            return hidden[:, 0]
+        mask_f = mask[..., None].astype(np.float32)
+        return (hidden * mask_f).sum(axis=1) / np.clip(mask_f.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            idxs = order[start : start + batch_size]
+            enc = self.tokenizer(
+                [texts[i] for i in idxs],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+            pooled = _normalize(self._pool(hidden, enc["attention_mask"]))
+            for i, vec in zip(idxs, pooled):
+                out[i] = vec
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(out)
+
+
+class _HashBackend:
+    """确定性的字符 1/2-gram 特征哈希向量（不依赖模型），语义能力有限但检索路径与真实后端一致。"""
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        chars = [c for c in text.lower() if not c.isspace()]
+        grams = chars + [a + b for a, b in zip(chars, chars[1:])]
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vec
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize(np.stack([self._vector(t) for t in texts]))
 
 
 @dataclass
 class Embedder:
 
-    model_name: str = "BAAI/bge-small-zh-v1.5"
+    model_name: str = DEFAULT_MODEL_NAME
+    backend: str = EMBED_BACKEND
+    batch_size: int = EMBED_BATCH_SIZE
+    cache_dir: Path = field(default=MODEL_CACHE_DIR)
 
     def __post_init__(self):
-        self.model = SentenceTransformer(self.model_name)
+        if self.backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"不支持的向量化后端：{self.backend}，可选：{', '.join(SUPPORTED_BACKENDS)}")
+        with tracing.span("rag.embedder_load", backend=self.backend):
+            if self.backend == "hash":
+                self._impl = _HashBackend()
+            elif self.backend.startswith("onnx"):
+                self._impl = _OnnxBackend(self.model_name, self.cache_dir, int8=self.backend == "onnx-int8")
+            else:
+                self._impl = _TorchBackend(self.model_name, int8=self.backend == "torch-int8")
 
     def encode(self, texts: List[str]) -> np.ndarray:
         """
         返回 shape = (N, D) 的 float32 向量（已归一化，可直接用内积做相似度）。
         """
-        vecs = self.model.encode(
-            texts,
-            batch_size=32,
-            show_progress_bar=False,
-            convert_to_numpy=True,
-            normalize_embeddings=True,  # 归一化后内积等价于 cosine
+        vecs = self._impl.encode(texts, self.batch_size)
+        return np.asarray(vecs, dtype=np.float32)
+
+
+@lru_cache(maxsize=4)
+def get_embedder(model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None) -> Embedder:
+    """进程内复用 Embedder，避免每次检索都重新加载模型。"""
+    return Embedder(model_name=model_name, backend=backend or EMBED_BACKEND)
+
+
+def embedding_info(model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None) -> Dict[str, Any]:
+    """当前向量化配置（不加载模型），构建索引时写入 embedding.json，加载时据此校验。"""
+    backend = backend or EMBED_BACKEND
+    if backend == "hash":
+        return {"backend": backend, "model": None, "dim": HASH_DIM}
+    return {"backend": backend, "model": model_name}
+
+
+def embedding_mismatch(recorded: Optional[Dict[str, Any]], current: Dict[str, Any]) -> Optional[str]:
+    """
+    比较索引记录的向量化配置与当前配置，不兼容时返回原因。
+    同一模型的 torch/onnx 各精度后端向量可互通（见 compare_backends），只比较模型与维度；无记录的旧索引视为兼容。
+    """
+    if not recorded:
+        return None
+    rec_hash, cur_hash = recorded.get("backend") == "hash", current.get("backend") == "hash"
+    if rec_hash != cur_hash or recorded.get("model") != current.get("model"):
+        return (
+            f"索引由 {recorded.get('backend')}/{recorded.get('model')} 构建，"
+            f"当前为 {current.get('backend')}/{current.get('model')}"
         )
-        return vecs.astype(np.float32)
+    if recorded.get("dim") and current.get("dim") and recorded["dim"] != current["dim"]:
+        return f"索引向量维度 {recorded['dim']} 与当前 {current['dim']} 不一致"
+    return None
+
+
+def compare_backends(
+    texts: List[str],
+    queries: Optional[List[str]] = None,
+    candidate: str = "onnx-int8",
+    baseline: str = "torch",
+    model_name: str = DEFAULT_MODEL_NAME,
+    top_k: int = 5,
+    min_cosine: float = 0.98,
+    min_recall: float = 0.9,
+) -> Dict[str, Any]:
+    """
+    检查候选后端相对基线的检索质量：逐条向量余弦一致性 + 查询 top_k 召回重合度。
+    未提供 queries 时用 texts 前 20 条自身做查询。
+    """
+    queries = queries or texts[:20]
+    base = get_embedder(model_name, baseline)
+    cand = get_embedder(model_name, candidate)
+
+    base_docs, cand_docs = base.encode(texts), cand.encode(texts)
+    base_q, cand_q = base.encode(queries), cand.encode(queries)
+    cosines = np.sum(base_docs * cand_docs, axis=1)
+
+    k = min(top_k, len(texts))
+    base_top = np.argsort(-(base_q @ base_docs.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_q @ cand_docs.T), axis=1)[:, :k]
+    recalls = [len(set(b) & set(c)) / k for b, c in zip(base_top.tolist(), cand_top.tolist())] if k else [1.0]
+
+    report = {
+        "baseline": baseline,
+        "candidate": candidate,
+        "texts": len(texts),
+        "queries": len(queries),
+        "cosine_mean": float(cosines.mean()) if cosines.size else 1.0,
+        "cosine_min": float(cosines.min()) if cosines.size else 1.0,
+        f"recall@{k}": float(np.mean(recalls)),
+    }
+    report["passed"] = report["cosine_min"] >= min_cosine and report[f"recall@{k}"] >= min_recall
+    return report
+
+
+def _sample_corpus(limit: int) -> List[str]:
+    from .data_preparation import DataPreparationModule
+
+    prep = DataPreparationModule(str(Path(__file__).parent / "data"))
+    prep.load_documents()
+    return [c.page_content for c in prep.chunk_documents()[:limit]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出量化模型并校验检索质量")
+    parser.add_argument("--backend", default="onnx-int8", choices=SUPPORTED_BACKENDS)
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--export", action="store_true", help="仅导出/量化 ONNX 模型到缓存目录")
+    parser.add_argument("--check", action="store_true", help="与 torch 基线比较检索质量")
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
 
+    if args.export and args.backend.startswith("onnx"):
+        print(export_onnx(args.model, quantize=args.backend == "onnx-int8"))
+    if args.check:
+        result = compare_backends(_sample_corpus(args.samples), candidate=args.backend, model_name=args.model)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
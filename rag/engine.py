@@ -0,0 +1,403 @@
+"""
+检索引擎：每个 collection 一个 RagEngine，首次检索时懒加载索引并常驻内存；
+CollectionManager 负责按 LRU 淘汰冷 collection，并支持多 collection 并行检索、按分数合并结果。
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import tracing
+
+from .collection import WORKSPACE_COLLECTION, CollectionConfig, get_collection, load_collections
+from .embedding import embedding_info, embedding_mismatch, get_embedder
+from .index_construction import (
+    FAISS_INDEX_PATH,
+    META_PATH,
+    activate_generation,
+    build_index,
+    load_index,
+    new_generation_dir,
+    read_embed_info,
+)
+from .vector_store import QUANT_FILE, VectorStore, has_store
+
+try:  # 可选 FAISS
+    import faiss
+except Exception:  # pragma: no cover - faiss 非必需
+    faiss = None
+
+# 同时常驻内存的 collection 数量上限，超出后按最近最少使用卸载
+MAX_LOADED_COLLECTIONS = int(os.getenv("RAG_MAX_LOADED_COLLECTIONS", "4"))
+SEARCH_WORKERS = int(os.getenv("RAG_SEARCH_WORKERS", "4"))
+
+
+def _dot_similarity(a: List[float], b: List[float]) -> float:
+    """向量已归一化，可直接用内积表示余弦相似度。"""
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _to_result(rec: Dict[str, object], score: float) -> Dict[str, object]:
+    return {
+        "id": rec.get("id"),
+        "score": float(score),
+        "source": rec.get("source"),
+        "dish_name": rec.get("dish_name"),
+        "category": rec.get("category"),
+        "difficulty": rec.get("difficulty"),
+        "content": rec.get("content"),
+        "parent_id": rec.get("parent_id"),
+        "chunk_index": rec.get("chunk_index"),
+        "sub_index": rec.get("sub_index"),
+        "sub_count": rec.get("sub_count"),
+    }
+
+
+class IndexNotReady(RuntimeError):
+    """collection 尚无可用索引，已提交后台构建任务。"""
+
+    def __init__(self, collection: str, job: Dict[str, object], reason: Optional[str] = None):
+        state = f"索引与当前向量化配置不一致（{reason}）" if reason else "索引尚未就绪"
+        super().__init__(f"collection {collection} {state}，后台构建任务 {job.get('job_id')} 进行中，请稍后重试")
+        self.collection = collection
+        self.job = job
+        self.reason = reason
+
+
+class RagEngine:
+    """单个 collection 的检索引擎；索引文件变化（重建）后下一次检索自动重新加载。"""
+
+    def __init__(self, config: CollectionConfig):
+        self.config = config
+        self._lock = threading.RLock()
+        self.kind: Optional[str] = None  # store / faiss / numpy / json
+        self._store: Optional[VectorStore] = None
+        self._faiss = None
+        self._matrix: Optional[np.ndarray] = None
+        self._records: List[Dict[str, object]] = []
+        self._signature: Optional[Tuple] = None
+        self._embed_info: Optional[Dict[str, object]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.kind is not None
+
+    def _index_signature(self) -> Tuple:
+        index_dir = self.config.active_index_dir
+        sig: List[object] = [str(index_dir)]
+        for name in (self.config.index_path.name, QUANT_FILE, FAISS_INDEX_PATH.name):
+            path = index_dir / name
+            sig.append(path.stat().st_mtime_ns if path.exists() else None)
+        return tuple(sig)
+
+    def index_exists(self) -> bool:
+        return self.config.index_path.exists() or has_store(self.config.active_index_dir)
+
+    def _load(self):
+        index_dir = self.config.active_index_dir
+        index_type = self.config.index_type
+        self.unload()
+        signature = self._index_signature()
+        self._embed_info = read_embed_info(index_dir)
+
+        if index_type == "auto" and has_store(index_dir):
+            self._store = VectorStore(index_dir)
+            self.kind = "store"
+        elif index_type in ("auto", "faiss") and faiss is not None and (index_dir / FAISS_INDEX_PATH.name).exists():
+            try:
+                self._faiss = faiss.read_index(str(index_dir / FAISS_INDEX_PATH.name))
+                self._records = json.loads((index_dir / META_PATH.name).read_text(encoding="utf-8"))
+                self.kind = "faiss"
+            except Exception:
+                self._faiss, self._records = None, []
+
+        if self.kind is None:
+            records = load_index(index_path=self.config.index_path)
+            if index_type == "json":
+                self._records = records
+                self.kind = "json"
+            else:
+                # NumPy 矩阵检索：向量常驻为 float32 矩阵，记录去掉 embedding 字段
+                vectors = [rec.get("embedding") or [] for rec in records]
+                dim = max((len(v) for v in vectors), default=0)
+                self._matrix = np.array([v if len(v) == dim else [0.0] * dim for v in vectors], dtype=np.float32)
+                self._records = [{k: v for k, v in rec.items() if k != "embedding"} for rec in records]
+                self.kind = "numpy"
+        self._signature = signature
+
+    def ensure_loaded(self):
+        with self._lock:
+            if not self.loaded or self._signature != self._index_signature():
+                self._load()
+
+    def embedding_mismatch(self) -> Optional[str]:
+        """索引构建时的向量化配置与当前配置不兼容时返回原因（用不同模型/维度的向量检索结果无意义）。"""
+        with self._lock:
+            self.ensure_loaded()
+            return embedding_mismatch(self._embed_info, embedding_info())
+
+    def unload(self):
+        with self._lock:
+            if self._store is not None:
+                self._store.close()
+            self._store, self._faiss, self._matrix = None, None, None
+            self._records = []
+            self._embed_info = None
+            self.kind = None
+            self._signature = None
+
+    def resident_bytes(self) -> int:
+        if self._store is not None:
+            return self._store.resident_bytes()
+        size = self._matrix.nbytes if self._matrix is not None else 0
+        if self._faiss is not None:
+            size += self._faiss.ntotal * self._faiss.d * 4
+        return size
+
+    def build(self, progress=None, should_cancel=None, force: bool = True) -> Dict[str, object]:
+        """
+        在新的代际目录中构建索引，完成后原子切换；构建期间检索继续使用旧索引。
+        workspace collection 交给 WorkspaceIndexer（与后台刷新共用锁与清单），force=False 时只做增量刷新。
+        """
+        cfg = self.config
+        if cfg.name == WORKSPACE_COLLECTION:
+            from .workspace_index import get_indexer
+
+            result = get_indexer().refresh(force=force, should_cancel=should_cancel)
+            result["collection"] = cfg.name
+            return result
+        gen_dir = new_generation_dir(cfg.index_dir)
+        try:
+            result = build_index(
+                data_dir=cfg.data_dir,
+                index_path=gen_dir / cfg.index_path.name,
+                storage=cfg.storage,
+                file_globs=cfg.file_globs,
+                max_chunk_chars=cfg.max_chunk_chars,
+                chunk_overlap=cfg.chunk_overlap,
+                build_faiss=cfg.index_type in ("auto", "faiss"),
+                progress=progress,
+                should_cancel=should_cancel,
+            )
+        except BaseException:
+            shutil.rmtree(gen_dir, ignore_errors=True)
+            raise
+        activate_generation(cfg.index_dir, gen_dir)
+        result["collection"] = cfg.name
+        result["generation"] = gen_dir.name
+        return result
+
+    def search_vector(
+        self,
+        query_vec: np.ndarray,
+        top_k: int = 5,
+        min_score: float = 0.2,
+        rescore: bool = True,
+        with_vectors: bool = False,
+    ) -> List[Dict[str, object]]:
+        """with_vectors=True 时每条结果附带 "vector"（numpy，已归一化），供 MMR 去重等后处理使用。"""
+        # 加载与检索在同一把锁内完成：CollectionManager 淘汰（unload）不会插在两者之间，
+        # 否则 kind 变为 None 会落入 JSON 分支误报索引为空
+        with self._lock:
+            self.ensure_loaded()
+            with tracing.span("rag.search", collection=self.config.name, kind=self.kind) as span:
+                vectors: List[Optional[np.ndarray]] = []
+                if self.kind == "store":
+                    hits = self._store.search(query_vec, top_k=top_k, min_score=min_score, rescore=rescore)
+                    results = [_to_result(self._store.get_record(idx), score) for idx, score in hits]
+                    if with_vectors and hits:
+                        vectors = list(self._store.get_vectors([idx for idx, _ in hits]))
+                elif self.kind == "faiss":
+                    D, I = self._faiss.search(np.expand_dims(query_vec, axis=0), top_k)
+                    pairs = [(idx, score) for score, idx in zip(D[0].tolist(), I[0].tolist()) if idx != -1 and score >= min_score]
+                    results = [_to_result(self._records[idx], score) for idx, score in pairs]
+                    if with_vectors:
+                        vectors = [self._reconstruct(idx) for idx, _ in pairs]
+                elif self.kind == "numpy":
+                    if not len(self._records):
+                        return []
+                    scores = self._matrix @ query_vec
+                    k = min(max(top_k, 1), len(scores))
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    top = [i for i in top[np.argsort(-scores[top])].tolist() if scores[i] >= min_score]
+                    results = [_to_result(self._records[i], scores[i]) for i in top]
+                    if with_vectors:
+                        vectors = [self._matrix[i] for i in top]
+                else:
+                    # 纯 Python 检索
+                    if not self._records:
+                        raise RuntimeError("索引为空，请先构建索引。")
+                    query_embedding = query_vec.tolist()
+                    results = []
+                    for record in self._records:
+                        emb = record.get("embedding") or []
+                        if not emb:
+                            continue
+                        score = _dot_similarity(query_embedding, emb)
+                        if score >= min_score:
+                            item = _to_result(record, score)
+                            if with_vectors:
+                                item["vector"] = np.asarray(emb, dtype=np.float32)
+                            results.append(item)
+                    results.sort(key=lambda x: x["score"], reverse=True)
+                    results = results[: max(top_k, 1)]
+                span.set_attribute("hits", len(results))
+        for item, vec in zip(results, vectors):
+            item["vector"] = vec
+        for item in results:
+            item["collection"] = self.config.name
+        return results
+
+    def _reconstruct(self, idx: int) -> Optional[np.ndarray]:
+        """从 FAISS 索引取回向量；部分索引类型不支持 reconstruct，此时返回 None。"""
+        try:
+            return np.asarray(self._faiss.reconstruct(int(idx)), dtype=np.float32)
+        except Exception:
+            return None
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        min_score: float = 0.2,
+        rescore: bool = True,
+        ensure_index: bool = True,
+        with_vectors: bool = False,
+    ) -> List[Dict[str, object]]:
+        if not self.index_exists():
+            if not ensure_index:
+                raise FileNotFoundError(f"collection {self.config.name} 尚无索引，请先构建")
+            # 不在检索路径上同步构建：启动（或复用）后台构建任务并立即返回
+            from .jobs import start_build_job
+
+            raise IndexNotReady(self.config.name, start_build_job(self.config.name))
+        reason = self.embedding_mismatch()
+        if reason:
+            if not ensure_index:
+                raise RuntimeError(f"collection {self.config.name} 需重建索引：{reason}")
+            from .jobs import start_build_job
+
+            raise IndexNotReady(self.config.name, start_build_job(self.config.name), reason=reason)
+        with tracing.span("rag.embed"):
+            query_vec = get_embedder().encode([query])[0]  # numpy, 已归一化
+        return self.search_vector(query_vec, top_k=top_k, min_score=min_score, rescore=rescore, with_vectors=with_vectors)
+
+
+class CollectionManager:
+    """按名称管理 RagEngine，最多保留 max_loaded 个已加载的 collection。"""
+
+    def __init__(self, max_loaded: int = MAX_LOADED_COLLECTIONS, max_workers: int = SEARCH_WORKERS):
+        self.max_loaded = max(1, max_loaded)
+        self._engines: "OrderedDict[str, RagEngine]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-search")
+
+    def names(self) -> List[str]:
+        return list(load_collections().keys())
+
+    def get(self, name: Optional[str] = None, evict: bool = True) -> RagEngine:
+        config = get_collection(name)
+        with self._lock:
+            engine = self._engines.get(config.name)
+            if engine is None or engine.config != config:
+                if engine is not None:
+                    engine.unload()
+                engine = RagEngine(config)
+                self._engines[config.name] = engine
+            self._engines.move_to_end(config.name)
+            if evict:
+                self._evict(keep=config.name)
+            return engine
+
+    def _evict(self, keep: Optional[str] = None):
+        """按最近最少使用卸载已加载的 collection；keep 为即将加载的 collection，为其预留一个名额。"""
+        loaded = [name for name, eng in self._engines.items() if eng.loaded and name != keep]
+        limit = self.max_loaded - 1 if keep else self.max_loaded
+        while len(loaded) > limit:
+            self._engines[loaded.pop(0)].unload()
+
+    def resolve(self, collection: Optional[str]) -> List[str]:
+        """解析 collection 参数：None/单个名称、逗号分隔列表或 all。"""
+        if not collection:
+            return [get_collection(None).name]
+        if collection.strip().lower() in ("all", "*"):
+            return self.names()
+        return [c.strip() for c in collection.split(",") if c.strip()]
+
+    def search(
+        self,
+        query: str,
+        collections: Optional[List[str]] = None,
+        top_k: int = 5,
+        min_score: float = 0.2,
+        rescore: bool = True,
+        ensure_index: bool = True,
+        with_vectors: bool = False,
+    ) -> List[Dict[str, object]]:
+        """在多个 collection 上并行检索（查询只向量化一次），按分数合并取 top_k。"""
+        names = collections or [get_collection(None).name]
+        if len(names) == 1:
+            return self.get(names[0]).search(query, top_k, min_score, rescore, ensure_index, with_vectors)
+
+        # 多 collection 检索不触发构建，跳过尚无索引或向量化配置不一致的 collection；检索结束后再统一按 LRU 淘汰
+        engines = [
+            eng
+            for eng in (self.get(name, evict=False) for name in names)
+            if eng.index_exists() and not eng.embedding_mismatch()
+        ]
+        with tracing.span("rag.embed"):
+            query_vec = get_embedder().encode([query])[0]
+        # 复制 contextvars，使工作线程中的 rag.search span 挂在当前请求的 trace 下
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run, eng.search_vector, query_vec, top_k, min_score, rescore, with_vectors
+            )
+            for eng in engines
+        ]
+        merged: List[Dict[str, object]] = []
+        for fut in futures:
+            merged.extend(fut.result())
+        with self._lock:
+            self._evict()
+        merged.sort(key=lambda x: x["score"], reverse=True)
+        return merged[: max(top_k, 1)]
+
+    def describe(self) -> List[Dict[str, object]]:
+        info = []
+        for name, config in load_collections().items():
+            engine = self._engines.get(name)
+            info.append(
+                {
+                    "name": name,
+                    "description": config.description,
+                    "data_dir": str(config.data_dir),
+                    "index_type": config.index_type,
+                    "storage": config.storage,
+                    "indexed": config.index_path.exists() or has_store(config.active_index_dir),
+                    "generation": config.active_index_dir.name if config.active_index_dir != config.index_dir else None,
+                    "loaded": bool(engine and engine.loaded),
+                    "resident_bytes": engine.resident_bytes() if engine and engine.loaded else 0,
+                }
+            )
+        return info
+
+
+_MANAGER: Optional[CollectionManager] = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_manager() -> CollectionManager:
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = CollectionManager()
+        return _MANAGER
@@ -1,11 +1,16 @@
 import json
+import os
+import shutil
+import time
+import uuid
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 import numpy as np
 
 from .data_preparation import DataPreparationModule
-from .embedding import Embedder
+from .embedding import embedding_info, get_embedder
+from .vector_store import QUANT_FILE, STORAGE_MODE, STORAGE_MODES, write_store
 
 try:  # 可选：FAISS 加速
     import faiss
@@ -18,6 +23,50 @@ INDEX_DIR = BASE_DIR / "index"
 INDEX_PATH = INDEX_DIR / "index.json"
 FAISS_INDEX_PATH = INDEX_DIR / "faiss.index"
 META_PATH = INDEX_DIR / "meta.json"
+# 构建时的向量化后端 / 模型 / 维度，检索端加载时校验，与当前配置不一致则拒绝使用并重建
+EMBED_INFO_FILE = "embedding.json"
+# 代际目录：每次构建写入 generations/<id>/，完成后原子替换 CURRENT 指针，检索端下一次查询即切换
+GENERATIONS_DIRNAME = "generations"
+CURRENT_FILE = "CURRENT"
+KEEP_GENERATIONS = 2
+
+
+class BuildCancelled(Exception):
+    """索引构建被取消。"""
+
+
+def resolve_index_dir(index_dir: Path) -> Path:
+    """返回当前生效的索引目录：CURRENT 指向的代际目录，不存在时为 index_dir 本身（兼容旧布局）。"""
+    index_dir = Path(index_dir)
+    pointer = index_dir / CURRENT_FILE
+    if pointer.exists():
+        gen = pointer.read_text(encoding="utf-8").strip()
+        gen_dir = index_dir / GENERATIONS_DIRNAME / gen
+        if gen and gen_dir.is_dir():
+            return gen_dir
+    return index_dir
+
+
+def new_generation_dir(index_dir: Path) -> Path:
+    gen_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    gen_dir = Path(index_dir) / GENERATIONS_DIRNAME / gen_id
+    gen_dir.mkdir(parents=True, exist_ok=False)
+    return gen_dir
+
+
+def activate_generation(index_dir: Path, gen_dir: Path, keep: int = KEEP_GENERATIONS):
+    """原子切换 CURRENT 指针到 gen_dir，并清理更早的代际目录（保留最近 keep 个）。"""
+    index_dir = Path(index_dir)
+    tmp = index_dir / f".{CURRENT_FILE}.{uuid.uuid4().hex}"
+    tmp.write_text(Path(gen_dir).name, encoding="utf-8")
+    os.replace(tmp, index_dir / CURRENT_FILE)
+
+    gens_root = index_dir / GENERATIONS_DIRNAME
+    gens = sorted((p for p in gens_root.iterdir() if p.is_dir()), key=lambda p: p.name)
+    for old in gens[: max(0, len(gens) - keep)]:
+        if old.name != Path(gen_dir).name:
+            # 旧代际可能仍被检索进程 mmap，Linux 下删除目录不影响已打开的文件
+            shutil.rmtree(old, ignore_errors=True)
 
 
 def _batched(items: List[str], batch_size: int):
@@ -28,23 +77,74 @@ def _batched(items: List[str], batch_size: int):
 def build_index(
     data_dir: Path = DATA_DIR,
     index_path: Path = INDEX_PATH,
-    batch_size: int = 16,
+    batch_size: int = 256,
+    storage: str = STORAGE_MODE,
+    file_globs: Optional[List[str]] = None,
+    max_chunk_chars: int = 0,
+    chunk_overlap: int = 0,
+    build_faiss: bool = True,
+    progress: Optional[Callable[[Dict[str, object]], None]] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
 ) -> Dict[str, object]:
-    """加载菜谱 markdown，分块后生成向量索引文件。"""
+    """加载菜谱 markdown，分块后生成向量索引文件。
+
+    storage 为 float16 / int8 / pq 时额外写入压缩向量存储（见 rag.vector_store），检索时优先使用。
+    faiss.index / meta.json 与 index_path 写在同一目录，便于每个 collection 拥有独立索引目录。
+    progress 接收阶段进度（parsing / embedding / writing），should_cancel 返回 True 时抛出 BuildCancelled。
+    """
+
+    def report(**info):
+        if progress is not None:
+            progress(info)
+
+    def check_cancel():
+        if should_cancel is not None and should_cancel():
+            raise BuildCancelled("索引构建已取消")
+
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"不支持的存储模式：{storage}，可选：{', '.join(STORAGE_MODES)}")
     data_dir = Path(data_dir)
     index_path = Path(index_path)
 
-    prep = DataPreparationModule(str(data_dir))
-    prep.load_documents()
+    prep = DataPreparationModule(
+        str(data_dir),
+        file_globs=file_globs,
+        max_chunk_chars=max_chunk_chars,
+        chunk_overlap=chunk_overlap,
+    )
+    prep.load_documents(
+        progress=lambda done, total: report(stage="parsing", files_parsed=done, files_total=total)
+    )
+    check_cancel()
     chunks = prep.chunk_documents()
 
-    embedder = Embedder()
+    embedder = get_embedder()
     embeddings: List[List[float]] = []
     contents = [chunk.page_content for chunk in chunks]
+    report(stage="embedding", chunks_embedded=0, chunks_total=len(contents))
     for batch in _batched(contents, batch_size):
-        vecs = embedder.encode(batch)  # numpy array, already normalized
+        check_cancel()
+        vecs = embedder.encode(batch)  # numpy array, already normalized；批内由 Embedder 再按 batch_size 切分
         embeddings.extend(vec.tolist() for vec in vecs)
+        report(stage="embedding", chunks_embedded=len(embeddings), chunks_total=len(contents))
+    check_cancel()
+    report(stage="writing", chunks_embedded=len(embeddings), chunks_total=len(contents))
+
+    records = chunk_records(chunks, embeddings)
+    files = write_index_files(
+        index_path,
+        records,
+        storage=storage,
+        build_faiss=build_faiss,
+        embed_info=embedding_info(embedder.model_name, embedder.backend),
+    )
 
+    stats = prep.get_statistics()
+    return {"message": "索引已构建", "chunks": len(records), **files, "stats": stats}
+
+
+def chunk_records(chunks, embeddings: List[List[float]]) -> List[Dict[str, object]]:
+    """把分块结果与向量组装为索引记录。"""
     records: List[Dict[str, object]] = []
     for chunk, emb in zip(chunks, embeddings):
         meta = chunk.metadata or {}
@@ -52,6 +152,9 @@ def build_index(
             {
                 "id": meta.get("chunk_id"),
                 "parent_id": meta.get("parent_id"),
+                "chunk_index": meta.get("chunk_index"),
+                "sub_index": meta.get("sub_index"),
+                "sub_count": meta.get("sub_count"),
                 "source": meta.get("source"),
                 "dish_name": meta.get("dish_name"),
                 "category": meta.get("category"),
@@ -60,44 +163,82 @@ def build_index(
                 "embedding": emb,
             }
         )
+    return records
+
+
+def write_index_files(
+    index_path: Path,
+    records: List[Dict[str, object]],
+    storage: str = STORAGE_MODE,
+    build_faiss: bool = True,
+    embed_info: Optional[Dict[str, Any]] = None,
+) -> Dict[str, object]:
+    """
+    写入 index.json 及（按存储模式）压缩存储或 faiss.index / meta.json，返回产物路径。
+    embed_info 为生成向量所用的配置（默认取当前配置），连同实际维度写入 embedding.json。
+    """
+    index_path = Path(index_path)
+    faiss_path = index_path.parent / FAISS_INDEX_PATH.name
+    meta_path = index_path.parent / META_PATH.name
+    embeddings = [rec.get("embedding") or [] for rec in records]
 
-    INDEX_DIR.mkdir(parents=True, exist_ok=True)
     index_path.parent.mkdir(parents=True, exist_ok=True)
     with open(index_path, "w", encoding="utf-8") as f:
         json.dump(records, f, ensure_ascii=False)
+    info = dict(embed_info or embedding_info())
+    info["dim"] = len(embeddings[0]) if embeddings else info.get("dim")
+    (index_path.parent / EMBED_INFO_FILE).write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+
+    # 压缩存储：量化向量 + 压缩 chunk 文本块，替代 faiss.index / meta.json 的全精度副本
+    store_info = None
+    quant_path = index_path.parent / QUANT_FILE
+    if storage != "float32":
+        meta_records = [{k: v for k, v in rec.items() if k != "embedding"} for rec in records]
+        store_info = write_store(index_path.parent, meta_records, np.array(embeddings, dtype="float32"), storage)
+        for stale in (faiss_path, meta_path):
+            stale.unlink(missing_ok=True)
+    elif quant_path.exists():
+        quant_path.unlink()
 
     # 构建 FAISS 索引（如可用），加速检索
     faiss_ok = False
-    if faiss is not None:
+    if faiss is not None and build_faiss and store_info is None:
         try:
             vec_matrix = np.array(embeddings, dtype="float32")
             dim = vec_matrix.shape[1] if vec_matrix.size else 0
             index = faiss.IndexFlatIP(dim)
             if vec_matrix.size:
                 index.add(vec_matrix)
-            faiss.write_index(index, str(FAISS_INDEX_PATH))
+            faiss.write_index(index, str(faiss_path))
 
             # 保存 metadata（去掉 embedding）供检索时返回
             meta_records = []
             for rec in records:
                 meta_records.append({k: v for k, v in rec.items() if k != "embedding"})
-            with open(META_PATH, "w", encoding="utf-8") as mf:
+            with open(meta_path, "w", encoding="utf-8") as mf:
                 json.dump(meta_records, mf, ensure_ascii=False)
             faiss_ok = True
         except Exception:
             faiss_ok = False
 
-    stats = prep.get_statistics()
     return {
-        "message": "索引已构建",
-        "chunks": len(records),
         "index_path": str(index_path),
-        "faiss_index": str(FAISS_INDEX_PATH) if faiss_ok else None,
-        "meta_path": str(META_PATH) if faiss_ok else None,
-        "stats": stats,
+        "faiss_index": str(faiss_path) if faiss_ok else None,
+        "meta_path": str(meta_path) if faiss_ok else None,
+        "storage": store_info or {"mode": "float32"},
+        "embedding": info,
     }
 
 
+def read_embed_info(index_dir: Path) -> Optional[Dict[str, Any]]:
+    """读取索引目录下的 embedding.json；旧索引没有该文件时返回 None。"""
+    path = Path(index_dir) / EMBED_INFO_FILE
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
 def load_index(index_path: Path = INDEX_PATH) -> List[Dict[str, object]]:
     if not Path(index_path).exists():
         raise FileNotFoundError(f"索引文件不存在，请先执行 build_index，路径：{index_path}")
@@ -106,6 +247,13 @@ def load_index(index_path: Path = INDEX_PATH) -> List[Dict[str, object]]:
 
 
 if __name__ == "__main__":
-    result = build_index()
+    import argparse
+
+    from .engine import get_manager
+
+    parser = argparse.ArgumentParser(description="构建 RAG 向量索引")
+    parser.add_argument("--collection", default=None, help="collection 名称，默认菜谱库")
+    args = parser.parse_args()
+    result = get_manager().get(args.collection).build()
     print(json.dumps(result, ensure_ascii=False, indent=2))
 
@@ -0,0 +1,261 @@
+"""
+后台索引构建任务：提交后立即返回 job 句柄，构建在独立进程（或线程）中进行。
+
+MCP stdio server 每次工具调用都会新起进程，调用结束即退出，因此默认以脱离会话的子进程
+`python -m rag.jobs run <job_id>` 执行构建；任务状态与进度写入 rag/index/jobs/<job_id>.json，
+取消通过 <job_id>.cancel 标记文件通知构建进程，在下一批向量化前生效。
+任务文件只由构建进程（run_job）写入状态，其他进程只读，派生状态（进程已退出、启动超时）在读取时计算。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .collection import PROJECT_ROOT, get_collection
+from .index_construction import INDEX_DIR, BuildCancelled
+
+JOBS_DIR = Path(os.getenv("RAG_JOBS_DIR", str(INDEX_DIR / "jobs")))
+# process：脱离会话的子进程（适用于短生命周期的 stdio server）；thread：当前进程内后台线程
+JOB_MODE = os.getenv("RAG_JOB_MODE", "process")
+# 进度写盘的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+ACTIVE_STATES = ("queued", "running")
+# 提交任务的 collection 锁超过该时长（秒）仍未释放，视为持有者已退出
+LOCK_STALE_SECONDS = 10.0
+# process 模式下子进程超过该时长（秒）仍未写入 pid 与 running 状态，视为启动失败
+QUEUED_TIMEOUT = float(os.getenv("RAG_JOB_QUEUED_TIMEOUT", "60"))
+# start_build_job 生成的 job_id 格式（uuid4 前 12 位十六进制），job_id 来自工具参数，拼路径前必须校验
+_JOB_ID_RE = re.compile(r"[0-9a-f]{12}")
+
+
+def _valid_job_id(job_id: object) -> bool:
+    return isinstance(job_id, str) and _JOB_ID_RE.fullmatch(job_id) is not None
+
+
+def _job_path(job_id: str) -> Path:
+    if not _valid_job_id(job_id):
+        raise ValueError(f"非法的 job_id：{job_id!r}")
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def _cancel_path(job_id: str) -> Path:
+    if not _valid_job_id(job_id):
+        raise ValueError(f"非法的 job_id：{job_id!r}")
+    return JOBS_DIR / f"{job_id}.cancel"
+
+
+def _write_job(job: Dict[str, Any]):
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    job["updated_at"] = time.time()
+    tmp = JOBS_DIR / f".{job['job_id']}.{uuid.uuid4().hex}.tmp"
+    tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, _job_path(job["job_id"]))
+
+
+@contextmanager
+def _collection_lock(collection: str):
+    """按 collection 加 O_EXCL 锁文件，跨进程串行化“检查进行中任务 + 写入新任务”。"""
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    path = JOBS_DIR / f"{collection}.lock"
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > LOCK_STALE_SECONDS:
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        path.unlink(missing_ok=True)
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """读取任务状态；派生状态只在返回值中体现，不回写文件，避免覆盖构建进程稍后写入的真实状态。"""
+    if not _valid_job_id(job_id):
+        return None
+    path = _job_path(job_id)
+    if not path.exists():
+        return None
+    try:
+        job = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    # 进程已退出但状态未落盘（被 kill 等），视为失败
+    if (
+        job.get("status") in ACTIVE_STATES
+        and job.get("mode") == "process"
+        and job.get("pid")
+        and not _pid_alive(job.get("pid"))
+    ):
+        job.update({"status": "failed", "error": "构建进程已退出"})
+    elif (
+        job.get("status") == "queued"
+        and job.get("mode") == "process"
+        and not job.get("pid")
+        and time.time() - job.get("created_at", 0) > QUEUED_TIMEOUT
+    ):
+        job.update({"status": "failed", "error": "构建进程未能启动"})
+    if job.get("status") in ACTIVE_STATES and _cancel_path(job_id).exists():
+        job["cancel_requested"] = True
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return _read_job(job_id)
+
+
+def list_jobs(collection: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+    if not JOBS_DIR.exists():
+        return []
+    jobs = []
+    for path in sorted(JOBS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+        job = _read_job(path.stem)
+        if job and (not collection or job.get("collection") == collection):
+            jobs.append(job)
+        if len(jobs) >= limit:
+            break
+    return jobs
+
+
+def _active_job(collection: str) -> Optional[Dict[str, Any]]:
+    for job in list_jobs(collection, limit=5):
+        if job.get("status") in ACTIVE_STATES:
+            return job
+    return None
+
+
+def start_build_job(collection: Optional[str] = None, force: bool = True) -> Dict[str, Any]:
+    """提交后台构建；同一 collection 已有进行中的任务时直接返回该任务。force=False 仅对 workspace 生效（增量刷新）。"""
+    name = get_collection(collection).name
+    with _collection_lock(name):
+        existing = _active_job(name)
+        if existing:
+            return existing
+
+        job_id = uuid.uuid4().hex[:12]
+        job: Dict[str, Any] = {
+            "job_id": job_id,
+            "collection": name,
+            "status": "queued",
+            "mode": JOB_MODE,
+            "force": force,
+            "created_at": time.time(),
+            "progress": {},
+        }
+        _write_job(job)
+
+    if JOB_MODE == "thread":
+        threading.Thread(target=run_job, args=(job_id,), name=f"rag-build-{job_id}", daemon=True).start()
+    else:
+        log = open(JOBS_DIR / f"{job_id}.log", "ab")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "rag.jobs", "run", job_id],
+            cwd=str(PROJECT_ROOT),
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,  # 脱离父进程会话，MCP server 退出后继续构建
+        )
+        log.close()
+        # pid 与 running 状态由子进程自己写入，这里不回写，避免用过期的 queued 覆盖子进程状态
+        job["pid"] = proc.pid
+    return job
+
+
+def cancel_job(job_id: str) -> Dict[str, Any]:
+    """只创建取消标记，由构建进程在下一批向量化前检查并写入 cancelled 状态。"""
+    job = _read_job(job_id)
+    if not job:
+        return {"job_id": job_id, "status": "not_found"}
+    if job.get("status") not in ACTIVE_STATES:
+        return job
+    _cancel_path(job_id).touch()
+    job["cancel_requested"] = True
+    return job
+
+
+def _eta(progress: Dict[str, Any], embed_started: Optional[float]) -> Optional[float]:
+    done, total = progress.get("chunks_embedded"), progress.get("chunks_total")
+    if not embed_started or not done or not total:
+        return None
+    rate = done / max(time.time() - embed_started, 1e-6)
+    return round((total - done) / rate, 1) if rate > 0 else None
+
+
+def run_job(job_id: str):
+    """执行构建任务（子进程入口或后台线程）。"""
+    from .engine import get_manager
+
+    job = _read_job(job_id) or {"job_id": job_id}
+    job.pop("error", None)  # 读取时派生的失败原因（如启动超时）不属于本次运行
+    job.update({"status": "running", "pid": os.getpid(), "started_at": time.time()})
+    _write_job(job)
+
+    state = {"last_write": 0.0, "embed_started": None}
+
+    def on_progress(info: Dict[str, Any]):
+        progress = job.setdefault("progress", {})
+        progress.update(info)
+        if info.get("stage") == "embedding" and state["embed_started"] is None:
+            state["embed_started"] = time.time()
+        job["eta_seconds"] = _eta(progress, state["embed_started"])
+        now = time.time()
+        if now - state["last_write"] >= PROGRESS_INTERVAL:
+            state["last_write"] = now
+            _write_job(job)
+
+    def should_cancel() -> bool:
+        return _cancel_path(job_id).exists()
+
+    try:
+        result = get_manager().get(job["collection"]).build(
+            progress=on_progress, should_cancel=should_cancel, force=job.get("force", True)
+        )
+        job.update({"status": "succeeded", "result": result, "eta_seconds": 0})
+    except BuildCancelled:
+        job["status"] = "cancelled"
+    except Exception as exc:
+        job.update({"status": "failed", "error": str(exc), "traceback": traceback.format_exc(limit=5)})
+    finally:
+        job["finished_at"] = time.time()
+        job["elapsed_seconds"] = round(job["finished_at"] - job["started_at"], 2)
+        _write_job(job)
+        _cancel_path(job_id).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "run":
+        run_job(sys.argv[2])
+    else:
+        print("用法：python -m rag.jobs run <job_id>")
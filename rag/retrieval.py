@@ -1,41 +1,25 @@
 import json
-from pathlib import Path
-from typing import Dict, List, Tuple
+import os
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
-from .embedding import Embedder
-from .index_construction import (
-    DATA_DIR,
-    FAISS_INDEX_PATH,
-    INDEX_PATH,
-    META_PATH,
-    build_index,
-    load_index,
-)
+from text_utils import estimate_tokens
 
-try:  # 可选 FAISS
-    import faiss
-except Exception:  # pragma: no cover - faiss 非必需
-    faiss = None
+from .collection import DEFAULT_COLLECTION
+from .engine import IndexNotReady, get_manager
+from .jobs import cancel_job, get_job, list_jobs, start_build_job
 
-
-def _dot_similarity(a: List[float], b: List[float]) -> float:
-    """向量已归一化，可直接用内积表示余弦相似度。"""
-    return sum(x * y for x, y in zip(a, b))
-
-
-def _load_faiss_index() -> Tuple[object, List[dict]]:
-    if faiss is None:
-        return None, []
-    if not FAISS_INDEX_PATH.exists() or not META_PATH.exists():
-        return None, []
-    try:
-        index = faiss.read_index(str(FAISS_INDEX_PATH))
-        meta = json.loads(META_PATH.read_text(encoding="utf-8"))
-        return index, meta
-    except Exception:
-        return None, []
+# rag_search 返回内容的默认 token 预算（0 表示不打包，按 top_k 原样返回）
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "600"))
+# MMR 中相关度的权重，越小越偏向多样性
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# 与已选片段的向量相似度不低于该值时视为重复，直接丢弃
+DUPLICATE_SIMILARITY = 0.95
+# 打包时先取 top_k 的若干倍候选，再经 MMR 筛选
+PACK_CANDIDATE_FACTOR = 3
+# 合并二次切分的相邻片段时，检测首尾重叠的最大字符数（不小于分块的 chunk_overlap）
+MERGE_MAX_OVERLAP = 500
 
 
 def search(
@@ -43,98 +27,254 @@ def search(
     top_k: int = 5,
     min_score: float = 0.2,
     ensure_index: bool = True,
-    index_path: Path = INDEX_PATH,
-    use_faiss: bool = True,
+    collection: Optional[str] = DEFAULT_COLLECTION,
+    rescore: bool = True,
+    with_vectors: bool = False,
 ) -> List[Dict[str, object]]:
-    if ensure_index and not Path(index_path).exists():
-        build_index(data_dir=DATA_DIR, index_path=index_path)
-
-    embedder = Embedder()
-    query_vec = embedder.encode([query])[0]  # numpy, 已归一化
-
-    # 优先使用 FAISS
-    if use_faiss:
-        faiss_index, meta = _load_faiss_index()
-        if faiss_index and meta:
-            D, I = faiss_index.search(np.expand_dims(query_vec, axis=0), top_k)
-            results: List[Dict[str, object]] = []
-            for score, idx in zip(D[0].tolist(), I[0].tolist()):
-                if idx == -1:
-                    continue
-                if score < min_score:
-                    continue
-                rec = meta[idx]
-                results.append(
-                    {
-                        "id": rec.get("id"),
-                        "score": float(score),
-                        "source": rec.get("source"),
-                        "dish_name": rec.get("dish_name"),
-                        "category": rec.get("category"),
-                        "difficulty": rec.get("difficulty"),
-                        "content": rec.get("content"),
-                        "parent_id": rec.get("parent_id"),
-                    }
-                )
-            return results
-
-    # 回退纯 Python 检索
-    index = load_index(index_path=index_path)
-    if not index:
-        raise RuntimeError("索引为空，请先构建索引。")
-
-    results: List[Dict[str, object]] = []
-    query_embedding = query_vec.tolist()
-    for record in index:
-        emb = record.get("embedding") or []
-        if not emb:
+    """在一个或多个 collection 上检索（collection 可为名称、逗号分隔列表或 all）。
+
+    索引按 collection 懒加载并常驻内存：压缩存储 -> FAISS -> NumPy -> 纯 Python 依次回退。
+    with_vectors=True 时每条结果附带 "vector"，供 pack_context 做 MMR 去重。
+    """
+    manager = get_manager()
+    names = manager.resolve(collection)
+    return manager.search(
+        query,
+        collections=names,
+        top_k=top_k,
+        min_score=min_score,
+        rescore=rescore,
+        ensure_index=ensure_index,
+        with_vectors=with_vectors,
+    )
+
+
+def _similarity(a, b) -> float:
+    if a is None or b is None or len(a) != len(b):
+        return 0.0
+    return float(np.dot(a, b))
+
+
+def mmr_select(
+    results: List[Dict[str, object]], k: int, lambda_: float = MMR_LAMBDA
+) -> Tuple[List[Dict[str, object]], int]:
+    """最大边际相关（MMR）：依次选出 λ·相关度 −（1−λ）·与已选片段最大相似度 最高的结果，至多 k 条。
+
+    与已选片段几乎相同（相似度 ≥ DUPLICATE_SIMILARITY）或内容完全相同的结果直接丢弃；没有向量的结果只按相关度参与。
+    返回 (按选中顺序排列的结果, 丢弃的重复条数)。
+    """
+    pool = list(results)
+    selected: List[Dict[str, object]] = []
+    seen_content = set()
+    duplicates = 0
+    while pool and len(selected) < k:
+        best_idx, best_value = -1, -np.inf
+        for idx, item in enumerate(pool):
+            redundancy = max((_similarity(item.get("vector"), s.get("vector")) for s in selected), default=0.0)
+            if redundancy >= DUPLICATE_SIMILARITY or (item.get("content") or "").strip() in seen_content:
+                best_idx, best_value = idx, None  # 标记为重复，本轮先移除
+                break
+            value = lambda_ * float(item.get("score") or 0.0) - (1 - lambda_) * redundancy
+            if value > best_value:
+                best_idx, best_value = idx, value
+        item = pool.pop(best_idx)
+        if best_value is None:
+            duplicates += 1
+            continue
+        selected.append(item)
+        seen_content.add((item.get("content") or "").strip())
+    return selected, duplicates
+
+
+def _follows(prev: Dict[str, object], item: Dict[str, object]) -> bool:
+    """item 是否紧接在 prev 之后：同一块的下一段，或 prev 为其块的最后一段且 item 为下一块的第一段。"""
+    if item["chunk_index"] == prev["chunk_index"]:
+        return item["sub_index"] == prev["sub_index"] + 1
+    return (
+        item["chunk_index"] == prev["chunk_index"] + 1
+        and item["sub_index"] == 0
+        and prev["sub_index"] == (prev.get("sub_count") or 1) - 1
+    )
+
+
+def _join_pieces(run: List[Dict[str, object]]) -> str:
+    """拼接相邻片段；同一块二次切分出的片段首尾有重叠（chunk_overlap），拼接时去掉重复的部分。"""
+    joined = (run[0].get("content") or "").strip()
+    for prev, item in zip(run, run[1:]):
+        text = (item.get("content") or "").strip()
+        overlap = 0
+        if item["chunk_index"] == prev["chunk_index"]:
+            limit = min(len(joined), len(text), MERGE_MAX_OVERLAP)
+            # 不足 8 个字符的首尾重合多为巧合（如 chunk_overlap=0），不去重
+            overlap = next((k for k in range(limit, 7, -1) if joined.endswith(text[:k])), 0)
+        joined = joined + text[overlap:] if overlap else f"{joined}\n{text}"
+    return joined
+
+
+def merge_adjacent(results: List[Dict[str, object]]) -> Tuple[List[Dict[str, object]], int]:
+    """同一 parent_id 下位置 (chunk_index, sub_index) 相邻的片段合并为一段（按位置顺序拼接，分数取最高）。
+
+    合并后的片段位于组内最靠前的位置；旧索引没有 chunk_index / sub_index 时不合并。返回 (结果, 合并掉的片段数)。
+    """
+    groups: Dict[Tuple[object, object], List[Dict[str, object]]] = {}
+    for item in results:
+        if (
+            item.get("parent_id") is not None
+            and isinstance(item.get("chunk_index"), int)
+            and isinstance(item.get("sub_index"), int)
+        ):
+            groups.setdefault((item.get("collection"), item["parent_id"]), []).append(item)
+    runs: Dict[int, List[Dict[str, object]]] = {}  # id(片段) -> 所在的相邻片段组
+    for members in groups.values():
+        members = sorted(members, key=lambda x: (x["chunk_index"], x["sub_index"]))
+        run = [members[0]]
+        for item in members[1:]:
+            if _follows(run[-1], item):
+                run.append(item)
+                continue
+            for m in run:
+                runs[id(m)] = run
+            run = [item]
+        for m in run:
+            runs[id(m)] = run
+
+    merged: List[Dict[str, object]] = []
+    emitted = set()
+    absorbed = 0
+    for item in results:
+        run = runs.get(id(item))
+        if run is None or len(run) == 1:
+            merged.append(item)
             continue
-        score = _dot_similarity(query_embedding, emb)
-        if score < min_score:
+        if id(run[0]) in emitted:
             continue
-        results.append(
+        emitted.add(id(run[0]))
+        absorbed += len(run) - 1
+        best = max(run, key=lambda x: float(x.get("score") or 0.0))
+        merged.append(
             {
-                "id": record.get("id"),
-                "score": score,
-                "source": record.get("source"),
-                "dish_name": record.get("dish_name"),
-                "category": record.get("category"),
-                "difficulty": record.get("difficulty"),
-                "content": record.get("content"),
-                "parent_id": record.get("parent_id"),
+                **best,
+                "content": _join_pieces(run),
+                "chunk_index": run[0]["chunk_index"],
+                "sub_index": run[0]["sub_index"],
+                "chunks": len(run),
             }
         )
+    return merged, absorbed
+
+
+def _header(item: Dict[str, object]) -> str:
+    title = item.get("dish_name") or item.get("source") or "菜谱"
+    category = item.get("category") or ""
+    difficulty = item.get("difficulty") or ""
+    return f"[{title}]({item.get('source', '')})  score={item.get('score'):.3f}  {category} {difficulty}".strip()
 
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results[: max(top_k, 1)]
+
+def pack_context(
+    results: List[Dict[str, object]], max_tokens: int, top_k: Optional[int] = None, lambda_: float = MMR_LAMBDA
+) -> Tuple[List[Dict[str, object]], Dict[str, object]]:
+    """在 token 预算内打包检索结果：MMR 去重 → 合并相邻片段 → 按分数依次装入（放不下的跳过，尝试更短的）。
+
+    results 应按分数降序并尽量附带 "vector"（search(with_vectors=True)）；返回的结果不含向量。
+    一条都放不下时截断得分最高的一条。返回 (打包后的结果, 统计信息)。
+    """
+    candidates = len(results)
+    selected, duplicates = mmr_select(results, k=top_k or len(results), lambda_=lambda_)
+    merged, absorbed = merge_adjacent(selected)
+    merged.sort(key=lambda x: float(x.get("score") or 0.0), reverse=True)
+
+    packed: List[Dict[str, object]] = []
+    used = 0
+    for item in merged:
+        cost = estimate_tokens(_header(item)) + estimate_tokens(item.get("content") or "")
+        if used + cost > max_tokens:
+            continue
+        packed.append(item)
+        used += cost
+    if not packed and merged:
+        item = dict(merged[0])
+        content = item.get("content") or ""
+        room = max(max_tokens - estimate_tokens(_header(item)), 1)
+        keep = max(int(len(content) * room / estimate_tokens(content)), 1)
+        item["content"] = content[:keep].rstrip() + "…"
+        item["truncated"] = True
+        packed.append(item)
+        used = estimate_tokens(_header(item)) + estimate_tokens(item["content"])
+    packed = [{k: v for k, v in item.items() if k != "vector"} for item in packed]
+    stats = {
+        "max_tokens": max_tokens,
+        "tokens": used,
+        "candidates": candidates,
+        "duplicates": duplicates,
+        "merged": absorbed,
+        "dropped": len(merged) - len(packed),
+    }
+    return packed, stats
 
 
-def format_context(results: List[Dict[str, object]]) -> str:
-    """将检索结果串接为上下文字符串，供上游模型调用。"""
+def format_context(results: List[Dict[str, object]], max_tokens: Optional[int] = None) -> str:
+    """将检索结果串接为上下文字符串，供上游模型调用；给出 max_tokens 时先经 pack_context 去重、合并并按预算装入。"""
+    if max_tokens:
+        results, _ = pack_context(results, max_tokens)
     lines: List[str] = []
     for item in results:
-        title = item.get("dish_name") or item.get("source") or "菜谱"
-        category = item.get("category") or ""
-        difficulty = item.get("difficulty") or ""
-        header = f"[{title}]({item.get('source', '')})  score={item.get('score'):.3f}  {category} {difficulty}".strip()
-        lines.append(header)
+        lines.append(_header(item))
         lines.append(item.get("content", ""))
         lines.append("")
     return "\n".join(lines).strip()
 
 
-def rag_search_tool(query: str, top_k: int = 5) -> Dict[str, object]:
-    results = search(query=query, top_k=top_k)
-    return {
+def rag_search_tool(
+    query: str, top_k: int = 5, collection: str = DEFAULT_COLLECTION, max_tokens: int = RAG_CONTEXT_TOKENS
+) -> Dict[str, object]:
+    """检索并（max_tokens>0 时）在 token 预算内打包：多取候选，MMR 去重、合并相邻片段后按分数装入。"""
+    pack = max_tokens > 0
+    try:
+        results = search(
+            query=query,
+            top_k=top_k * PACK_CANDIDATE_FACTOR if pack else top_k,
+            collection=collection,
+            with_vectors=pack,
+        )
+    except IndexNotReady as exc:
+        return {
+            "query": query,
+            "top_k": top_k,
+            "collection": collection,
+            "results": [],
+            "message": str(exc),
+            "job": exc.job,
+        }
+    # 不再附带 format_context 拼接的 context：它与 results 内容重复，模型可见的文本由 MCP 客户端按预算渲染
+    response: Dict[str, object] = {
         "query": query,
         "top_k": top_k,
+        "collection": collection,
         "results": results,
-        "context": format_context(results),
     }
+    if pack:
+        response["results"], response["packed"] = pack_context(results, max_tokens, top_k=top_k)
+    return response
+
+
+def rebuild_index_tool(collection: str = DEFAULT_COLLECTION) -> Dict[str, object]:
+    """提交后台重建任务并立即返回 job 句柄；构建完成前检索继续使用旧索引。"""
+    return start_build_job(collection)
+
+
+def index_status_tool(job_id: str = "", collection: str = "") -> Dict[str, object]:
+    if job_id:
+        return get_job(job_id) or {"job_id": job_id, "status": "not_found"}
+    jobs = list_jobs(collection or None, limit=1)
+    return jobs[0] if jobs else {"collection": collection, "status": "none"}
+
+
+def cancel_index_job_tool(job_id: str) -> Dict[str, object]:
+    return cancel_job(job_id)
 
 
-def rebuild_index_tool() -> Dict[str, object]:
-    return build_index(data_dir=DATA_DIR, index_path=INDEX_PATH)
+def list_collections_tool() -> List[Dict[str, object]]:
+    return get_manager().describe()
 
 
 if __name__ == "__main__":
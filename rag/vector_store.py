@@ -0,0 +1,236 @@
+"""
+压缩向量存储：float16 / int8 标量量化 / 乘积量化（PQ）向量 + 按偏移寻址的压缩 chunk 文本块。
+
+磁盘布局（位于索引目录下）：
+- quant.json              量化参数与元信息
+- vectors.float16.npy     float16 模式的向量
+- vectors.int8.npy        int8 模式的 uint8 编码（配合 quant.json 中逐维 offset/scale 反量化）
+- vectors.pq.faiss        PQ 模式的 faiss.IndexPQ
+- vectors.f32.npy         全精度向量，仅在精排（rescore）时以 mmap 方式按需读取
+- chunks.bin              逐条 zlib 压缩的 chunk 记录（JSON）
+- chunks.offsets.npy      chunks.bin 中每条记录的起始偏移（N+1 个 uint64）
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:  # 可选 FAISS，PQ 模式依赖
+    import faiss
+except Exception:  # pragma: no cover - faiss 非必需
+    faiss = None
+
+STORAGE_MODES = ("float32", "float16", "int8", "pq")
+# float32 为原有行为（index.json + faiss.index + meta.json），其余模式写入压缩存储
+STORAGE_MODE = os.getenv("RAG_STORAGE_MODE", "float32")
+
+QUANT_FILE = "quant.json"
+FULL_VECTORS_FILE = "vectors.f32.npy"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.offsets.npy"
+PQ_FILE = "vectors.pq.faiss"
+
+# PQ 码本训练样本下限（faiss 建议每个质心约 39 个样本，nbits=8 时 256 个质心）
+PQ_MIN_TRAIN = 256 * 39
+
+# 打分时按块反量化，避免一次性展开成 float32 大矩阵
+_SCORE_BLOCK = 65536
+
+
+def _codes_file(mode: str) -> str:
+    return f"vectors.{mode}.npy"
+
+
+def _write_chunks(index_dir: Path, records: List[Dict[str, object]]):
+    offsets = np.zeros(len(records) + 1, dtype=np.uint64)
+    pos = 0
+    with open(index_dir / CHUNKS_FILE, "wb") as f:
+        for i, rec in enumerate(records):
+            blob = zlib.compress(json.dumps(rec, ensure_ascii=False).encode("utf-8"), 6)
+            f.write(blob)
+            pos += len(blob)
+            offsets[i + 1] = pos
+    np.save(index_dir / OFFSETS_FILE, offsets)
+
+
+def _pick_pq_m(dim: int) -> int:
+    """每个子空间 4~8 维，m 需整除 dim。"""
+    for sub_dim in (8, 4, 16, 2):
+        if dim % sub_dim == 0:
+            return dim // sub_dim
+    return 1
+
+
+def write_store(
+    index_dir: Path,
+    records: List[Dict[str, object]],
+    vectors: np.ndarray,
+    mode: str,
+    keep_full_precision: bool = True,
+) -> Dict[str, object]:
+    """把记录（不含 embedding）与向量按指定模式写入 index_dir，返回存储信息。"""
+    if mode not in STORAGE_MODES or mode == "float32":
+        raise ValueError(f"压缩存储仅支持 float16 / int8 / pq，收到：{mode}")
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = (vectors.shape[0], vectors.shape[1]) if vectors.ndim == 2 else (0, 0)
+    quant: Dict[str, object] = {"mode": mode, "dim": dim, "count": count}
+
+    if mode == "pq":
+        pq_m = _pick_pq_m(dim) if dim else 0
+        # 样本不足以训练码本或缺少 faiss 时退回 int8
+        if faiss is None or count < PQ_MIN_TRAIN or not pq_m:
+            quant["mode"] = mode = "int8"
+            quant["fallback_from"] = "pq"
+        else:
+            index = faiss.IndexPQ(dim, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.add(vectors)
+            faiss.write_index(index, str(index_dir / PQ_FILE))
+            quant.update({"pq_m": pq_m, "pq_nbits": 8})
+
+    if mode == "float16":
+        np.save(index_dir / _codes_file(mode), vectors.astype(np.float16))
+    elif mode == "int8":
+        lo = vectors.min(axis=0) if count else np.zeros(dim, dtype=np.float32)
+        hi = vectors.max(axis=0) if count else np.zeros(dim, dtype=np.float32)
+        scale = np.where(hi > lo, (hi - lo) / 255.0, 1.0).astype(np.float32)
+        codes = np.clip(np.rint((vectors - lo) / scale), 0, 255).astype(np.uint8)
+        np.save(index_dir / _codes_file(mode), codes)
+        quant.update({"offset": lo.tolist(), "scale": scale.tolist()})
+
+    if keep_full_precision:
+        np.save(index_dir / FULL_VECTORS_FILE, vectors)
+    quant["full_precision"] = keep_full_precision
+    _write_chunks(index_dir, records)
+    # quant.json 最后写入，作为存储完整可用的标志
+    (index_dir / QUANT_FILE).write_text(json.dumps(quant), encoding="utf-8")
+    return {"mode": quant["mode"], "dim": dim, "count": count, "path": str(index_dir)}
+
+
+def has_store(index_dir: Path) -> bool:
+    return (Path(index_dir) / QUANT_FILE).exists()
+
+
+class VectorStore:
+    """只读压缩向量存储；常驻内存的只有量化编码与偏移表，chunk 文本和全精度向量均按需从磁盘读取。"""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self.quant = json.loads((self.index_dir / QUANT_FILE).read_text(encoding="utf-8"))
+        self.mode: str = self.quant["mode"]
+        self.count: int = int(self.quant.get("count", 0))
+        self.dim: int = int(self.quant.get("dim", 0))
+        self._pq = None
+        self._codes: Optional[np.ndarray] = None
+        if self.mode == "pq":
+            if faiss is None:
+                raise RuntimeError("PQ 存储需要安装 faiss-cpu")
+            self._pq = faiss.read_index(str(self.index_dir / PQ_FILE))
+        else:
+            self._codes = np.load(self.index_dir / _codes_file(self.mode))
+        if self.mode == "int8":
+            self._offset = np.asarray(self.quant["offset"], dtype=np.float32)
+            self._scale = np.asarray(self.quant["scale"], dtype=np.float32)
+        self._offsets = np.load(self.index_dir / OFFSETS_FILE)
+        self._full: Optional[np.ndarray] = None
+        self._chunks_file = None
+        self._chunks_map: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def resident_bytes(self) -> int:
+        """估算常驻内存（编码 + 偏移表）。"""
+        codes = self._codes.nbytes if self._codes is not None else self.count * int(self.quant.get("pq_m", 0))
+        return int(codes + self._offsets.nbytes)
+
+    def _approx_scores(self, query_vec: np.ndarray) -> np.ndarray:
+        if self.mode == "pq":
+            D, I = self._pq.search(np.expand_dims(query_vec, axis=0), self.count)
+            scores = np.full(self.count, -np.inf, dtype=np.float32)
+            valid = I[0] >= 0
+            scores[I[0][valid]] = D[0][valid]
+            return scores
+        scores = np.empty(self.count, dtype=np.float32)
+        if self.mode == "int8":
+            q_scaled = query_vec * self._scale
+            bias = float(np.dot(query_vec, self._offset))
+        for start in range(0, self.count, _SCORE_BLOCK):
+            block = self._codes[start : start + _SCORE_BLOCK].astype(np.float32)
+            if self.mode == "int8":
+                scores[start : start + len(block)] = block @ q_scaled + bias
+            else:
+                scores[start : start + len(block)] = block @ query_vec
+        return scores
+
+    def _full_vectors(self) -> Optional[np.ndarray]:
+        if self._full is None and self.quant.get("full_precision"):
+            path = self.index_dir / FULL_VECTORS_FILE
+            if path.exists():
+                self._full = np.load(path, mmap_mode="r")
+        return self._full
+
+    def search(
+        self,
+        query_vec: np.ndarray,
+        top_k: int = 5,
+        min_score: float = 0.0,
+        rescore: bool = True,
+        candidate_factor: int = 4,
+    ) -> List[Tuple[int, float]]:
+        """近似打分取候选，可选用磁盘上的全精度向量对候选精排，返回 [(行号, 分数)]。"""
+        if not self.count:
+            return []
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        scores = self._approx_scores(query_vec)
+        full = self._full_vectors() if rescore else None
+        n_cand = min(self.count, max(top_k, 1) * (candidate_factor if full is not None else 1))
+        cand = np.argpartition(-scores, n_cand - 1)[:n_cand]
+        if full is not None:
+            cand = np.sort(cand)  # 按行号顺序读取 mmap，减少随机 IO
+            cand_scores = np.asarray(full[cand], dtype=np.float32) @ query_vec
+        else:
+            cand_scores = scores[cand]
+        order = np.argsort(-cand_scores)[: max(top_k, 1)]
+        return [
+            (int(cand[i]), float(cand_scores[i]))
+            for i in order
+            if cand_scores[i] >= min_score
+        ]
+
+    def get_record(self, idx: int) -> Dict[str, object]:
+        if self._chunks_map is None:
+            self._chunks_file = open(self.index_dir / CHUNKS_FILE, "rb")
+            self._chunks_map = mmap.mmap(self._chunks_file.fileno(), 0, access=mmap.ACCESS_READ)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return json.loads(zlib.decompress(self._chunks_map[start:end]).decode("utf-8"))
+
+    def get_vectors(self, idxs: List[int]) -> np.ndarray:
+        """返回指定行的向量（优先全精度，否则反量化）。"""
+        full = self._full_vectors()
+        if full is not None:
+            return np.asarray(full[np.asarray(idxs, dtype=np.int64)], dtype=np.float32)
+        if self.mode == "pq":
+            return np.stack([self._pq.reconstruct(int(i)) for i in idxs]) if idxs else np.zeros((0, self.dim), np.float32)
+        codes = self._codes[np.asarray(idxs, dtype=np.int64)].astype(np.float32)
+        if self.mode == "int8":
+            return codes * self._scale + self._offset
+        return codes
+
+    def close(self):
+        if self._chunks_map is not None:
+            self._chunks_map.close()
+            self._chunks_map = None
+        if self._chunks_file is not None:
+            self._chunks_file.close()
+            self._chunks_file = None
+        self._full = None
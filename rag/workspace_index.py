@@ -0,0 +1,359 @@
+"""
+workspace 增量索引：监听 workspace/ 的文件变化，只对新增/修改的文件重新分块与向量化，
+写入 workspace collection（新代际目录 + 原子切换），供 workspace_search 按相关度检索。
+
+- 变化检测：默认按 mtime/size 轮询；安装 watchdog 时使用文件系统事件（inotify/FSEvents）唤醒，仍以轮询结果为准。
+- 去抖：检测到变化后等待 debounce 秒内不再变化再索引，避免上传/连续写入过程中反复向量化。
+- 每个文件的分块与向量缓存在 <index_dir>/files/<md5(相对路径)>.json，内容哈希不变时直接复用。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .collection import WORKSPACE_COLLECTION, CollectionConfig, get_collection
+from .data_preparation import DataPreparationModule
+from .embedding import embedding_info, embedding_mismatch, get_embedder
+from .index_construction import (
+    BuildCancelled,
+    activate_generation,
+    chunk_records,
+    new_generation_dir,
+    read_embed_info,
+    resolve_index_dir,
+    write_index_files,
+)
+
+try:  # 跨进程互斥（backend 与 MCP server 可能同时刷新）
+    import fcntl
+except Exception:  # pragma: no cover - Windows
+    fcntl = None
+
+try:  # 可选：文件系统事件
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except Exception:  # pragma: no cover - watchdog 非必需
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+FILES_DIRNAME = "files"
+# 超过该大小的文件不索引（避免误把大二进制/日志整体向量化）
+MAX_FILE_BYTES = int(os.getenv("WORKSPACE_INDEX_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+POLL_INTERVAL = float(os.getenv("WORKSPACE_INDEX_POLL_INTERVAL", "2.0"))
+DEBOUNCE_SECONDS = float(os.getenv("WORKSPACE_INDEX_DEBOUNCE", "1.0"))
+
+
+def _file_hash(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class WorkspaceIndexer:
+    """维护 workspace collection 的增量索引。"""
+
+    def __init__(self, config: Optional[CollectionConfig] = None):
+        self.config = config or get_collection(WORKSPACE_COLLECTION)
+        self.root = Path(self.config.data_dir)
+        self.index_dir = Path(self.config.index_dir)
+        self.files_dir = self.index_dir / FILES_DIRNAME
+        self._lock = threading.Lock()
+
+    # ---------- 扫描与清单 ----------
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """返回 {相对路径: (mtime_ns, size)}，跳过隐藏文件与超限文件。"""
+        found: Dict[str, Tuple[int, int]] = {}
+        if not self.root.exists():
+            return found
+        patterns = self.config.file_globs
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                if name.startswith(".") or not any(Path(name).match(p) for p in patterns):
+                    continue
+                full = Path(dirpath) / name
+                try:
+                    st = full.stat()
+                except OSError:
+                    continue
+                if st.st_size > MAX_FILE_BYTES:
+                    continue
+                found[full.relative_to(self.root).as_posix()] = (st.st_mtime_ns, st.st_size)
+        return found
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        path = self.index_dir / MANIFEST_FILE
+        if not path.exists():
+            return {}
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _save_manifest(self, manifest: Dict[str, Dict[str, Any]]):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_dir / f".{MANIFEST_FILE}.{uuid.uuid4().hex}"
+        tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.index_dir / MANIFEST_FILE)
+
+    def _cache_path(self, rel: str) -> Path:
+        return self.files_dir / f"{hashlib.md5(rel.encode('utf-8')).hexdigest()}.json"
+
+    @contextmanager
+    def _exclusive(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.index_dir / ".lock", "a+") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def pending_changes(self) -> bool:
+        """仅比较 mtime/size，判断是否有待索引的变化。"""
+        manifest = self._load_manifest()
+        current = self.scan()
+        if set(current) != set(manifest):
+            return True
+        return any(
+            (manifest[rel].get("mtime_ns"), manifest[rel].get("size")) != stat for rel, stat in current.items()
+        )
+
+    # ---------- 增量索引 ----------
+
+    def _embed_files(self, rels: List[str]) -> Dict[str, List[Dict[str, object]]]:
+        prep = DataPreparationModule(
+            str(self.root),
+            file_globs=self.config.file_globs,
+            max_chunk_chars=self.config.max_chunk_chars,
+            chunk_overlap=self.config.chunk_overlap,
+        )
+        prep.load_documents(files=[self.root / rel for rel in rels])
+        if not prep.documents:
+            return {rel: [] for rel in rels}
+        chunks = prep.chunk_documents()
+        vecs = get_embedder().encode([c.page_content for c in chunks]) if chunks else []
+        by_file: Dict[str, List[Dict[str, object]]] = {rel: [] for rel in rels}
+        for rec in chunk_records(chunks, [v.tolist() for v in vecs]):
+            rel = Path(str(rec["source"])).resolve().relative_to(self.root.resolve()).as_posix()
+            rec["source"] = rel
+            by_file.setdefault(rel, []).append(rec)
+        return by_file
+
+    def refresh(self, force: bool = False, should_cancel: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """
+        对比当前文件与清单，只处理新增/修改/删除的文件；有变化时写入新代际索引并原子切换。
+        force=True 时全部重新向量化（workspace collection 的整体重建也走这里，共用 .lock 与清单）。
+        """
+        started = time.perf_counter()
+        with self._exclusive():
+            # 向量化模型/维度变更后，文件缓存中的旧向量不能与新向量混用，整体重新向量化
+            force = force or bool(embedding_mismatch(read_embed_info(resolve_index_dir(self.index_dir)), embedding_info()))
+            manifest = self._load_manifest()
+            current = self.scan()
+            removed = [rel for rel in manifest if rel not in current]
+            to_embed: List[str] = []
+            touched = 0
+            for rel, (mtime_ns, size) in current.items():
+                entry = manifest.get(rel)
+                if not force and entry and (entry.get("mtime_ns"), entry.get("size")) == (mtime_ns, size):
+                    continue
+                try:
+                    digest = _file_hash(self.root / rel)
+                except OSError:
+                    # 扫描后被删除/替换：本轮跳过且不更新清单，下一轮按最新状态处理
+                    continue
+                if not force and entry and entry.get("hash") == digest and self._cache_path(rel).exists():
+                    # 内容未变（仅 touch），只更新清单
+                    entry.update({"mtime_ns": mtime_ns, "size": size})
+                    touched += 1
+                    continue
+                manifest[rel] = {"mtime_ns": mtime_ns, "size": size, "hash": digest}
+                to_embed.append(rel)
+
+            if not removed and not to_embed and not force and not touched:
+                return {"changed": False, "files": len(current), "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+            if should_cancel is not None and should_cancel():
+                raise BuildCancelled("索引构建已取消")
+            self.files_dir.mkdir(parents=True, exist_ok=True)
+            embedded_chunks = 0
+            if to_embed:
+                for rel, records in self._embed_files(to_embed).items():
+                    embedded_chunks += len(records)
+                    manifest.setdefault(rel, {})["chunks"] = len(records)
+                    self._cache_path(rel).write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+            for rel in removed:
+                manifest.pop(rel, None)
+                self._cache_path(rel).unlink(missing_ok=True)
+
+            if removed or to_embed or force:
+                self._write_index(manifest)
+            self._save_manifest(manifest)
+
+        result = {
+            "changed": bool(removed or to_embed or force),
+            "files": len(current),
+            "added_or_updated": to_embed,
+            "removed": removed,
+            "chunks_embedded": embedded_chunks,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logger.info(f"workspace 索引已更新：{result}")
+        return result
+
+    def _write_index(self, manifest: Dict[str, Dict[str, Any]]):
+        records: List[Dict[str, object]] = []
+        for rel in sorted(manifest):
+            path = self._cache_path(rel)
+            if path.exists():
+                records.extend(json.loads(path.read_text(encoding="utf-8")))
+        gen_dir = new_generation_dir(self.index_dir)
+        write_index_files(
+            gen_dir / self.config.index_path.name,
+            records,
+            storage=self.config.storage,
+            build_faiss=self.config.index_type in ("auto", "faiss"),
+        )
+        activate_generation(self.index_dir, gen_dir)
+
+
+class _DirtyHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "WorkspaceWatcher"):
+        self.watcher = watcher
+
+    def on_any_event(self, event):  # noqa: D401 - watchdog 回调
+        self.watcher.mark_dirty()
+
+
+class WorkspaceWatcher:
+    """后台线程：轮询（或文件事件唤醒）检测变化，去抖后调用 WorkspaceIndexer.refresh。"""
+
+    def __init__(
+        self,
+        indexer: Optional[WorkspaceIndexer] = None,
+        interval: float = POLL_INTERVAL,
+        debounce: float = DEBOUNCE_SECONDS,
+    ):
+        self.indexer = indexer or get_indexer()
+        self.interval = interval
+        self.debounce = debounce
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def mark_dirty(self):
+        self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        if Observer is not None and self.indexer.root.exists():
+            self._observer = Observer()
+            self._observer.schedule(_DirtyHandler(self), str(self.indexer.root), recursive=True)
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="workspace-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def _snapshot(self):
+        return self.indexer.scan()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                if not self.indexer.pending_changes():
+                    continue
+                # 去抖：直到连续 debounce 秒内文件快照不再变化
+                snapshot = self._snapshot()
+                while not self._stop.is_set():
+                    time.sleep(self.debounce)
+                    latest = self._snapshot()
+                    if latest == snapshot:
+                        break
+                    snapshot = latest
+                self.last_result = self.indexer.refresh()
+            except Exception as exc:
+                logger.warning(f"workspace 索引刷新失败：{exc}")
+
+
+_INDEXER: Optional[WorkspaceIndexer] = None
+_WATCHER: Optional[WorkspaceWatcher] = None
+
+
+def get_indexer() -> WorkspaceIndexer:
+    global _INDEXER
+    if _INDEXER is None:
+        _INDEXER = WorkspaceIndexer()
+    return _INDEXER
+
+
+def start_watcher() -> WorkspaceWatcher:
+    global _WATCHER
+    if _WATCHER is None:
+        _WATCHER = WorkspaceWatcher()
+    _WATCHER.start()
+    return _WATCHER
+
+
+def notify_changed():
+    """文件工具/上传接口写入后调用：唤醒本进程内的 watcher（未启动时无操作）。"""
+    if _WATCHER is not None:
+        _WATCHER.mark_dirty()
+
+
+def workspace_search_tool(query: str, top_k: int = 5) -> Dict[str, object]:
+    """
+    在当前生效的索引代际上检索，不在工具调用内向量化。
+    有未索引的变化（仅 stat 比较）时返回 stale=True，并交给本进程的 watcher（去抖）或后台增量刷新任务处理。
+    """
+    from .engine import get_manager
+    from .jobs import start_build_job
+
+    stale = get_indexer().pending_changes()
+    job = None
+    if stale:
+        if _WATCHER is not None and _WATCHER.running:
+            _WATCHER.mark_dirty()
+        else:
+            job = start_build_job(WORKSPACE_COLLECTION, force=False)
+    engine = get_manager().get(WORKSPACE_COLLECTION)
+    results = engine.search(query, top_k=top_k, ensure_index=False) if engine.index_exists() else []
+    response: Dict[str, object] = {"query": query, "top_k": top_k, "results": results, "stale": stale}
+    if job is not None:
+        response["job"] = job
+    return response
@@ -0,0 +1,226 @@
+"""
+推测执行：第一轮模型请求发出的同时，预先执行问题大概率会用到的工具调用。
+
+多数问题的第一轮只是决定用（几乎是）用户原话调用 rag_search / web_search，检索要等一整轮模型往返后才开始；
+每次 MCP 调用还要新起 server 进程。AGENT_SPECULATE=1（或 get_completion(speculate=True)）时：
+1. classify() 用关键词规则判断可能的工具调用（时间词 → get_current_datetime，时效性词 → web_search，
+   菜谱类词 → rag_search），参数为用户原话，只预取只读工具，且必须在当前工具列表中；
+2. 预取与模型请求并行执行（复制当前 contextvars，trace / 时限 / 压缩参照照常生效）；
+3. 本轮对话中模型发起同名工具调用时，参数一致（按 inputSchema 中的 default 补齐模型省略的可选参数后比较，
+   query 允许归一化后相同或向量相似度不低于 AGENT_SPECULATE_MATCH）即直接使用预取结果，否则照常调用；
+   对话结束时未用上的预取被取消并丢弃。
+
+命中、未命中与未使用次数及省下的等待时间计入 myagent_speculative_tool_calls_total 与
+myagent_speculative_saved_seconds_total，summary() 汇总命中率。
+"""
+
+import contextvars
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+import tracing
+from tool_common import LazyEmbedder, base_name
+
+SPECULATE_ENABLED = os.getenv("AGENT_SPECULATE", "0") == "1"
+# query 参数的向量相似度不低于该值即视为同一次调用
+SPECULATE_MATCH_THRESHOLD = float(os.getenv("AGENT_SPECULATE_MATCH", "0.85"))
+# 每个问题最多预取的工具调用数
+SPECULATE_MAX = int(os.getenv("AGENT_SPECULATE_MAX", "2"))
+
+SPECULATIONS = metrics.counter("speculative_tool_calls_total", "预取的工具调用（outcome=hit|miss|unused）", ("tool", "outcome"))
+SPECULATION_SAVED = metrics.counter("speculative_saved_seconds_total", "预取命中省下的工具等待时间（秒）", ("tool",))
+
+# (工具名（不带 server 前缀）, 触发规则, 是否以用户原话作为 query 参数)；按顺序取前 SPECULATE_MAX 个
+_RULES: List[Tuple[str, "re.Pattern[str]", bool]] = [
+    (
+        "get_current_datetime",
+        re.compile(r"今天|昨天|明天|前天|现在|当前|今年|去年|明年|星期|周[一二三四五六日末]|几号|日期|几点|\d{4}\s*年|today|now|current", re.I),
+        False,
+    ),
+    (
+        "rag_search",
+        re.compile(r"菜谱|食谱|做法|怎么做|如何做|烹饪|家常菜|[炒炖蒸煮烤煎焖卤腌拌]|配料|食材|调料|recipe|cook", re.I),
+        True,
+    ),
+    (
+        "web_search",
+        re.compile(r"最新|新闻|近期|最近|实时|价格|股价|汇率|天气|比分|发布会|上映|热搜|latest|news|price|weather", re.I),
+        True,
+    ),
+]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[\s\W_]+", "", str(text).lower())
+
+
+def classify(query: str, tools: List[Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+    """返回可能的 (工具全名, 参数) 列表；工具须在 tools 中，query 参数取用户原话。"""
+    available: Dict[str, str] = {}
+    for tool in tools:
+        name = tool["function"]["name"]
+        available.setdefault(base_name(name), name)
+    calls: List[Tuple[str, Dict[str, Any]]] = []
+    for base, pattern, with_query in _RULES:
+        if base in available and pattern.search(query):
+            calls.append((available[base], {"query": query.strip()} if with_query else {}))
+        if len(calls) >= SPECULATE_MAX:
+            break
+    return calls
+
+
+def _defaults(tools: List[Dict[str, Any]], name: str) -> Dict[str, Any]:
+    for tool in tools:
+        if tool["function"]["name"] == name:
+            props = (tool["function"].get("parameters") or {}).get("properties") or {}
+            return {key: spec["default"] for key, spec in props.items() if isinstance(spec, dict) and "default" in spec}
+    return {}
+
+
+class _Discard(threading.Event):
+    """丢弃预取结果时置位；对话被中断（parent 置位）时同样视为已置位。"""
+
+    def __init__(self, parent: Any = None):
+        super().__init__()
+        self.parent = parent
+
+    def is_set(self) -> bool:
+        return super().is_set() or (self.parent is not None and self.parent.is_set())
+
+
+class _Prefetch:
+    def __init__(self, name: str, arguments: Dict[str, Any], defaults: Dict[str, Any], cancel: Any):
+        self.name = name
+        self.arguments = arguments
+        self.defaults = defaults
+        self.discard = _Discard(cancel)
+        self.future: Optional[Future] = None
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.outcome = "unused"
+
+    def run(self, mcp_client: Any, timeout: Optional[int]) -> str:
+        try:
+            return mcp_client.call_tool(self.name, dict(self.arguments), timeout=timeout, cancel=self.discard)
+        finally:
+            self.finished = time.perf_counter()
+
+
+class Speculation:
+    """一次对话轮次内的预取结果；由 Speculator.start() 创建，对话结束时 close()。"""
+
+    def __init__(self, speculator: "Speculator", items: List[_Prefetch]):
+        self.speculator = speculator
+        self.items = items
+
+    def take(self, name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """模型发起工具调用时查询：参数匹配则等待并返回预取结果，否则返回 None（照常调用）。"""
+        requested = time.perf_counter()
+        for item in self.items:
+            if item.name != name or item.outcome == "hit" or item.future is None:
+                continue
+            match = self.speculator.match(item, arguments)
+            if match is None:
+                item.outcome = "miss"
+                continue
+            item.outcome = "hit"
+            result = item.future.result()
+            saved = min(item.finished or requested, requested) - item.started
+            self.speculator.record_hit(base_name(name), saved)
+            span = tracing.current_span()
+            if span is not None:
+                span.set_attributes(speculative=match, speculative_saved_ms=round(saved * 1000, 1))
+            return result
+        return None
+
+    def close(self):
+        """对话结束：取消并丢弃未用上的预取，计入命中率统计。"""
+        for item in self.items:
+            if item.outcome != "hit":
+                item.discard.set()
+            self.speculator.record(base_name(item.name), item.outcome)
+
+
+class Speculator:
+    """推测执行器；线程安全，所有会话共享一个线程池与统计。"""
+
+    def __init__(self, threshold: float = SPECULATE_MATCH_THRESHOLD, max_workers: int = 8, embedder: Any = None):
+        self.threshold = threshold
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self._embedder = LazyEmbedder(embedder)
+        self._lock = threading.Lock()
+        self._stats = {"prefetched": 0, "hit": 0, "miss": 0, "unused": 0, "saved_s": 0.0}
+
+    def start(
+        self, query: str, tools: List[Dict[str, Any]], mcp_client: Any, timeout: Optional[int] = None, cancel: Any = None
+    ) -> Optional[Speculation]:
+        """按问题预测并立即在后台发起工具调用；没有可预测的调用时返回 None。"""
+        calls = classify(query, tools)
+        if not calls:
+            return None
+        items: List[_Prefetch] = []
+        with tracing.span("agent.speculate", tools=",".join(base_name(name) for name, _ in calls)):
+            for name, arguments in calls:
+                item = _Prefetch(name, arguments, _defaults(tools, name), cancel)
+                # 复制当前上下文：预取的 span 挂在本次请求的 trace 下，同样受请求时限约束
+                ctx = contextvars.copy_context()
+                item.future = self._pool.submit(ctx.run, item.run, mcp_client, timeout)
+                items.append(item)
+        with self._lock:
+            self._stats["prefetched"] += len(items)
+        return Speculation(self, items)
+
+    def match(self, item: _Prefetch, arguments: Dict[str, Any]) -> Optional[str]:
+        """比较模型的实际参数与预取参数：返回 "exact" / "semantic"，不匹配时返回 None。"""
+        actual = {**item.defaults, **(arguments or {})}
+        predicted = {**item.defaults, **item.arguments}
+        if set(actual) != set(predicted):
+            return None
+        if any(actual[key] != predicted[key] for key in actual if key != "query"):
+            return None
+        if "query" not in actual:
+            return "exact"
+        a, b = str(actual["query"]), str(predicted["query"])
+        if _normalize(a) == _normalize(b):
+            return "exact"
+        try:
+            vecs = self._embedder.encode([a, b])
+        except Exception:
+            return None
+        return "semantic" if float(vecs[0] @ vecs[1]) >= self.threshold else None
+
+    def record_hit(self, tool: str, saved: float):
+        SPECULATION_SAVED.inc(max(saved, 0.0), tool=tool)
+        with self._lock:
+            self._stats["saved_s"] += max(saved, 0.0)
+
+    def record(self, tool: str, outcome: str):
+        SPECULATIONS.inc(tool=tool, outcome=outcome)
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats["hit"] + stats["miss"] + stats["unused"]
+        stats["hit_rate"] = round(stats["hit"] / done, 3) if done else None
+        stats["saved_s"] = round(stats["saved_s"], 3)
+        return stats
+
+
+_SPECULATOR: Optional[Speculator] = None
+_SPECULATOR_LOCK = threading.Lock()
+
+
+def get_speculator() -> Speculator:
+    """进程内共享的推测执行器。"""
+    global _SPECULATOR
+    with _SPECULATOR_LOCK:
+        if _SPECULATOR is None:
+            _SPECULATOR = Speculator()
+        return _SPECULATOR
@@ -0,0 +1,9 @@
+"""
+文本相关的小工具，agent 侧（工具路由、结果压缩）与 rag 包共用，不依赖两边的任何模块。
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符 1 个 token，中文约 1.5 字 1 个 token。"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return int((len(text) - non_ascii) / 4 + non_ascii / 1.5) + 1
@@ -0,0 +1,34 @@
+"""
+工具路由、结果压缩与推测执行共用的小工具。
+
+- base_name()：去掉 MultiMCPClient 聚合时加的 server 前缀（local__rag_search -> rag_search）。
+- LazyEmbedder：首次使用时才加载进程内共享的 Embedder（rag.embedding.get_embedder），
+  不向量化的路径不导入模型；传入 embedder 时直接使用（便于替换为其他实现）。
+"""
+
+import threading
+from typing import Any, List, Optional
+
+
+def base_name(name: str) -> str:
+    return name.split("__", 1)[1] if "__" in name else name
+
+
+class LazyEmbedder:
+    """按需加载的 Embedder 句柄，接口同 Embedder.encode。"""
+
+    def __init__(self, embedder: Any = None):
+        self._embedder = embedder
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    from rag.embedding import get_embedder
+
+                    self._embedder = get_embedder()
+        return self._embedder
+
+    def encode(self, texts: List[str]) -> Optional[Any]:
+        return self.get().encode(texts)
@@ -0,0 +1,234 @@
+"""
+按当前问题压缩过长的工具结果，取代「只保留开头 N 个字符」的截断。
+
+长网页（mcp-server-fetch）、文件内容等超出预算时：
+1. 按空行/行把文本切成约 PASSAGE_CHARS 字的段落，记录每段的行号范围；
+2. 用本地 Embedder 批量向量化问题与各段落（段落向量按内容哈希缓存，同一页面反复出现时不重复计算），
+   以向量相似度加上问题字词的覆盖率打分（覆盖率保证专有名词、代码标识符等字面命中不被长段落稀释）；
+3. 在工具的 token 预算内按得分挑选段落，按原文顺序输出，段落之间标明省略的行号范围，模型需要时可据此续读。
+
+问题来自 Agent 当前轮次的用户输入（focus()，contextvar）加上本次工具调用的参数。没有问题、向量化不可用或文本
+本身不超预算时退化为原来的开头截断。每个工具的 token 预算见 TOOL_RESULT_TOKEN_BUDGET / TOOL_RESULT_TOKEN_BUDGETS。
+"""
+
+import contextvars
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+import tracing
+from text_utils import estimate_tokens
+from tool_common import LazyEmbedder
+
+PASSAGE_CHARS = int(os.getenv("TOOL_COMPRESS_PASSAGE_CHARS", "240"))
+# 文本结果的默认 token 预算，以及按工具名（不带 server 前缀）覆盖，如 "fetch=1000,read_file=600"
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "400"))
+TOOL_RESULT_TOKEN_BUDGETS: Dict[str, int] = {"fetch": 1000, "web_search": 600}
+for _item in os.getenv("TOOL_RESULT_TOKEN_BUDGETS", "").split(","):
+    if "=" in _item:
+        _name, _value = _item.split("=", 1)
+        TOOL_RESULT_TOKEN_BUDGETS[_name.strip()] = int(_value)
+EMBED_CACHE_SIZE = 4096
+# 开头段落通常是标题/摘要，略微加分
+LEAD_BONUS = 0.05
+# 问题字词覆盖率的权重
+LEXICAL_WEIGHT = 0.5
+
+RESULT_CHARS = metrics.counter("tool_result_chars_total", "进入压缩阶段的工具结果字符数（kind=raw|kept）", ("tool", "kind"))
+
+_focus: contextvars.ContextVar[str] = contextvars.ContextVar("tool_focus", default="")
+
+
+@contextmanager
+def focus(query: str) -> Iterator[None]:
+    """在 with 块内把 query 作为工具结果压缩的参照问题。"""
+    token = _focus.set(query or "")
+    try:
+        yield
+    finally:
+        _focus.reset(token)
+
+
+def current_focus() -> str:
+    return _focus.get()
+
+
+def budget_for(tool_name: str) -> int:
+    return TOOL_RESULT_TOKEN_BUDGETS.get(tool_name, TOOL_RESULT_TOKEN_BUDGET)
+
+
+class _Passage:
+    __slots__ = ("text", "start_line", "end_line", "tokens")
+
+    def __init__(self, text: str, start_line: int, end_line: int):
+        self.text = text
+        self.start_line = start_line
+        self.end_line = end_line
+        self.tokens = estimate_tokens(text)
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS, line_base: int = 1) -> List[_Passage]:
+    """按空行优先切分，单段不超过 max_chars；超长的单行按句读/定长再切（这些片段共享同一行号）。"""
+    passages: List[_Passage] = []
+    buf: List[str] = []
+    buf_len, buf_start = 0, line_base
+
+    def flush(end_line: int):
+        nonlocal buf, buf_len
+        if buf and "".join(buf).strip():
+            passages.append(_Passage("\n".join(buf), buf_start, end_line))
+        buf, buf_len = [], 0
+
+    for idx, line in enumerate(text.split("\n")):
+        lineno = line_base + idx
+        if len(line) > max_chars:
+            flush(lineno - 1)
+            for piece in re.findall(rf".{{1,{max_chars}}}(?:[。！？.!?；;]|$)|.{{1,{max_chars}}}", line):
+                if piece.strip():
+                    passages.append(_Passage(piece, lineno, lineno))
+            buf_start = lineno + 1
+            continue
+        if buf and (buf_len + len(line) > max_chars or (not line.strip() and buf_len > max_chars // 2)):
+            flush(lineno - 1)
+            buf_start = lineno
+        if not buf:
+            buf_start = lineno
+        buf.append(line)
+        buf_len += len(line) + 1
+    flush(line_base + text.count("\n"))
+    return passages
+
+
+class _EmbedCache:
+    """内容哈希 -> 向量的 LRU，线程安全；未命中的文本一次批量向量化。"""
+
+    def __init__(self, size: int = EMBED_CACHE_SIZE):
+        self.size = size
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._embedder = LazyEmbedder()
+
+    def encode(self, texts: List[str]) -> List[Any]:
+        keys = [hashlib.sha1(t.encode("utf-8")).hexdigest() for t in texts]
+        out: List[Any] = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._data.get(key)
+                if vec is not None:
+                    self._data.move_to_end(key)
+                    out[i] = vec
+        missing = [i for i, vec in enumerate(out) if vec is None]
+        if missing:
+            vecs = self._embedder.encode([texts[i] for i in missing])
+            with self._lock:
+                for i, vec in zip(missing, vecs):
+                    out[i] = vec
+                    self._data[keys[i]] = vec
+                while len(self._data) > self.size:
+                    self._data.popitem(last=False)
+        return out
+
+
+_CACHE = _EmbedCache()
+
+
+def _grams(text: str) -> set:
+    """小写后的单字与相邻二字组合（中文按字、英文按字母），用于字面覆盖率。"""
+    chars = [c for c in text.lower() if c.isalnum()]
+    return set(a + b for a, b in zip(chars, chars[1:])) or set(chars)
+
+
+def _head(text: str, max_chars: int) -> str:
+    return text[:max_chars].rstrip() + f"... (已截断，原始长度 {len(text)})"
+
+
+def _gap(start: int, end: int, hint: str) -> str:
+    span = f"L{start}" if start == end else f"L{start}-{end}"
+    return f"…（省略 {span}{hint}）…"
+
+
+def compress(
+    text: str,
+    query: Optional[str] = None,
+    budget_tokens: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    tool: str = "",
+    line_base: int = 1,
+    gap_hint: str = "",
+) -> str:
+    """在 token / 字符预算内保留与 query 最相关的段落；未超预算时原样返回。
+
+    line_base 为 text 第一行在原始内容中的行号（如分段读取文件时的起始行），省略标记据此给出可续读的行号；
+    gap_hint 附加在省略标记后（如「，可用 read_file 的 offset 读取」）。
+    """
+    query = query if query is not None else current_focus()
+    over_tokens = budget_tokens is not None and estimate_tokens(text) > budget_tokens
+    over_chars = max_chars is not None and len(text) > max_chars
+    if not over_tokens and not over_chars:
+        return text
+    char_limit = max_chars if max_chars is not None else budget_tokens * 4
+    passages = split_passages(text, line_base=line_base)
+    if not query.strip() or len(passages) < 2:
+        return _head(text, char_limit)
+    with tracing.span("tool.compress", tool=tool, passages=len(passages)) as span:
+        try:
+            vecs = _CACHE.encode([query] + [p.text for p in passages])
+        except Exception as exc:
+            span.record_error(exc)
+            return _head(text, char_limit)
+        qvec, qgrams = vecs[0], _grams(query)
+        scores = [
+            float(qvec @ v) + LEXICAL_WEIGHT * len(qgrams & _grams(p.text)) / max(len(qgrams), 1) + (LEAD_BONUS if i == 0 else 0.0)
+            for i, (p, v) in enumerate(zip(passages, vecs[1:]))
+        ]
+        order = sorted(range(len(passages)), key=lambda i: -scores[i])
+
+        # 预留省略标记的开销：每保留一段最多多出一个标记
+        marker_chars, marker_tokens = 40, 15
+        kept: List[int] = []
+        used_tokens = used_chars = 0
+        for i in order:
+            p = passages[i]
+            need_tokens = used_tokens + p.tokens + marker_tokens
+            need_chars = used_chars + len(p.text) + marker_chars
+            if (budget_tokens is not None and need_tokens > budget_tokens) or (max_chars is not None and need_chars > max_chars):
+                continue
+            kept.append(i)
+            used_tokens, used_chars = need_tokens, need_chars
+        if not kept:
+            return _head(text, char_limit)
+        kept.sort()
+
+        lines: List[str] = []
+        cursor, prev = passages[0].start_line, -1
+        for i in kept:
+            p = passages[i]
+            if p.start_line > cursor:
+                lines.append(_gap(cursor, p.start_line - 1, gap_hint))
+            elif i > prev + 1:
+                lines.append("…")  # 同一超长行内被跳过的片段
+            lines.append(p.text)
+            cursor, prev = max(cursor, p.end_line + 1), i
+        last_line = passages[-1].end_line
+        if cursor <= last_line:
+            lines.append(_gap(cursor, last_line, gap_hint))
+        lines.append(f"(按与问题的相关度保留 {len(kept)}/{len(passages)} 段，原始长度 {len(text)} 字)")
+        result = "\n".join(lines)
+        span.set_attributes(kept=len(kept), raw_chars=len(text), kept_chars=len(result))
+    RESULT_CHARS.inc(len(text), tool=tool, kind="raw")
+    RESULT_CHARS.inc(len(result), tool=tool, kind="kept")
+    return result
+
+
+def focus_query(arguments: Optional[Dict[str, Any]] = None) -> str:
+    """压缩参照：当前用户问题 + 本次工具调用中的字符串参数（如检索词、正则、URL）。"""
+    parts: List[str] = [current_focus()]
+    for value in (arguments or {}).values():
+        if isinstance(value, str) and value and len(value) < 300:
+            parts.append(value)
+    return " ".join(p for p in parts if p).strip()
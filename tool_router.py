@@ -0,0 +1,110 @@
+"""
+按问题挑选每轮发给模型的工具子集，缩小 prompt。
+
+聚合后的工具（local / fetch / amap 全套）每轮都带完整描述，问题本身之前就有数千 token 的工具 schema。
+ToolRouter 把每个工具的「名称 + 描述 + 参数名」向量化一次（与 RAG 共用 Embedder），每个对话轮次按用户问题
+取相似度最高的 TOOL_ROUTER_TOP_K 个，再并上：
+- TOOL_ROUTER_ALWAYS_ON 中的常驻工具（默认 get_current_datetime，系统提示要求涉及时间必须先调用）；
+- 该会话之前发送或调用过的工具（粘性，只增不减）：工具列表位于请求前缀中，保持不变才能命中供应商的上下文缓存，
+  会话话题稳定后不再新增工具，后续轮次的系统提示 + 工具 + 历史消息都可复用缓存。
+
+模型调用了子集之外的工具时：真实存在的工具直接执行并加入粘性集合；不存在的工具名（子集过小导致模型臆造）
+则本轮剩余的模型调用改发完整工具列表。节省的 schema token 计入 myagent_tool_schema_tokens_saved_total。
+向量化失败或工具数不多时直接返回完整列表。
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import metrics
+from text_utils import estimate_tokens
+from tool_common import LazyEmbedder, base_name
+
+TOOL_ROUTER_ENABLED = os.getenv("TOOL_ROUTER", "1") != "0"
+TOOL_ROUTER_TOP_K = int(os.getenv("TOOL_ROUTER_TOP_K", "8"))
+# 逗号分隔，可写不带 server 前缀的工具名（匹配所有 server 的同名工具）
+TOOL_ROUTER_ALWAYS_ON = [
+    name.strip() for name in os.getenv("TOOL_ROUTER_ALWAYS_ON", "get_current_datetime").split(",") if name.strip()
+]
+
+TOOLS_SAVED = metrics.counter("tool_schema_tokens_saved_total", "工具路由省下的工具 schema token 数（估算）")
+TOOLS_SELECTED = metrics.histogram("tool_router_selected_tools", "每轮发给模型的工具数", buckets=(2, 4, 8, 12, 16, 24, 32, 48, 64))
+TOOL_EXPANSIONS = metrics.counter("tool_router_expansions_total", "模型请求子集外工具的次数（kind=known|unknown）", ("kind",))
+
+
+def _tool_text(tool: Dict[str, Any]) -> str:
+    fn = tool.get("function") or {}
+    params = (fn.get("parameters") or {}).get("properties") or {}
+    return f"{base_name(fn.get('name', ''))}: {fn.get('description') or ''} 参数: {' '.join(params)}"
+
+
+class ToolRouter:
+    """工具子集选择器；线程安全，所有会话共享（工具向量只计算一次）。"""
+
+    def __init__(self, top_k: int = TOOL_ROUTER_TOP_K, always_on: Sequence[str] = TOOL_ROUTER_ALWAYS_ON, embedder: Any = None):
+        self.top_k = top_k
+        self.always_on = set(always_on)
+        self._embedder = LazyEmbedder(embedder)
+        self._lock = threading.Lock()
+        self._key: Optional[Tuple[str, ...]] = None
+        self._matrix = None
+        self._tokens: List[int] = []
+        self._failed = False
+
+    def _index(self, tools: List[Dict[str, Any]]) -> Tuple[Optional[Any], List[int]]:
+        """工具列表变化时重新向量化，否则复用。"""
+        key = tuple(t["function"]["name"] for t in tools)
+        with self._lock:
+            if key == self._key:
+                return self._matrix, self._tokens
+            tokens = [estimate_tokens(json.dumps(t, ensure_ascii=False)) for t in tools]
+            matrix = None
+            if not self._failed:
+                try:
+                    matrix = self._embedder.encode([_tool_text(t) for t in tools])
+                except Exception as exc:
+                    self._failed = True  # 向量化不可用时退化为发送完整列表，不反复重试加载模型
+                    print(f"⚠️ 工具路由向量化失败，改为发送完整工具列表：{exc}")
+            self._key, self._matrix, self._tokens = key, matrix, tokens
+            return matrix, tokens
+
+    def _always_on(self, name: str) -> bool:
+        return name in self.always_on or base_name(name) in self.always_on
+
+    def select(self, tools: List[Dict[str, Any]], query: str, sticky: Iterable[str] = ()) -> Tuple[List[Dict[str, Any]], int]:
+        """返回 (本轮发给模型的工具, 省下的 schema token)；工具保持原始顺序：常驻 + 粘性 + 与 query 最相关的 top_k。"""
+        if not tools or len(tools) <= self.top_k + len(self.always_on):
+            return tools, 0
+        matrix, tokens = self._index(tools)
+        if matrix is None or not query.strip():
+            return tools, 0
+        sticky = set(sticky)
+        chosen: Set[int] = {i for i, t in enumerate(tools) if t["function"]["name"] in sticky or self._always_on(t["function"]["name"])}
+        try:
+            scores = matrix @ self._embedder.encode([query])[0]
+        except Exception:
+            return tools, 0
+        for idx in scores.argsort()[::-1][: self.top_k]:
+            chosen.add(int(idx))
+        selected = [tools[i] for i in sorted(chosen)]
+        saved = sum(tokens) - sum(tokens[i] for i in chosen)
+        TOOLS_SELECTED.observe(len(selected))
+        TOOLS_SAVED.inc(saved)
+        return selected, saved
+
+
+_ROUTER: Optional[ToolRouter] = None
+_ROUTER_LOCK = threading.Lock()
+
+
+def get_tool_router() -> Optional[ToolRouter]:
+    """进程内共享的路由器；TOOL_ROUTER=0 时返回 None（每轮发送完整工具列表）。"""
+    global _ROUTER
+    if not TOOL_ROUTER_ENABLED:
+        return None
+    with _ROUTER_LOCK:
+        if _ROUTER is None:
+            _ROUTER = ToolRouter()
+        return _ROUTER
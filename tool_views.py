@@ -0,0 +1,146 @@
+"""
+把工具的 structuredContent 渲染成给模型看的紧凑文本。
+
+完整结构化结果不进入 prompt，进入 prompt 的只是按字符预算（MCPClient.result_max_chars）裁剪后的视图：
+检索类只保留排名靠前、能放进预算的片段；文件读取保留与当前问题最相关的段落（tool_compressor）与续读游标；
+其余工具输出去掉冗余字段的紧凑 JSON。
+"""
+
+import json
+from typing import Any, Callable, Dict, List
+
+import tool_compressor
+
+# 单个字符串字段在通用视图中的最大长度
+GENERIC_MAX_STR = 300
+
+
+def _clip(text: str, limit: int) -> str:
+    text = (text or "").strip()
+    if len(text) <= limit:
+        return text
+    return text[: max(limit, 0)].rstrip() + "…"
+
+
+def _pack(header: str, blocks: List[str], max_chars: int, noun: str = "条") -> str:
+    """依次放入 blocks，超出预算时截断最后一个并注明省略数量。"""
+    lines = [header] if header else []
+    used = len(header)
+    for idx, block in enumerate(blocks):
+        remaining = max_chars - used - 1
+        if remaining <= 40:
+            lines.append(f"(其余 {len(blocks) - idx} {noun}已省略)")
+            break
+        if len(block) > remaining:
+            lines.append(_clip(block, remaining - 20))
+            if idx + 1 < len(blocks):
+                lines.append(f"(其余 {len(blocks) - idx - 1} {noun}已省略)")
+            break
+        lines.append(block)
+        used += len(block) + 1
+    return "\n".join(lines)
+
+
+def _render_search(data: Dict[str, Any], max_chars: int) -> str:
+    results = data.get("results") or []
+    if not results:
+        return data.get("message") or f"未检索到与「{data.get('query', '')}」相关的内容"
+    blocks = []
+    for rank, item in enumerate(results, 1):
+        title = item.get("dish_name") or item.get("source") or "片段"
+        meta = " ".join(str(v) for v in (item.get("category"), item.get("difficulty")) if v)
+        if (item.get("chunks") or 1) > 1:
+            meta = f"{meta} (相邻 {item['chunks']} 段)".strip()
+        header = f"{rank}. [{title}]({item.get('source') or ''}) score={item.get('score', 0):.3f} {meta}".rstrip()
+        blocks.append(f"{header}\n{(item.get('content') or '').strip()}")
+    packed = data.get("packed")
+    note = ""
+    if packed:
+        skipped = [f"{label} {packed[key]} 条" for key, label in (("duplicates", "去重"), ("dropped", "超出预算")) if packed.get(key)]
+        note = f"（{packed.get('max_tokens')} token 预算{'，' + '、'.join(skipped) if skipped else ''}）"
+    return _pack(f"检索到 {len(results)} 条{note}：", blocks, max_chars)
+
+
+def _render_read(data: Dict[str, Any], max_chars: int) -> str:
+    if data.get("eof"):
+        tail = "(已到文件末尾)"
+    else:
+        cursor = f" cursor={data['next_cursor']}" if data.get("next_cursor") else ""
+        tail = f"(未读完，续读 offset={data.get('next_offset')}{cursor})"
+    header = f"{data.get('path')} [{data.get('unit', 'lines')} 从 {data.get('offset', 0)} 起，共 {data.get('total_bytes', '?')} 字节]"
+    budget = max_chars - len(header) - len(tail) - 2
+    content = (data.get("content") or "").rstrip("\n")
+    if len(content) > budget:
+        if data.get("unit", "lines") == "lines":
+            # 省略标记中的行号是文件行号，模型可直接用 offset=行号-1 读取被省略的部分
+            content = tool_compressor.compress(
+                content,
+                max_chars=budget,
+                tool="read_file",
+                line_base=int(data.get("offset") or 0) + 1,
+                gap_hint="，可用 offset=行号-1 读取",
+            )
+        else:
+            content = tool_compressor.compress(content, max_chars=budget, tool="read_file")
+    return f"{header}\n{content}\n{tail}"
+
+
+def _render_grep(data: Dict[str, Any], max_chars: int) -> str:
+    matches = data.get("matches") or []
+    total = data.get("match_count", len(matches))
+    header = f"{data.get('path')} 中匹配 /{data.get('pattern', '')}/ 共 {total} 处" + ("（已截断）" if data.get("truncated") else "")
+    blocks = [f"L{m.get('start_line', m.get('line'))}-{m.get('end_line', m.get('line'))}:\n{m.get('text', '')}" for m in matches]
+    return _pack(header, blocks, max_chars, noun="处")
+
+
+def _render_list(data: Dict[str, Any], max_chars: int) -> str:
+    items = data.get("items") or []
+    header = f"{data.get('path')}：共 {data.get('total', len(items))} 项"
+    if data.get("next_offset") is not None:
+        header += f"，下一页 offset={data['next_offset']}"
+    blocks = [f"{it.get('name')}/" if it.get("is_dir") else f"{it.get('name')}  {it.get('size', 0)}B" for it in items]
+    return _pack(header, blocks, max_chars, noun="项")
+
+
+def _render_research(data: Dict[str, Any], max_chars: int) -> str:
+    sources = data.get("sources") or []
+    refs = [s.get("url") or s.get("source") or s.get("title") or "" for s in sources]
+    blocks = [data.get("answer") or ""]
+    blocks.extend(f"- {ref}" for ref in refs if ref)
+    return _pack("", blocks, max_chars)
+
+
+def _shorten(value: Any) -> Any:
+    if isinstance(value, str):
+        return _clip(value, GENERIC_MAX_STR)
+    if isinstance(value, dict):
+        return {k: _shorten(v) for k, v in value.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [_shorten(v) for v in value]
+    return value
+
+
+def _render_generic(data: Dict[str, Any], max_chars: int) -> str:
+    text = json.dumps(_shorten(data), ensure_ascii=False, separators=(",", ":"))
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + f"... (已截断，原始长度 {len(text)})"
+
+
+RENDERERS: Dict[str, Callable[[Dict[str, Any], int], str]] = {
+    "rag_search": _render_search,
+    "workspace_search": _render_search,
+    "read_file": _render_read,
+    "rag_read_file": _render_read,
+    "grep_file": _render_grep,
+    "rag_grep_file": _render_grep,
+    "list_dir": _render_list,
+    "research": _render_research,
+}
+
+
+def render(tool_name: str, data: Dict[str, Any], max_chars: int) -> str:
+    """按工具类型渲染结构化结果，结果长度不超过 max_chars（附加的省略说明除外）。"""
+    renderer = RENDERERS.get(tool_name, _render_generic)
+    try:
+        return renderer(data, max_chars)
+    except Exception:
+        return _render_generic(data, max_chars)
@@ -1,45 +1,88 @@
 """
-RAG 工具适配层：供 MCP 暴露，调用 rag 模块完成检索、索引重建，以及只读访问菜谱源文件。
+RAG 工具适配层：供 MCP 暴露，调用 rag 模块完成检索、索引重建，以及只读访问各 collection 的源文件。
 """
 
 from pathlib import Path
 
-from rag.retrieval import rag_search_tool, rebuild_index_tool
+from rag.collection import DEFAULT_COLLECTION, get_collection
+from rag.workspace_index import workspace_search_tool
+from rag.retrieval import (
+    RAG_CONTEXT_TOKENS,
+    cancel_index_job_tool,
+    index_status_tool,
+    list_collections_tool,
+    rag_search_tool,
+    rebuild_index_tool,
+)
+from tools.text_io import GREP_MAX_MATCHES, grep_lines, read_range
 
 
 RAG_BASE = (Path(__file__).resolve().parent.parent / "rag").resolve()
 RAG_DATA = (RAG_BASE / "data").resolve()
 
 
-def _safe_rag_path(rel_path: str) -> Path:
-    """限制访问 rag/data 下的文件，防止越界。"""
-    candidate = (RAG_DATA / rel_path).resolve()
-    if not str(candidate).startswith(str(RAG_DATA)):
-        raise PermissionError("仅允许读取 rag/data 下的文件")
+def _safe_rag_path(rel_path: str, collection: str = DEFAULT_COLLECTION) -> Path:
+    """限制访问 collection 数据目录（默认 rag/data）下的文件，防止越界。"""
+    data_dir = get_collection(collection).data_dir.resolve()
+    candidate = (data_dir / rel_path).resolve()
+    if not str(candidate).startswith(str(data_dir)):
+        raise PermissionError(f"仅允许读取 {collection} 数据目录下的文件")
     return candidate
 
 
-def rag_search(query: str, top_k: int = 5):
-    """基于菜谱数据集的 RAG 检索，返回命中的片段与上下文。"""
-    return rag_search_tool(query=query, top_k=top_k)
+def rag_search(query: str, top_k: int = 5, collection: str = DEFAULT_COLLECTION, max_tokens: int = RAG_CONTEXT_TOKENS):
+    """基于本地知识库的 RAG 检索，返回命中的片段与上下文。
+    collection 默认为菜谱库 cookbook；可传逗号分隔的多个名称或 all 跨库检索（结果按分数合并）。
+    结果在 max_tokens 预算内去重并合并同一菜谱的相邻片段；需要更多内容时调大 max_tokens，0 表示不打包。
+    可用的 collection 见 rag_list_collections。"""
+    return rag_search_tool(query=query, top_k=top_k, collection=collection, max_tokens=max_tokens)
 
 
-def rag_rebuild_index():
-    """重建菜谱向量索引。"""
-    return rebuild_index_tool()
+def rag_rebuild_index(collection: str = DEFAULT_COLLECTION):
+    """在后台重建指定 collection（默认菜谱库）的向量索引，立即返回任务 job_id。
+    构建完成前检索继续使用旧索引；用 rag_index_status 查询进度（已解析文件数、已向量化 chunk 数、预计剩余秒数）。"""
+    return rebuild_index_tool(collection=collection)
 
 
-def rag_read_file(path: str) -> str:
-    """读取 rag/data 下的菜谱 markdown，提供只读访问。"""
+def rag_index_status(job_id: str = "", collection: str = ""):
+    """查询索引构建任务状态与进度；不传 job_id 时返回该 collection（或全部）最近一次任务。"""
+    return index_status_tool(job_id=job_id, collection=collection)
+
+
+def rag_cancel_index_job(job_id: str):
+    """取消进行中的索引构建任务，旧索引保持不变。"""
+    return cancel_index_job_tool(job_id=job_id)
+
+
+def rag_list_collections():
+    """列出可检索的知识库 collection 及其索引状态。"""
+    return list_collections_tool()
+
+
+def workspace_search(query: str, top_k: int = 5):
+    """在 workspace 目录（用户上传/写入的文件）中按相关度检索片段。
+    大文件请优先用本工具定位相关内容，而不是 read_file 整篇读取；stale=true 表示有文件尚未索引（后台更新中）。"""
+    return workspace_search_tool(query=query, top_k=top_k)
+
+
+def rag_read_file(path: str, collection: str = DEFAULT_COLLECTION, offset: int = 0, limit: int = 0, unit: str = "lines", cursor: str = ""):
+    """分段读取 collection 数据目录（默认 rag/data 菜谱库）下的源文件，提供只读访问。
+    分页参数与返回字段同 read_file：默认前 200 行，eof=false 时用 next_offset/next_cursor 续读。"""
     try:
-        real = _safe_rag_path(path)
+        real = _safe_rag_path(path, collection)
+        if not real.exists():
+            return f"读取失败：文件不存在：{path}"
+        return {"path": path, "collection": collection, **read_range(str(real), offset, limit, unit, cursor)}
     except Exception as exc:
         return f"读取失败：{exc}"
-    if not real.exists():
-        return f"读取失败：文件不存在：{path}"
+
+
+def rag_grep_file(path: str, pattern: str, collection: str = DEFAULT_COLLECTION, context: int = 2, max_matches: int = GREP_MAX_MATCHES):
+    """在 collection 数据目录下的源文件中按正则查找，返回命中行号及前后 context 行。"""
     try:
-        return real.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        return real.read_text(encoding="utf-8", errors="ignore")
+        real = _safe_rag_path(path, collection)
+        if not real.exists():
+            return f"查找失败：文件不存在：{path}"
+        return {"path": path, "collection": collection, **grep_lines(str(real), pattern, context, max_matches)}
     except Exception as exc:
-        return f"读取失败：{exc}"
+        return f"查找失败：{exc}"
@@ -1,5 +1,6 @@
 import os
-from typing import List
+
+from tools.text_io import GREP_MAX_MATCHES, grep_lines, read_range
 
 # 🔒 安全沙箱根目录
 WORKSPACE = os.path.join(os.path.dirname(__file__), "..", "workspace")
@@ -27,38 +28,81 @@ def _safe_path(path: str) -> str:
     return real
 
 
-def list_dir(path: str = ".") -> List[str]:
+def _invalidate_meta(real: str):
+    """写入类操作后使 workspace 元数据缓存失效（延迟导入避免循环依赖）。"""
+    from tools.workspace_meta import invalidate
+
+    invalidate(real)
+
+
+def list_dir(
+    path: str = ".",
+    recursive: bool = False,
+    pattern: str = "",
+    sort: str = "name",
+    descending: bool = False,
+    offset: int = 0,
+    limit: int = 100,
+):
     """
-    列出 workspace 中某个目录下的文件和子目录。
+    列出 workspace 中某个目录下的文件和子目录（含大小、修改时间、类型）。
 
     给模型的说明：
     - 当你需要查看有哪些文件/目录时，使用该工具。
     - path 是 workspace 下的相对路径，如 "." 或 "data/"
+    - recursive=true 递归列出子目录；pattern 为 glob（如 "*.csv"、"data/*.md"）。
+    - sort 可选 name/size/mtime/type；结果分页返回，next_offset 非空时用 offset=next_offset 取下一页。
     """
+    from tools.workspace_meta import get_meta_index
+
     try:
         real = _safe_path(path)
-        return os.listdir(real)
+        return get_meta_index().list(
+            real,
+            recursive=recursive,
+            pattern=pattern,
+            sort=sort,
+            descending=descending,
+            offset=offset,
+            limit=limit,
+        )
     except Exception as e:
-        return [f"错误：{e}"]
+        return f"列出失败：{e}"
 
 
-def read_file(path: str) -> str:
+def read_file(path: str, offset: int = 0, limit: int = 0, unit: str = "lines", cursor: str = ""):
     """
-    读取 workspace 中的文本文件内容。
+    分段读取 workspace 中的文本文件。
 
     给模型的说明：
-    - 当用户需要你读取某个文件内容时调用。
-    - 仅支持文本文件。
-    - 如果文件不存在，请如实反馈。
+    - 当用户需要你读取某个文件内容时调用；仅支持文本文件，文件不存在请如实反馈。
+    - 默认返回前 200 行；unit="bytes" 时按字节读取（默认 16KB），单次最多 64KB。
+    - 返回 total_bytes、next_offset 与 next_cursor；未到文件末尾（eof=false）时，
+      传入 offset=next_offset、cursor=next_cursor 继续读取下一段。
+    - 只需查找某些内容时优先用 grep_file 或 workspace_search，而不是逐段读完整个文件。
     """
     try:
         real = _safe_path(path)
-        with open(real, "r", encoding="utf-8") as f:
-            return f.read()
+        return {"path": path, **read_range(real, offset=offset, limit=limit, unit=unit, cursor=cursor)}
     except Exception as e:
         return f"读取失败：{e}"
 
 
+def grep_file(path: str, pattern: str, context: int = 2, max_matches: int = GREP_MAX_MATCHES, ignore_case: bool = False):
+    """
+    在 workspace 文件中按正则（非法正则按字面量）查找，返回命中行号及前后 context 行。
+
+    给模型的说明：
+    - 只需要文件中与某关键词相关的部分时使用，避免整篇读取。
+    - 需要更多上下文时，用 read_file 的 offset=start_line-1 读取对应行段。
+    """
+    try:
+        real = _safe_path(path)
+        return {"path": path, **grep_lines(real, pattern, context=context, max_matches=max_matches, ignore_case=ignore_case)}
+    except Exception as e:
+        return f"查找失败：{e}"
+
+
 def write_file(path: str, content: str) -> str:
     """
     将内容写入 workspace 中的文件（覆盖写入）。
@@ -75,6 +119,7 @@ def write_file(path: str, content: str) -> str:
 
         with open(real, "w", encoding="utf-8") as f:
             f.write(content)
+        _invalidate_meta(real)
 
         return f"写入成功：{path}"
     except Exception as e:
@@ -95,6 +140,7 @@ def append_file(path: str, content: str) -> str:
 
         with open(real, "a", encoding="utf-8") as f:
             f.write(content)
+        _invalidate_meta(real)
 
         return f"追加成功：{path}"
     except Exception as e:
@@ -108,6 +154,7 @@ def delete_file(path: str) -> str:
     try:
         real = _safe_path(path)
         os.remove(real)
+        _invalidate_meta(real)
         return f"删除成功：{path}"
     except Exception as e:
         return f"删除失败：{e}"
@@ -124,6 +171,8 @@ def rename_file(src: str, dst: str) -> str:
         os.makedirs(os.path.dirname(real_dst), exist_ok=True)
 
         os.rename(real_src, real_dst)
+        _invalidate_meta(real_src)
+        _invalidate_meta(real_dst)
 
         return f"已将 {src} 重命名为 {dst}"
     except Exception as e:
@@ -137,6 +186,7 @@ def make_dir(path: str) -> str:
     try:
         real = _safe_path(path)
         os.makedirs(real, exist_ok=True)
+        _invalidate_meta(real)
         return f"目录创建成功：{path}"
     except Exception as e:
         return f"创建失败：{e}"
@@ -0,0 +1,154 @@
+"""
+返回结构化结果的工具的 outputSchema（JSON Schema）。
+
+声明了 outputSchema 的工具由 mcp_server 以 structuredContent 返回（文本块只附带裁剪后的渲染视图，供其他 MCP 客户端使用），
+本项目客户端据此渲染紧凑的模型视图（见 tool_views.py），完整 JSON 不进入 prompt。工具返回字符串时视为出错（isError=True）。
+schema 只约束客户端渲染依赖的字段，其余字段允许扩展。
+"""
+
+from typing import Any, Dict
+
+_NULLABLE_INT = {"type": ["integer", "null"]}
+
+_SEARCH_HIT = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "number"},
+        "content": {"type": ["string", "null"]},
+        "source": {"type": ["string", "null"]},
+        "collection": {"type": "string"},
+        "chunks": {"type": "integer", "description": "合并的相邻片段数"},
+    },
+    "required": ["score", "content"],
+}
+
+_SEARCH = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string"},
+        "top_k": {"type": "integer"},
+        "collection": {"type": "string"},
+        "results": {"type": "array", "items": _SEARCH_HIT},
+        "message": {"type": "string", "description": "索引未就绪等提示"},
+        "job": {"type": "object"},
+        "packed": {
+            "type": "object",
+            "description": "按 token 预算打包的统计",
+            "properties": {
+                "max_tokens": {"type": "integer"},
+                "tokens": {"type": "integer"},
+                "candidates": {"type": "integer"},
+                "duplicates": {"type": "integer"},
+                "merged": {"type": "integer"},
+                "dropped": {"type": "integer"},
+            },
+        },
+    },
+    "required": ["query", "results"],
+}
+
+_READ = {
+    "type": "object",
+    "properties": {
+        "path": {"type": "string"},
+        "collection": {"type": "string"},
+        "unit": {"type": "string", "enum": ["lines", "bytes"]},
+        "offset": {"type": "integer"},
+        "content": {"type": "string"},
+        "total_bytes": {"type": "integer"},
+        "next_offset": _NULLABLE_INT,
+        "next_cursor": {"type": ["string", "null"]},
+        "eof": {"type": "boolean"},
+    },
+    "required": ["path", "content", "eof"],
+}
+
+_GREP = {
+    "type": "object",
+    "properties": {
+        "path": {"type": "string"},
+        "collection": {"type": "string"},
+        "pattern": {"type": "string"},
+        "matches": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "line": {"type": "integer"},
+                    "start_line": {"type": "integer"},
+                    "end_line": {"type": "integer"},
+                    "text": {"type": "string"},
+                },
+                "required": ["line", "text"],
+            },
+        },
+        "match_count": {"type": "integer"},
+        "truncated": {"type": "boolean"},
+    },
+    "required": ["path", "matches", "match_count"],
+}
+
+_LIST_DIR = {
+    "type": "object",
+    "properties": {
+        "path": {"type": "string"},
+        "total": {"type": "integer"},
+        "offset": {"type": "integer"},
+        "limit": {"type": "integer"},
+        "next_offset": _NULLABLE_INT,
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "path": {"type": "string"},
+                    "is_dir": {"type": "boolean"},
+                    "type": {"type": "string"},
+                    "size": {"type": "integer"},
+                    "mtime": {"type": "number"},
+                },
+                "required": ["name", "is_dir"],
+            },
+        },
+    },
+    "required": ["path", "total", "items"],
+}
+
+_RESEARCH = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string"},
+        "answer": {"type": "string"},
+        "sub_questions": {
+            "type": "array",
+            "items": {"type": "object", "properties": {"question": {"type": "string"}, "summary": {"type": "string"}}},
+        },
+        "sources": {"type": "array", "items": {"type": "object"}},
+        "duplicates_removed": {"type": "integer"},
+        "timings": {"type": "object"},
+    },
+    "required": ["answer"],
+}
+
+_JOB = {
+    "type": "object",
+    "properties": {"status": {"type": "string"}},
+}
+
+OUTPUT_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "rag_search": _SEARCH,
+    "workspace_search": {
+        **_SEARCH,
+        "properties": {**_SEARCH["properties"], "stale": {"type": "boolean", "description": "有文件变化尚未索引，后台更新中"}},
+    },
+    "read_file": _READ,
+    "rag_read_file": _READ,
+    "grep_file": _GREP,
+    "rag_grep_file": _GREP,
+    "list_dir": _LIST_DIR,
+    "research": _RESEARCH,
+    "rag_rebuild_index": _JOB,
+    "rag_index_status": _JOB,
+    "rag_cancel_index_job": _JOB,
+}
@@ -0,0 +1,54 @@
+"""
+研究工具：把 modules.research 流水线暴露为 MCP 工具。
+
+调用方在请求中携带 progressToken 时，每完成一条子问题总结即通过 progress 通知推送（见 mcp_server）。
+"""
+
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from modules.research import DEFAULT_CONCURRENCY, run_research
+from rag.collection import DEFAULT_COLLECTION
+
+# (progress, total, message) -> None；由 MCP server 在每次调用前设置
+progress_reporter: ContextVar[Optional[Callable[[float, Optional[float], str], Awaitable[None]]]] = ContextVar(
+    "progress_reporter", default=None
+)
+
+
+async def research(
+    query: str,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    use_web: bool = True,
+    use_rag: bool = True,
+    collection: str = DEFAULT_COLLECTION,
+):
+    """
+    针对复杂问题做多步研究：拆分 3-5 个子问题，并发联网搜索与知识库检索，去重来源后并发总结，再综合成最终答案。
+    返回 answer、各子问题总结、来源列表与耗时分解（timings）。
+    仅在问题需要多方面资料时使用；简单事实查询请直接用 web_search 或 rag_search。
+    """
+    report = progress_reporter.get()
+    state: Dict[str, Any] = {"done": 0, "total": None}
+
+    async def on_event(event: Dict[str, Any]):
+        if report is None:
+            return
+        if event["type"] == "plan":
+            state["total"] = len(event["sub_questions"]) + 1
+            await report(0, state["total"], "子问题：" + "；".join(event["sub_questions"]))
+        elif event["type"] == "summary":
+            state["done"] += 1
+            await report(state["done"], state["total"], f"{event['question']}：{event['summary'][:200]}")
+
+    try:
+        return await run_research(
+            query,
+            on_event=on_event,
+            max_concurrency=max_concurrency,
+            use_web=use_web,
+            use_rag=use_rag,
+            collection=collection,
+        )
+    except Exception as exc:
+        return f"研究失败：{exc}"
@@ -0,0 +1,142 @@
+"""
+文本文件的分段读取与流式查找，供 workspace（tools.file）与 RAG 数据目录（tools.cookbook_rag）的只读工具共用；
+调用方负责路径校验，这里只接收已解析的真实路径。
+"""
+
+import mmap
+import os
+import re
+from collections import deque
+from typing import Any, Dict, List
+
+import cancellation
+
+# 分段读取的默认窗口与单次返回上限，避免整篇文件进入上下文
+READ_DEFAULT_LINES = 200
+READ_DEFAULT_BYTES = 16 * 1024
+READ_MAX_BYTES = 64 * 1024
+# 超过该大小的文件用 mmap 定位，不整体读入内存
+MMAP_THRESHOLD = 1024 * 1024
+GREP_MAX_MATCHES = 20
+
+
+def _align_utf8(buf, pos: int, size: int) -> int:
+    """把字节位置后移到 UTF-8 字符边界（跳过续字节），避免截断多字节字符。"""
+    while pos < size and (buf[pos] & 0xC0) == 0x80:
+        pos += 1
+    return pos
+
+
+def read_range(real: str, offset: int = 0, limit: int = 0, unit: str = "lines", cursor: str = "") -> Dict[str, Any]:
+    """
+    按行或字节读取文件片段。大文件使用 mmap 定位；lines 模式返回的 next_cursor
+    记录“行号:字节位置”，续读时无需从头数行。
+    """
+    if unit not in ("lines", "bytes"):
+        raise ValueError("unit 仅支持 lines 或 bytes")
+    offset = max(int(offset or 0), 0)
+    size = os.path.getsize(real)
+    with open(real, "rb") as f:
+        use_mmap = size >= MMAP_THRESHOLD
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f.read()
+        try:
+            if unit == "bytes":
+                limit = min(limit or READ_DEFAULT_BYTES, READ_MAX_BYTES)
+                start = offset = _align_utf8(buf, min(offset, size), size)
+                end = _align_utf8(buf, min(start + limit, size), size)
+                content = bytes(buf[start:end]).decode("utf-8", errors="replace")
+                next_offset = end if end < size else None
+                next_cursor = ""
+            else:
+                limit = limit or READ_DEFAULT_LINES
+                line, pos = 0, 0
+                if cursor:
+                    c_line, _, c_pos = cursor.partition(":")
+                    if c_line.isdigit() and c_pos.isdigit():
+                        c_line, c_pos = int(c_line), int(c_pos)
+                        valid = c_pos <= size and (c_pos == 0 or buf[c_pos - 1] == 0x0A)
+                        if valid and c_line <= offset:
+                            line, pos = c_line, c_pos
+                while line < offset and pos < size:
+                    nl = buf.find(b"\n", pos)
+                    pos = size if nl == -1 else nl + 1
+                    line += 1
+                start, count, truncated = pos, 0, False
+                while count < limit and pos < size:
+                    nl = buf.find(b"\n", pos)
+                    nxt = size if nl == -1 else nl + 1
+                    if nxt - start > READ_MAX_BYTES and count:
+                        break
+                    pos, count = nxt, count + 1
+                    if pos - start > READ_MAX_BYTES:
+                        truncated = True  # 单行过长
+                        break
+                end = min(pos, start + READ_MAX_BYTES) if truncated else pos
+                content = bytes(buf[start:_align_utf8(buf, end, size)]).decode("utf-8", errors="replace")
+                if truncated:
+                    content += "...(行过长已截断)"
+                next_offset = offset + count if pos < size else None
+                next_cursor = f"{offset + count}:{pos}" if pos < size else ""
+        finally:
+            if use_mmap:
+                buf.close()
+    return {
+        "unit": unit,
+        "offset": offset,
+        "content": content,
+        "total_bytes": size,
+        "next_offset": next_offset,
+        "next_cursor": next_cursor,
+        "eof": next_offset is None,
+    }
+
+
+def grep_lines(real: str, pattern: str, context: int = 2, max_matches: int = GREP_MAX_MATCHES, ignore_case: bool = False) -> Dict[str, Any]:
+    """逐行流式匹配（内存与文件大小无关），返回每个命中行及前后 context 行的窗口。"""
+    flags = re.IGNORECASE if ignore_case else 0
+    try:
+        regex = re.compile(pattern, flags)
+    except re.error:
+        regex = re.compile(re.escape(pattern), flags)
+    context = max(int(context or 0), 0)
+    max_matches = max(int(max_matches or GREP_MAX_MATCHES), 1)
+
+    matches: List[Dict[str, Any]] = []
+    before: deque = deque(maxlen=context)
+    pending: List[Dict[str, Any]] = []  # 还在收集后文的窗口
+    total = 0
+    with open(real, "r", encoding="utf-8", errors="replace") as f:
+        for lineno, raw in enumerate(f, 1):
+            # 调用方已取消时提前结束，大文件不再扫到底（结果会被丢弃）
+            if lineno % 4096 == 0 and cancellation.tool_cancelled():
+                break
+            line = raw.rstrip("\n")
+            for win in pending:
+                win["lines"].append(line)
+                win["end_line"] = lineno
+            pending = [w for w in pending if w["end_line"] - w["line"] < context]
+            if regex.search(line):
+                total += 1
+                if len(matches) < max_matches:
+                    win = {
+                        "line": lineno,
+                        "start_line": lineno - len(before),
+                        "end_line": lineno,
+                        "lines": list(before) + [line],
+                    }
+                    matches.append(win)
+                    if context:
+                        pending.append(win)
+                elif not pending:
+                    # 已达上限：继续计数但无需收集窗口；行数很多时提前结束
+                    if total > max_matches * 10:
+                        break
+            before.append(line)
+    for win in matches:
+        win["text"] = "\n".join(win.pop("lines"))
+    return {
+        "pattern": pattern,
+        "matches": matches,
+        "match_count": total,
+        "truncated": total > len(matches),
+    }
@@ -1,72 +1,250 @@
-import requests
-from langchain_tavily import TavilySearch
+"""
+联网搜索（Tavily）：复用连接池的异步 HTTP 客户端 + 对冲请求 + 按查询缓存。
+
+- 连接池：每个事件循环一个 httpx.AsyncClient（keep-alive，安装 h2 时启用 HTTP/2），避免每次握手。
+- 对冲请求：主请求超过近期 p95 延迟仍未返回时，再发一个相同请求，先返回者胜出，另一个取消；
+  而不是等主请求超时失败后才重试，最坏延迟不再翻倍。
+- 缓存：相同查询在 TTL 内直接返回（进程内 LRU + 磁盘，stdio MCP server 每次调用新起进程也能命中）。
+- TAVILY_API_URL 可指向本地桩服务用于测试。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import weakref
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+import tracing
 from config import TAVILY_API_KEY
 
-search = TavilySearch(
-    api_key=TAVILY_API_KEY,
-    max_results=5
-)
+try:  # 可选：HTTP/2
+    import h2  # noqa: F401
 
-def _fallback_request(query: str, timeout: float):
-    """在 langchain_tavily 调用异常时直接请求 Tavily API，增加超时保护。"""
-    try:
-        resp = requests.post(
-            "https://api.tavily.com/search",
-            json={
-                "api_key": TAVILY_API_KEY,
-                "query": query,
-                "max_results": 5,
-            },
-            timeout=timeout,
+    HTTP2_AVAILABLE = True
+except Exception:  # pragma: no cover - h2 非必需
+    HTTP2_AVAILABLE = False
+
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com/search")
+MAX_RESULTS = 5
+# 对冲：0 关闭；样本不足时使用初始延迟，之后取近期 p95（限制在 [最小值, timeout) 内）
+HEDGE_ENABLED = os.getenv("WEB_SEARCH_HEDGE", "1") != "0"
+HEDGE_INITIAL_DELAY = float(os.getenv("WEB_SEARCH_HEDGE_DELAY", "1.5"))
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", "600"))
+CACHE_MAX_ENTRIES = 256
+CACHE_DIR = Path(os.getenv("WEB_SEARCH_CACHE_DIR", str(Path(__file__).resolve().parent.parent / ".cache" / "web_search")))
+
+_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_LATENCIES: deque = deque(maxlen=LATENCY_WINDOW)
+_CACHE: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+_STATS = {"requests": 0, "hedged": 0, "hedge_wins": 0, "cache_hits": 0}
+
+
+def get_client() -> httpx.AsyncClient:
+    """返回当前事件循环的共享客户端（AsyncClient 不能跨事件循环复用）。"""
+    loop = asyncio.get_running_loop()
+    client = _CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            headers={"Content-Type": "application/json"},
         )
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("results")
-    except Exception:
+        _CLIENTS[loop] = client
+    return client
+
+
+async def close_client():
+    client = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _p95() -> Optional[float]:
+    if len(_LATENCIES) < HEDGE_MIN_SAMPLES:
         return None
+    ordered = sorted(_LATENCIES)
+    return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+
+def hedge_delay(timeout: float) -> float:
+    p95 = _p95()
+    delay = HEDGE_INITIAL_DELAY if p95 is None else p95
+    return min(max(delay, HEDGE_MIN_DELAY), timeout * 0.9)
+
+
+# ---------- 缓存 ----------
+
+
+def _cache_key(query: str, max_results: int) -> str:
+    normalized = " ".join(query.lower().split())
+    return hashlib.sha1(f"{normalized}|{max_results}".encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[List[Dict[str, Any]]]:
+    now = time.time()
+    hit = _CACHE.get(key)
+    if hit and now - hit[0] < CACHE_TTL:
+        _CACHE.move_to_end(key)
+        return hit[1]
+    path = CACHE_DIR / f"{key}.json"
+    try:
+        if now - path.stat().st_mtime < CACHE_TTL:
+            results = json.loads(path.read_text(encoding="utf-8"))
+            _cache_put(key, results, persist=False)
+            return results
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _cache_put(key: str, results: List[Dict[str, Any]], persist: bool = True):
+    _CACHE[key] = (time.time(), results)
+    _CACHE.move_to_end(key)
+    while len(_CACHE) > CACHE_MAX_ENTRIES:
+        _CACHE.popitem(last=False)
+    if not persist:
+        return
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = CACHE_DIR / f".{key}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(results, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, CACHE_DIR / f"{key}.json")
+    except OSError:
+        pass
+
+
+# ---------- 请求 ----------
+
+
+async def _request(query: str, max_results: int, timeout: float) -> List[Dict[str, Any]]:
+    started = time.perf_counter()
+    resp = await get_client().post(
+        TAVILY_API_URL,
+        json={"api_key": TAVILY_API_KEY, "query": query, "max_results": max_results},
+        timeout=timeout,
+    )
+    resp.raise_for_status()
+    _LATENCIES.append(time.perf_counter() - started)
+    return resp.json().get("results") or []
+
+
+async def _hedged_request(query: str, max_results: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+    """返回 (结果, 是否由对冲请求胜出)。两个请求都失败时抛出最后一个异常。"""
+    primary = asyncio.create_task(_request(query, max_results, timeout))
+    if not HEDGE_ENABLED:
+        return await primary, False
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay(timeout))
+    if primary in done and primary.exception() is None:
+        return primary.result(), False
 
+    _STATS["hedged"] += 1
+    hedge = asyncio.create_task(_request(query, max_results, timeout))
+    pending = {primary, hedge} - done
+    last_exc: Optional[BaseException] = primary.exception() if primary in done else None
+    try:
+        while pending:
+            finished, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not finished:
+                raise asyncio.TimeoutError("搜索超时")
+            for task in finished:
+                if task.exception() is None:
+                    if task is hedge:
+                        _STATS["hedge_wins"] += 1
+                    return task.result(), task is hedge
+                last_exc = task.exception()
+        raise last_exc or RuntimeError("搜索失败")
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def search_results(query: str, max_results: int = MAX_RESULTS, timeout: float = 8.0) -> Dict[str, Any]:
+    """结构化搜索结果：{"query", "results": [{"title", "url", "content"}], "source", "elapsed_ms"[, "error"]}。"""
+    with tracing.span("web.search") as span:
+        result = await _search(query, max_results, timeout)
+        span.set_attributes(source=result["source"], cache_hit=result["source"] == "cache")
+    return result
+
+
+async def _search(query: str, max_results: int, timeout: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    key = _cache_key(query, max_results)
+    cached = _cache_get(key)
+    if cached is not None:
+        _STATS["cache_hits"] += 1
+        return {"query": query, "results": cached, "source": "cache", "elapsed_ms": 0.0}
+
+    _STATS["requests"] += 1
+    try:
+        raw, hedged = await _hedged_request(query, max_results, timeout)
+    except Exception as exc:
+        return {
+            "query": query,
+            "results": [],
+            "source": "error",
+            "error": str(exc) or exc.__class__.__name__,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    results = [_normalize(item) for item in raw[:max_results]]
+    if results:
+        _cache_put(key, results)
+    return {
+        "query": query,
+        "results": results,
+        "source": "hedge" if hedged else "primary",
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
 
-def web_search(query: str, timeout: float = 8.0):
+
+def _normalize(item: Dict[str, Any]) -> Dict[str, Any]:
+    url = item.get("url") or ""
+    if url and not url.startswith(("http://", "https://")):
+        url = "https://" + url.lstrip("/")
+    return {
+        "title": (item.get("title") or item.get("url") or "无标题").strip(),
+        "url": url,
+        "content": (item.get("content") or item.get("snippet") or item.get("description") or "").strip(),
+    }
+
+
+def search_stats() -> Dict[str, Any]:
+    p95 = _p95()
+    return {**_STATS, "samples": len(_LATENCIES), "p95_ms": round(p95 * 1000, 1) if p95 else None}
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = []
+    for idx, item in enumerate(results[:MAX_RESULTS], 1):
+        # 确保 URL 可点击（加 markdown 链接）
+        display_title = f"[{item['title']}]({item['url']})" if item.get("url") else item["title"]
+        line = f"{idx}. {display_title}"
+        if item.get("content"):
+            line += f"：{item['content']}"
+        lines.append(line)
+    return "搜索结果摘要：\n" + "\n".join(lines)
+
+
+async def web_search(query: str, timeout: float = 8.0):
     """
     搜索互联⽹获取最新信息。
     - 输⼊：搜索关键词（字符串）
     - 输出：相关⽹⻚内容摘要
     - 适⽤场景：需要实时数据、最新新闻、当前事件
-    - 不适⽤场景：历史数据、个⼈信息、数学计算  
+    - 不适⽤场景：历史数据、个⼈信息、数学计算
     返回精简后的摘要字符串，避免将完整 JSON 直接给模型。
     仅取前 5 个结果，提炼标题和内容（可用时附上 URL）。
     """
-    try:
-        resp = search.invoke({"query": query}, config={"timeout": timeout})
-        results = resp.get("results") if isinstance(resp, dict) else None
-    except Exception:
-        results = _fallback_request(query, timeout)
-
-    if not results:
+    data = await search_results(query, max_results=MAX_RESULTS, timeout=timeout)
+    if not data["results"]:
         return "搜索失败或超时，或未找到相关结果。"
-
-    lines = []
-    for idx, item in enumerate(results[:5], 1):
-        title = (item.get("title") or item.get("url") or "无标题").strip()
-        snippet = (
-            item.get("content")
-            or item.get("snippet")
-            or item.get("description")
-            or ""
-        ).strip()
-        url = item.get("url")
-
-        # 确保 URL 可点击（加 markdown 链接）
-        display_title = title
-        link = url
-        if link and not link.startswith(("http://", "https://")):
-            link = "https://" + link.lstrip("/")
-        if link:
-            display_title = f"[{title}]({link})"
-
-        line = f"{idx}. {display_title}"
-        if snippet:
-            line += f"：{snippet}"
-        lines.append(line)
-
-    return "搜索结果摘要：\n" + "\n".join(lines)
+    return format_results(data["results"])
@@ -0,0 +1,270 @@
+"""
+workspace 元数据索引：缓存每个目录的条目（路径、大小、mtime、类型、内容哈希），
+为 list_dir 工具与 /workspace/list 提供排序、分页、glob 过滤与递归列举。
+
+- 增量维护：目录 mtime 未变时直接复用缓存条目，不再逐个 stat；仅对返回页中的条目重新 stat 校正。
+- 内容哈希按需计算（include_hash），以 (mtime_ns, size) 作为缓存键。
+- 写入类工具与上传接口调用 invalidate() 使对应目录失效；索引持久化到 workspace/.meta/index.json，
+  backend 与 MCP server 两个进程通过文件 mtime 感知对方的更新。
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+import metrics
+from tools.file import WORKSPACE
+
+META_FILE = os.getenv("WORKSPACE_META_FILE", os.path.join(WORKSPACE, ".meta", "index.json"))
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+SORT_KEYS = ("name", "size", "mtime", "type")
+HASH_MAX_BYTES = int(os.getenv("WORKSPACE_META_HASH_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def _rel(real: str) -> str:
+    rel = os.path.relpath(real, os.path.realpath(WORKSPACE))
+    return "." if rel == "." else rel.replace(os.sep, "/")
+
+
+def _file_type(name: str, is_dir: bool) -> str:
+    if is_dir:
+        return "dir"
+    ext = os.path.splitext(name)[1].lower().lstrip(".")
+    return ext or "file"
+
+
+def _content_hash(real: str) -> Optional[str]:
+    h = hashlib.sha1()
+    try:
+        with open(real, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+class WorkspaceMetaIndex:
+    """按目录缓存的 workspace 元数据。dirs: {相对目录: {"mtime_ns": int, "entries": {name: entry}}}"""
+
+    def __init__(self, root: str = WORKSPACE, meta_file: str = META_FILE):
+        self.root = os.path.realpath(root)
+        self.meta_file = meta_file
+        self.dirs: Dict[str, Dict[str, Any]] = {}
+        self._loaded_mtime: Optional[int] = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    # ---------- 持久化 ----------
+
+    def _meta_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.meta_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        mtime = self._meta_mtime()
+        if mtime is None or mtime == self._loaded_mtime:
+            return
+        try:
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                self.dirs = json.load(f).get("dirs", {})
+        except Exception:
+            self.dirs = {}
+        self._loaded_mtime = mtime
+
+    def _save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.meta_file), exist_ok=True)
+        tmp = f"{self.meta_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dirs": self.dirs}, f, ensure_ascii=False)
+        os.replace(tmp, self.meta_file)
+        self._loaded_mtime = self._meta_mtime()
+        self._dirty = False
+
+    # ---------- 增量刷新 ----------
+
+    def _entry_from_stat(self, name: str, is_dir: bool, st: os.stat_result, old: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        entry = {
+            "name": name,
+            "is_dir": is_dir,
+            "type": _file_type(name, is_dir),
+            "size": 0 if is_dir else st.st_size,
+            "mtime": st.st_mtime,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        # 内容未变时保留已计算的哈希
+        if old and old.get("hash") and old.get("mtime_ns") == st.st_mtime_ns and old.get("size") == entry["size"]:
+            entry["hash"] = old["hash"]
+        return entry
+
+    def _refresh_dir(self, rel_dir: str) -> Dict[str, Dict[str, Any]]:
+        """返回目录条目；目录 mtime 与缓存一致时不重新扫描。"""
+        real_dir = os.path.join(self.root, rel_dir) if rel_dir != "." else self.root
+        try:
+            dir_mtime = os.stat(real_dir).st_mtime_ns
+        except OSError:
+            if self.dirs.pop(rel_dir, None) is not None:
+                self._dirty = True
+            return {}
+        cached = self.dirs.get(rel_dir)
+        hit = bool(cached) and cached.get("mtime_ns") == dir_mtime
+        metrics.cache_lookup("workspace_meta", hit)
+        if hit:
+            return cached["entries"]
+
+        old_entries = cached["entries"] if cached else {}
+        entries: Dict[str, Dict[str, Any]] = {}
+        with os.scandir(real_dir) as it:
+            for de in it:
+                if de.name.startswith("."):
+                    continue  # 隐藏目录（.uploads/.meta 等）不对外列出
+                try:
+                    st = de.stat()
+                    is_dir = de.is_dir()
+                except OSError:
+                    continue
+                entries[de.name] = self._entry_from_stat(de.name, is_dir, st, old_entries.get(de.name))
+        self.dirs[rel_dir] = {"mtime_ns": dir_mtime, "entries": entries}
+        self._dirty = True
+        return entries
+
+    def _restat(self, rel_dir: str, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """返回前对单个条目重新 stat，校正外部原地修改带来的大小/mtime 变化。"""
+        real = os.path.join(self.root, rel_dir, entry["name"])
+        try:
+            st = os.stat(real)
+        except OSError:
+            return None
+        if st.st_mtime_ns != entry.get("mtime_ns") or (not entry["is_dir"] and st.st_size != entry["size"]):
+            entry = self._entry_from_stat(entry["name"], entry["is_dir"], st, entry)
+            self.dirs.get(rel_dir, {}).get("entries", {})[entry["name"]] = entry
+            self._dirty = True
+        return entry
+
+    def invalidate(self, real_path: str):
+        """使 real_path 所在目录（以及它自身作为目录时）的缓存失效。"""
+        with self._lock:
+            self._maybe_reload()
+            rel = _rel(os.path.realpath(real_path))
+            parent = _rel(os.path.dirname(os.path.realpath(real_path)))
+            changed = False
+            for key in (rel, parent):
+                if self.dirs.pop(key, None) is not None:
+                    changed = True
+            prefix = rel + "/"
+            for key in [k for k in self.dirs if k.startswith(prefix)]:
+                self.dirs.pop(key)
+                changed = True
+            if changed:
+                self._dirty = True
+                self._save()
+
+    # ---------- 列举 ----------
+
+    def _collect(self, rel_dir: str, recursive: bool) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            for entry in self._refresh_dir(current).values():
+                path = entry["name"] if current == "." else f"{current}/{entry['name']}"
+                items.append({**entry, "path": path, "_dir": current})
+                if recursive and entry["is_dir"]:
+                    stack.append(path)
+        return items
+
+    def list(
+        self,
+        real_dir: str,
+        recursive: bool = False,
+        pattern: str = "",
+        sort: str = "name",
+        descending: bool = False,
+        offset: int = 0,
+        limit: int = LIST_DEFAULT_LIMIT,
+        include_hash: bool = False,
+    ) -> Dict[str, Any]:
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort 仅支持 {', '.join(SORT_KEYS)}")
+        if not os.path.isdir(real_dir):
+            raise FileNotFoundError(f"目录不存在：{_rel(real_dir)}")
+        rel_dir = _rel(os.path.realpath(real_dir))
+        offset = max(int(offset or 0), 0)
+        limit = min(max(int(limit or LIST_DEFAULT_LIMIT), 1), LIST_MAX_LIMIT)
+
+        with self._lock:
+            self._maybe_reload()
+            items = self._collect(rel_dir, recursive)
+            if pattern:
+                # 含 / 的模式匹配相对路径，否则只匹配文件名
+                items = [
+                    it
+                    for it in items
+                    if fnmatch.fnmatch(it["path"] if "/" in pattern else it["name"], pattern)
+                ]
+            key_funcs = {
+                "name": lambda it: it["path"].lower(),
+                "size": lambda it: it["size"],
+                "mtime": lambda it: it["mtime"],
+                "type": lambda it: (it["type"], it["path"].lower()),
+            }
+            items.sort(key=key_funcs[sort], reverse=descending)
+            if sort == "name":
+                items.sort(key=lambda it: not it["is_dir"])  # 目录在前（稳定排序保留名称顺序）
+
+            total = len(items)
+            page: List[Dict[str, Any]] = []
+            for it in items[offset : offset + limit]:
+                fresh = self._restat(it["_dir"], {k: v for k, v in it.items() if k not in ("path", "_dir")})
+                if fresh is None:
+                    continue
+                if include_hash and not fresh["is_dir"] and not fresh.get("hash") and fresh["size"] <= HASH_MAX_BYTES:
+                    fresh["hash"] = _content_hash(os.path.join(self.root, it["path"]))
+                    self.dirs.get(it["_dir"], {}).get("entries", {})[fresh["name"]] = fresh
+                    self._dirty = True
+                out = {k: v for k, v in fresh.items() if k != "mtime_ns"}
+                if not include_hash:
+                    out.pop("hash", None)
+                out["path"] = it["path"]
+                if recursive:
+                    # 递归列举时 name 为相对于所列目录的路径，便于前端直接展示
+                    out["name"] = it["path"] if rel_dir == "." else it["path"][len(rel_dir) + 1 :]
+                page.append(out)
+            self._save()
+
+        next_offset = offset + limit if offset + limit < total else None
+        return {
+            "path": rel_dir,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": next_offset,
+            "items": page,
+        }
+
+
+_META: Optional[WorkspaceMetaIndex] = None
+
+
+def get_meta_index() -> WorkspaceMetaIndex:
+    global _META
+    if _META is None:
+        _META = WorkspaceMetaIndex()
+    return _META
+
+
+def invalidate(real_path: str):
+    """文件写入/删除/重命名后调用；失败不影响写入本身。"""
+    try:
+        get_meta_index().invalidate(real_path)
+    except Exception:
+        pass
@@ -0,0 +1,253 @@
+"""
+轻量级请求追踪：基于 contextvars 的 span 树，导出为 OpenTelemetry（OTLP/JSON）兼容格式。
+
+- span(name, **attrs)：上下文管理器，自动挂到当前 span 之下，异常时标记为错误。
+- inject()/extract()：W3C traceparent，经 MCP 请求的 _meta 传递给 MCP server；server 侧的 span 随
+  CallToolResult._meta 回传并并入调用方的 trace，因此 /chat 的耗时分解包含工具进程内的各阶段。
+- 本地根 span 结束时，若 TRACE_EXPORT=file，则把整条 trace 以一行 OTLP JSON 追加到 TRACE_FILE。
+- breakdown()：按 span 名称汇总耗时，供 ChatResponse.timings 使用。
+"""
+
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")  # "" 不导出；file 写入 TRACE_FILE
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "traces.jsonl"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "myagent")
+# 单条 trace 最多保留的 span 数，防止异常循环撑爆内存
+MAX_SPANS_PER_TRACE = 2000
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_service_name = SERVICE_NAME
+_export_lock = threading.Lock()
+
+
+def set_service_name(name: str):
+    global _service_name
+    _service_name = name
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "status", "error", "_trace", "service")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], trace: "_Trace", attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.service = _service_name
+        self._trace = trace
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attrs: Any):
+        self.attributes.update(attrs)
+
+    def record_error(self, exc: BaseException):
+        self.status = "error"
+        self.error = f"{exc.__class__.__name__}: {exc}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """跨进程传递用的紧凑格式。"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+            "service": self.service,
+        }
+
+    def breakdown(self) -> Dict[str, Any]:
+        return breakdown(self._trace.spans, root=self)
+
+
+class _RemoteSpan:
+    """从 traceparent 解析出的远端父 span（仅携带 id）。"""
+
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+
+class _Trace:
+    def __init__(self):
+        self.spans: List[Any] = []  # Span 或导入的 dict
+        self.lock = threading.Lock()
+
+    def add(self, item):
+        with self.lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(item)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, parent: Optional[Any] = None, **attributes: Any) -> Iterator[Span]:
+    """开启一个 span；parent 可传 extract() 的结果以延续远端 trace。"""
+    local_parent = _current.get()
+    if parent is None:
+        parent = local_parent
+    if isinstance(parent, Span):
+        trace = parent._trace
+    else:
+        trace = _Trace()  # 本进程内的新 trace（可能延续远端 trace id）
+    trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+    s = Span(name, trace_id, parent.span_id if parent is not None else None, trace, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as exc:
+        s.record_error(exc)
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current.reset(token)
+        trace.add(s)
+        if not isinstance(parent, Span):
+            _export(trace)
+
+
+def inject() -> Dict[str, str]:
+    """当前 span 的 W3C traceparent，放入 MCP 请求 _meta。"""
+    s = _current.get()
+    if s is None:
+        return {}
+    return {"traceparent": f"00-{s.trace_id}-{s.span_id}-01"}
+
+
+def extract(meta: Any) -> Optional[_RemoteSpan]:
+    """从 MCP 请求 _meta（dict 或 pydantic 模型）中解析 traceparent。"""
+    if meta is None:
+        return None
+    value = meta.get("traceparent") if isinstance(meta, dict) else getattr(meta, "traceparent", None)
+    if not value:
+        return None
+    parts = str(value).split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return _RemoteSpan(parts[1], parts[2])
+
+
+def export_spans(root: Span) -> List[Dict[str, Any]]:
+    """序列化 root（已结束）所在 trace 的全部 span，用于随 MCP 结果回传。"""
+    with root._trace.lock:
+        items = list(root._trace.spans)
+    return [_as_dict(item) for item in items]
+
+
+def import_spans(spans: List[Dict[str, Any]]):
+    """把远端（MCP server）回传的 span 并入当前 trace。"""
+    s = _current.get()
+    if s is None or not spans:
+        return
+    for item in spans:
+        if isinstance(item, dict) and item.get("trace_id") == s.trace_id:
+            s._trace.add(item)
+
+
+def _as_dict(item) -> Dict[str, Any]:
+    return item.to_dict() if isinstance(item, Span) else item
+
+
+def breakdown(spans: List[Any], root: Optional[Span] = None) -> Dict[str, Any]:
+    """按 span 名称汇总次数与累计耗时（毫秒）；total_ms 为根 span 耗时。"""
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for item in spans:
+        d = _as_dict(item)
+        if root is not None and d["span_id"] == root.span_id:
+            continue
+        end = d.get("end_ns") or time.time_ns()
+        entry = by_name.setdefault(d["name"], {"count": 0, "ms": 0.0, "errors": 0})
+        entry["count"] += 1
+        entry["ms"] += (end - d["start_ns"]) / 1e6
+        if d.get("status") == "error":
+            entry["errors"] += 1
+    for entry in by_name.values():
+        entry["ms"] = round(entry["ms"], 1)
+    result: Dict[str, Any] = {"spans": by_name}
+    if root is not None:
+        result["total_ms"] = round(root.duration_ms, 1)
+        result["trace_id"] = root.trace_id
+    return result
+
+
+# ---------- OTLP/JSON 导出 ----------
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)}
+
+
+def to_otlp(spans: List[Any]) -> Dict[str, Any]:
+    by_service: Dict[str, List[Dict[str, Any]]] = {}
+    for item in spans:
+        d = _as_dict(item)
+        otel = {
+            "traceId": d["trace_id"],
+            "spanId": d["span_id"],
+            "name": d["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(d["start_ns"]),
+            "endTimeUnixNano": str(d.get("end_ns") or d["start_ns"]),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in (d.get("attributes") or {}).items()],
+            "status": {"code": 2, "message": d.get("error") or ""} if d.get("status") == "error" else {"code": 1},
+        }
+        if d.get("parent_id"):
+            otel["parentSpanId"] = d["parent_id"]
+        by_service.setdefault(d.get("service") or _service_name, []).append(otel)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                "scopeSpans": [{"scope": {"name": "myagent.tracing"}, "spans": items}],
+            }
+            for service, items in by_service.items()
+        ]
+    }
+
+
+def _export(trace: _Trace):
+    if TRACE_EXPORT != "file":
+        return
+    with trace.lock:
+        # 只导出本进程产生的 span；远端回传的 span 由其所在进程自行导出
+        items = [item for item in trace.spans if isinstance(item, Span)]
+    line = json.dumps(to_otlp(items), ensure_ascii=False)
+    try:
+        with _export_lock:
+            os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError:
+        pass